@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+from taar.context import app_context
+from taar.interfaces import IMozLogging
+from taar.profile_fetcher import BigTableProfileController, build_profile_controller
+from taar.profile_loader import LoadStats, iter_ndjson_profiles, load_profiles, open_profile_dump
+from taar.settings import AppSettings
+import click
+
+
+@click.command()
+@click.argument("paths", nargs=-1, required=True)
+@click.option("--batch-size", default=1000, show_default=True, help="Profiles per mutate_rows call")
+@click.option("--concurrency", default=8, show_default=True, help="Batches written at the same time")
+@click.option(
+    "--binary/--json",
+    default=AppSettings.BIGTABLE_WRITE_BINARY_PROFILES,
+    show_default=True,
+    help="Write compact binary profile records or compressed JSON",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(["bigtable", "sqlite", "memory"]),
+    default=AppSettings.PROFILE_BACKEND,
+    show_default=True,
+    help="Profile database to load into.  memory only parses and encodes profiles.",
+)
+@click.option("--create-table", is_flag=True, help="Create the profile table before loading")
+def main(paths, batch_size, concurrency, binary, backend, create_table):
+    """
+    Bulk load newline delimited JSON client profiles into the profile
+    database.
+
+    PATHS may be plain, .gz or .bz2 files, or - to read from stdin.
+
+    This expects that the following enviroment variables are set:
+
+    BIGTABLE_PROJECT_ID
+    BIGTABLE_INSTANCE_ID
+    BIGTABLE_TABLE_ID
+
+    Set BIGTABLE_EMULATOR_HOST to load into the BigTable emulator.  The
+    sqlite backend writes to PROFILE_SQLITE_PATH instead.
+    """
+    ctx = app_context()
+
+    if backend == "bigtable":
+        controller = BigTableProfileController(
+            ctx,
+            project_id=AppSettings.BIGTABLE_PROJECT_ID,
+            instance_id=AppSettings.BIGTABLE_INSTANCE_ID,
+            table_id=AppSettings.BIGTABLE_TABLE_ID,
+            pool_size=concurrency,
+            binary_profiles=binary,
+        )
+    else:
+        controller = build_profile_controller(ctx, backend=backend, binary_profiles=binary)
+
+    if create_table and hasattr(controller, "create_table"):
+        controller.create_table()
+
+    def progress(stats):
+        if stats.batches % 100 == 0:
+            print(stats)
+
+    logger = ctx[IMozLogging].get_logger("taar")
+    for path in paths:
+        stats = LoadStats()
+        with open_profile_dump(path) as lines:
+            load_profiles(
+                controller,
+                iter_ndjson_profiles(lines, stats=stats, logger=logger),
+                batch_size=batch_size,
+                concurrency=concurrency,
+                progress=progress,
+                logger=logger,
+                stats=stats,
+            )
+        print(f"{path}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
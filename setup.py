@@ -29,6 +29,6 @@ setup(
     [taarapi_app]
     app=taar.plugin:configure_plugin
     """,
-    scripts=["bin/taar-redis.py"],
+    scripts=["bin/taar-redis.py", "bin/taar-load-profiles.py"],
     zip_safe=False,
 )
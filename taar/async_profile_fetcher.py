@@ -0,0 +1,180 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+asyncio variants of the profile controller and fetcher.
+
+The BigTable client only exposes a blocking API, so reads are run on
+a thread pool.  Each read is bounded by a hard timeout and an optional
+hedged second read is issued when the first read is slower than a
+percentile of recently observed read latencies.
+"""
+
+import asyncio
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import markus
+import numpy as np
+
+from taar.interfaces import IMozLogging
+from taar.profile_fetcher import PROFILE_UNAVAILABLE, ProfileFetcher
+from taar.settings import AppSettings
+
+metrics = markus.get_metrics("taar")
+
+
+class AsyncProfileController:
+    """
+    Wrap a blocking profile controller such as
+    BigTableProfileController for use from asyncio.
+
+    Note that a timed out or losing hedged read can't be interrupted,
+    it will run to completion on its worker thread and the result is
+    discarded.
+    """
+
+    # Don't hedge until we've seen enough reads to have a meaningful
+    # latency percentile
+    MIN_HEDGE_SAMPLES = 20
+
+    def __init__(
+        self,
+        ctx,
+        controller,
+        timeout=None,
+        hedge_percentile=None,
+        hedge_min_delay=None,
+        executor=None,
+    ):
+        self._ctx = ctx
+        self.logger = self._ctx[IMozLogging].get_logger("taar")
+        self._controller = controller
+
+        self._timeout = AppSettings.BIGTABLE_TIMEOUT if timeout is None else timeout
+        self._hedge_percentile = (
+            AppSettings.BIGTABLE_HEDGE_PERCENTILE
+            if hedge_percentile is None
+            else hedge_percentile
+        )
+        self._hedge_min_delay = (
+            AppSettings.BIGTABLE_HEDGE_MIN_DELAY
+            if hedge_min_delay is None
+            else hedge_min_delay
+        )
+
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=AppSettings.BIGTABLE_CHANNEL_POOL_SIZE * 2,
+                thread_name_prefix="taar-bigtable",
+            )
+        self._executor = executor
+
+        self._latencies = collections.deque(maxlen=1000)
+
+    def hedge_delay(self):
+        """
+        Return the number of seconds to wait before a hedged read is
+        issued, or None if hedging is disabled.
+        """
+        if self._hedge_percentile <= 0:
+            return None
+        if len(self._latencies) < max(self.MIN_HEDGE_SAMPLES, 1):
+            return None
+        observed = np.percentile(self._latencies, self._hedge_percentile)
+        return max(float(observed), self._hedge_min_delay)
+
+    async def _read(self, client_id):
+        loop = asyncio.get_running_loop()
+        start_time = time.monotonic()
+        result = await loop.run_in_executor(
+            self._executor, self._controller.get_client_profile, client_id
+        )
+        self._latencies.append(time.monotonic() - start_time)
+        return result
+
+    async def _hedged_read(self, client_id):
+        primary = asyncio.ensure_future(self._read(client_id))
+
+        delay = self.hedge_delay()
+        if delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        metrics.incr("bigtable_hedged_read", value=1)
+        hedge = asyncio.ensure_future(self._read(client_id))
+        done, pending = await asyncio.wait(
+            {primary, hedge}, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in pending:
+            task.cancel()
+        return done.pop().result()
+
+    async def get_client_profile(self, client_id):
+        """
+        Returns PROFILE_UNAVAILABLE if the read times out
+        """
+        try:
+            if self._timeout > 0:
+                return await asyncio.wait_for(
+                    self._hedged_read(client_id), timeout=self._timeout
+                )
+            return await self._hedged_read(client_id)
+        except asyncio.TimeoutError:
+            metrics.incr("bigtable_read_timeout", value=1)
+            self.logger.warning(
+                f"Timed out loading client profile for {client_id}"
+            )
+            return PROFILE_UNAVAILABLE
+
+
+class AsyncProfileFetcher(ProfileFetcher):
+    """
+    A ProfileFetcher which can be awaited with get_async.
+
+    The profile cache is shared with the blocking get method.
+    """
+
+    def __init__(self, ctx):
+        super(AsyncProfileFetcher, self).__init__(ctx)
+        self.__async_client = None
+
+    @property
+    def _async_client(self):
+        if self.__async_client is None:
+            self.__async_client = AsyncProfileController(self._ctx, self._client)
+        return self.__async_client
+
+    def set_client(self, client):
+        super(AsyncProfileFetcher, self).set_client(client)
+        self.__async_client = None
+
+    async def get_async(self, client_id):
+        hit, profile = self._get_cached(client_id)
+        if hit:
+            return profile
+
+        with metrics.timer("bigtable_read"):
+            try:
+                profile_data = await self._async_client.get_client_profile(client_id)
+                if profile_data is None:
+                    self.logger.debug(
+                        "Client profile not found", extra={"client_id": client_id}
+                    )
+                    profile = None
+                elif profile_data is PROFILE_UNAVAILABLE:
+                    profile = PROFILE_UNAVAILABLE
+                else:
+                    profile = self._remap_profile(client_id, profile_data)
+            except Exception as e:
+                # We just want to catch any kind of error here to make
+                # sure nothing breaks
+                self.logger.error("Error loading client data", e)
+                profile = PROFILE_UNAVAILABLE
+
+        return self._cache_profile(client_id, profile)
@@ -0,0 +1,164 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+The client profile handed to the recommenders.
+
+ClientProfile stores the profile fields in slots and lazily builds the
+derived structures the recommenders need (the continuous feature
+vector, the categorical features and the set of installed addons).
+Those are computed once per cached profile rather than once per
+recommender per request.
+
+ClientProfile behaves like the dict it replaces so existing callers
+which use get(), [] and `in` keep working.
+"""
+
+import numpy as np
+
+CATEGORICAL_FEATURES = ["geo_city", "locale", "os"]
+CONTINUOUS_FEATURES = [
+    "subsession_length",
+    "bookmark_count",
+    "tab_open_count",
+    "total_uri",
+    "unique_tlds",
+]
+
+PROFILE_FIELDS = (
+    ["client_id"]
+    + CATEGORICAL_FEATURES
+    + CONTINUOUS_FEATURES
+    + ["installed_addons", "disabled_addons_ids"]
+)
+
+# Marks a profile field which was never set
+_MISSING = object()
+
+_DERIVED_SLOTS = ("_continuous", "_categorical", "_installed_set")
+
+
+class ClientProfile:
+    __slots__ = tuple(PROFILE_FIELDS) + ("_extra",) + _DERIVED_SLOTS
+
+    def __init__(self, *args, **kwargs):
+        for field in PROFILE_FIELDS:
+            object.__setattr__(self, field, _MISSING)
+        self._extra = {}
+        self._invalidate()
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def _invalidate(self):
+        self._continuous = None
+        self._categorical = None
+        self._installed_set = None
+
+    @property
+    def continuous_features(self):
+        """
+        The continuous features as a 1 x N float array ready to be
+        passed to scipy.spatial.distance.cdist
+        """
+        if self._continuous is None:
+            values = [self.get(k) for k in CONTINUOUS_FEATURES]
+            self._continuous = np.array([values], dtype=float)
+        return self._continuous
+
+    @property
+    def categorical_features(self):
+        if self._categorical is None:
+            self._categorical = [self.get(k) for k in CATEGORICAL_FEATURES]
+        return self._categorical
+
+    @property
+    def installed_addon_set(self):
+        if self._installed_set is None:
+            self._installed_set = frozenset(self.get("installed_addons") or [])
+        return self._installed_set
+
+    # dict compatibility
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            value = object.__getattribute__(self, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            object.__setattr__(self, key, value)
+            self._invalidate()
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET:
+            if object.__getattribute__(self, key) is _MISSING:
+                raise KeyError(key)
+            object.__setattr__(self, key, _MISSING)
+            self._invalidate()
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return object.__getattribute__(self, key) is not _MISSING
+        return key in self._extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [k for k, _ in self.items()]
+
+    def values(self):
+        return [v for _, v in self.items()]
+
+    def items(self):
+        result = [
+            (k, object.__getattribute__(self, k))
+            for k in PROFILE_FIELDS
+            if object.__getattribute__(self, k) is not _MISSING
+        ]
+        result.extend(self._extra.items())
+        return result
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (ClientProfile, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f"ClientProfile({dict(self.items())!r})"
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def copy(self):
+        """
+        Return a shallow copy.  The derived features are shared with
+        the copy until either profile is modified.
+        """
+        result = ClientProfile.__new__(ClientProfile)
+        for slot in ClientProfile.__slots__:
+            object.__setattr__(result, slot, object.__getattribute__(self, slot))
+        result._extra = dict(self._extra)
+        return result
+
+    __hash__ = None
+
+
+_FIELD_SET = frozenset(PROFILE_FIELDS)
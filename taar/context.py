@@ -105,6 +105,7 @@ def app_context():
     from taar.settings import AppSettings, DefaultCacheSettings, RedisCacheSettings
     from taar.recommenders.cache import TAARCache
     from taar.recommenders.redis_cache import TAARCacheRedis
+    from taar.recommenders.result_cache import build_result_cache
     from taar.logs.moz_logging import Logging
 
     ctx = Context()
@@ -120,6 +121,8 @@ def app_context():
         ctx['cache_settings'] = RedisCacheSettings
         ctx[ITAARCache] = TAARCacheRedis.get_instance(ctx)
 
+    ctx["result_cache"] = build_result_cache(AppSettings)
+
     from taar.recommenders import CollaborativeRecommender
     from taar.recommenders import SimilarityRecommender
     from taar.recommenders import LocaleRecommender
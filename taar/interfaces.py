@@ -32,3 +32,14 @@ class ITAARCache(ABC):
 
     def cache_context(self):
         raise NotImplementedError()
+
+    def cache_generation(self):
+        """Return an opaque token identifying the currently loaded
+        model data, or None if no data is loaded
+        """
+        raise NotImplementedError()
+
+    def require_data(self, group_names):
+        """Declare the names of the model data groups a recommender
+        reads.  Caches which always load everything can ignore this.
+        """
@@ -253,6 +253,13 @@ def configure_plugin(app):  # noqa: C901
         response = app.response_class(
             response=json.dumps(jdata), status=200, mimetype="application/json"
         )
+
+        if AppSettings.TAAR_SEEDED_RANDOMIZATION and request.method == "GET":
+            # Seeded randomization yields a stable response for each
+            # client within a time bucket, so clients can revalidate
+            # with an ETag.
+            response.add_etag()
+            response = response.make_conditional(request)
         return response
 
     class MyPlugin:
@@ -0,0 +1,178 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Encoding of the client profiles stored in the profile database.
+
+Two encodings are supported:
+
+* legacy cells are zlib compressed JSON of the raw telemetry fields
+* binary cells are a compact, versioned record of the fields the
+  recommenders actually use, already derived from the raw telemetry
+
+Binary records start with a magic prefix which can never be the
+start of a zlib stream, so readers can accept both encodings.
+"""
+
+import json
+import math
+import struct
+import zlib
+
+BINARY_MAGIC = b"TPB"
+BINARY_VERSION = 1
+
+_HEADER = struct.Struct(">3sB")
+_CONTINUOUS = struct.Struct(">5d")
+_STR_LEN = struct.Struct(">H")
+_LIST_LEN = struct.Struct(">I")
+
+# Marks a None string in the binary record
+_NULL_STR_LEN = 0xFFFF
+
+# The order of the continuous fields in the binary record
+BINARY_CONTINUOUS_FIELDS = [
+    "subsession_length",
+    "bookmark_count",
+    "tab_open_count",
+    "total_uri",
+    "unique_tlds",
+]
+BINARY_CATEGORICAL_FIELDS = ["geo_city", "locale", "os"]
+BINARY_LIST_FIELDS = ["installed_addons", "disabled_addons_ids"]
+
+
+class DerivedProfile(dict):
+    """
+    A profile which has already been mapped from raw telemetry
+    fields into the fields used by the recommenders
+    """
+
+    pass
+
+
+def derive_profile(profile_data):
+    """
+    Convert the raw telemetry fields of a profile into the fields
+    used by the recommenders
+    """
+    addon_ids = [
+        addon["addon_id"]
+        for addon in profile_data.get("active_addons", [])
+        if not addon.get("is_system", False)
+    ]
+
+    return DerivedProfile(
+        geo_city=profile_data.get("city", ""),
+        subsession_length=profile_data.get("subsession_length", 0),
+        locale=profile_data.get("locale", ""),
+        os=profile_data.get("os", ""),
+        installed_addons=addon_ids,
+        disabled_addons_ids=profile_data.get("disabled_addons_ids", []),
+        bookmark_count=profile_data.get("places_bookmarks_count", 0),
+        tab_open_count=profile_data.get(
+            "scalar_parent_browser_engagement_tab_open_event_count", 0
+        ),
+        total_uri=profile_data.get(
+            "scalar_parent_browser_engagement_total_uri_count", 0
+        ),
+        unique_tlds=profile_data.get(
+            "scalar_parent_browser_engagement_unique_domains_count", 0
+        ),
+    )
+
+
+def _pack_str(value, chunks):
+    if value is None:
+        chunks.append(_STR_LEN.pack(_NULL_STR_LEN))
+        return
+    encoded = value.encode("utf8")
+    if len(encoded) >= _NULL_STR_LEN:
+        raise ValueError(f"String is too long for a binary profile: {value[:32]}...")
+    chunks.append(_STR_LEN.pack(len(encoded)))
+    chunks.append(encoded)
+
+
+def _unpack_str(buf, offset):
+    (length,) = _STR_LEN.unpack_from(buf, offset)
+    offset += _STR_LEN.size
+    if length == _NULL_STR_LEN:
+        return None, offset
+    end = offset + length
+    return buf[offset:end].decode("utf8"), end
+
+
+def encode_binary_profile(derived):
+    """
+    Pack a derived profile into a binary profile record
+    """
+    chunks = [_HEADER.pack(BINARY_MAGIC, BINARY_VERSION)]
+
+    continuous = [derived.get(k) for k in BINARY_CONTINUOUS_FIELDS]
+    chunks.append(
+        _CONTINUOUS.pack(*[math.nan if v is None else float(v) for v in continuous])
+    )
+
+    for key in BINARY_CATEGORICAL_FIELDS:
+        _pack_str(derived.get(key), chunks)
+
+    for key in BINARY_LIST_FIELDS:
+        values = derived.get(key) or []
+        chunks.append(_LIST_LEN.pack(len(values)))
+        for value in values:
+            _pack_str(value, chunks)
+
+    return b"".join(chunks)
+
+
+def decode_binary_profile(buf):
+    """
+    Unpack a binary profile record into a DerivedProfile
+    """
+    magic, version = _HEADER.unpack_from(buf, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary profile version: {version}")
+    offset = _HEADER.size
+
+    result = DerivedProfile()
+    continuous = _CONTINUOUS.unpack_from(buf, offset)
+    offset += _CONTINUOUS.size
+    for key, value in zip(BINARY_CONTINUOUS_FIELDS, continuous):
+        result[key] = None if math.isnan(value) else value
+
+    for key in BINARY_CATEGORICAL_FIELDS:
+        result[key], offset = _unpack_str(buf, offset)
+
+    for key in BINARY_LIST_FIELDS:
+        (count,) = _LIST_LEN.unpack_from(buf, offset)
+        offset += _LIST_LEN.size
+        values = []
+        for i in range(count):
+            value, offset = _unpack_str(buf, offset)
+            values.append(value)
+        result[key] = values
+
+    return result
+
+
+def encode_profile(client_profile, binary=False):
+    """
+    Encode a raw client profile into the value stored in a profile
+    cell
+    """
+    if binary:
+        return encode_binary_profile(derive_profile(client_profile))
+    return zlib.compress(json.dumps(client_profile).encode("utf8"))
+
+
+def decode_profile(value):
+    """
+    Decode the value of a profile cell.
+
+    Legacy cells decode to the raw client profile, binary records
+    decode to a DerivedProfile.
+    """
+    if value[: len(BINARY_MAGIC)] == BINARY_MAGIC:
+        return decode_binary_profile(value)
+    return json.loads(zlib.decompress(value).decode("utf-8"))
@@ -6,22 +6,37 @@ from taar.interfaces import IMozLogging
 from google.cloud import bigtable
 from google.cloud.bigtable import column_family
 from google.cloud.bigtable import row_filters
-import json
-import zlib
+from google.cloud.bigtable.row_set import RowSet
 import datetime
+import itertools
+import sqlite3
+import threading
 import markus
 
+from taar.client_profile import ClientProfile
+from taar.profile_codec import DerivedProfile, decode_profile, derive_profile, encode_profile
 from taar.settings import AppSettings
+from taar.utils import LRUTTLCache
 
 metrics = markus.get_metrics("taar")
 
+# Marker for clients known to have no profile
+PROFILE_NOT_FOUND = object()
+
+# Returned by the profile controllers in place of a profile that could
+# not be read because of an error.  Unlike a missing profile (None)
+# this is never cached.
+PROFILE_UNAVAILABLE = object()
+
 
 class BigTableProfileController:
     """
     This class implements the profile database in BigTable
     """
 
-    def __init__(self, ctx, project_id, instance_id, table_id):
+    def __init__(
+        self, ctx, project_id, instance_id, table_id, pool_size=1, binary_profiles=False
+    ):
         self._ctx = ctx
         self._project_id = project_id
         self._instance_id = instance_id
@@ -36,8 +51,26 @@ class BigTableProfileController:
             rules=[max_age_rule, max_versions_rule]
         )
 
-        self._client = bigtable.Client(project=project_id, admin=False)
-        self._instance = self._client.instance(self._instance_id)
+        # Every client owns its own gRPC channel.  Keep a pool of
+        # long-lived table handles, one per channel, and hand them out
+        # round robin so concurrent request threads don't all queue
+        # up on a single channel.
+        self._tables = []
+        for _ in range(max(pool_size, 1)):
+            client = bigtable.Client(project=project_id, admin=False)
+            instance = client.instance(self._instance_id)
+            self._tables.append(instance.table(self._table_id))
+        self._table_counter = itertools.count()
+
+        # Only ever read the most recent cell
+        self._row_filter = row_filters.CellsColumnLimitFilter(1)
+
+        # Write compact binary records instead of compressed JSON.
+        # Both encodings are always accepted on read.
+        self._binary_profiles = binary_profiles
+
+    def _table(self):
+        return self._tables[next(self._table_counter) % len(self._tables)]
 
     def create_table(self):
         # admin needs to be set to True here so that we can create the
@@ -51,36 +84,273 @@ class BigTableProfileController:
         table.create(column_families=column_families)
 
     def set_client_profile(self, client_profile):
+        self.set_client_profiles([client_profile])
 
-        # Keys must be UTF8 encoded
-        row_key = client_profile["client_id"].encode("utf8")
+    def set_client_profiles(self, client_profiles):
+        """Write many client records with a single mutate_rows call.
 
-        table = self._instance.table(self._table_id)
+        Returns the list of client_ids which could not be written.
+        """
+        table = self._table()
+        timestamp = datetime.datetime.utcnow()
 
-        row = table.direct_row(row_key)
-        row.set_cell(
-            self._column_family_id,
-            self._column_name,
-            zlib.compress(json.dumps(client_profile).encode("utf8")),
-            timestamp=datetime.datetime.utcnow(),
-        )
-        table.mutate_rows([row])
+        client_ids = []
+        rows = []
+        for client_profile in client_profiles:
+            client_id = client_profile["client_id"]
+
+            # Keys must be UTF8 encoded
+            row = table.direct_row(client_id.encode("utf8"))
+            row.set_cell(
+                self._column_family_id,
+                self._column_name,
+                encode_profile(client_profile, binary=self._binary_profiles),
+                timestamp=timestamp,
+            )
+            client_ids.append(client_id)
+            rows.append(row)
+
+        if not rows:
+            return []
+
+        statuses = table.mutate_rows(rows)
+        return [
+            client_id
+            for client_id, status in zip(client_ids, statuses)
+            if status.code != 0
+        ]
 
     def get_client_profile(self, client_id):
-        """This fetches a single client record out of GCP BigTable
+        """This fetches a single client record out of GCP BigTable.
+
+        Returns None if the client has no row, or PROFILE_UNAVAILABLE
+        if the row could not be read or decoded.
         """
         try:
             row_key = client_id.encode()
-            table = self._instance.table(self._table_id)
-            row_filter = row_filters.CellsColumnLimitFilter(1)
-            row = table.read_row(row_key, row_filter)
-            cell = row.cells[self._column_family_id][self._column_name][0]
-            jdata = json.loads(zlib.decompress(cell.value).decode("utf-8"))
-            return jdata
+            with metrics.timer("bigtable_read_row"):
+                row = self._table().read_row(row_key, self._row_filter)
+            if row is None:
+                return None
+            with metrics.timer("bigtable_decode_profile"):
+                return self._decode_row(row)
         except Exception:
+            logger = self._ctx[IMozLogging].get_logger("taar")
+            logger.warning(f"Error loading client profile for {client_id}")
+            return PROFILE_UNAVAILABLE
+
+    def get_client_profiles(self, client_ids):
+        """Fetch many client records out of GCP BigTable with a single
+        read_rows call.
+
+        This is a generator of (client_id, profile) 2-tuples which are
+        yielded as rows are streamed back from BigTable.  Clients
+        without a row are yielded last with a profile of None.  Rows
+        which can't be decoded, and every remaining client if the
+        stream fails, are yielded with PROFILE_UNAVAILABLE.
+        """
+        pending = set(client_ids)
+        if not pending:
+            return
+
+        row_set = RowSet()
+        for client_id in pending:
+            row_set.add_row_key(client_id.encode("utf8"))
+
+        missing = None
+        try:
+            for row in self._table().read_rows(row_set=row_set, filter_=self._row_filter):
+                client_id = row.row_key.decode("utf8")
+                pending.discard(client_id)
+                try:
+                    profile = self._decode_row(row)
+                except Exception:
+                    profile = PROFILE_UNAVAILABLE
+                yield client_id, profile
+        except Exception:
+            logger = self._ctx[IMozLogging].get_logger("taar")
+            logger.warning(f"Error streaming {len(pending)} client profiles")
+            missing = PROFILE_UNAVAILABLE
+
+        for client_id in pending:
+            yield client_id, missing
+
+    def _decode_row(self, row):
+        cell = row.cells[self._column_family_id][self._column_name][0]
+        return decode_profile(cell.value)
+
+
+class InMemoryProfileController:
+    """
+    A local stand-in for BigTableProfileController that keeps encoded
+    profiles in a dictionary.  This is useful to exercise the profile
+    read path without access to GCP.
+    """
+
+    def __init__(self, ctx, binary_profiles=False):
+        self._ctx = ctx
+        self._rows = {}
+        self._binary_profiles = binary_profiles
+
+    def set_client_profile(self, client_profile):
+        self._rows[client_profile["client_id"]] = encode_profile(
+            client_profile, binary=self._binary_profiles
+        )
+
+    def set_client_profiles(self, client_profiles):
+        for client_profile in client_profiles:
+            self.set_client_profile(client_profile)
+        return []
+
+    def get_client_profile(self, client_id):
+        value = self._rows.get(client_id)
+        if value is None:
             logger = self._ctx[IMozLogging].get_logger("taar")
             logger.warning(f"Error loading client profile for {client_id}")
             return None
+        return decode_profile(value)
+
+    def get_client_profiles(self, client_ids):
+        missing = []
+        for client_id in dict.fromkeys(client_ids):
+            value = self._rows.get(client_id)
+            if value is None:
+                missing.append(client_id)
+                continue
+            yield client_id, decode_profile(value)
+
+        for client_id in missing:
+            yield client_id, None
+
+
+class SQLiteProfileController:
+    """
+    A profile database in a local SQLite file.  Rows hold the same
+    encoded cells as BigTable, keyed by client_id.
+
+    This makes it possible to measure end to end recommendation
+    latency on a single machine without GCP.
+    """
+
+    MAX_BATCH_SIZE = 500
+
+    def __init__(self, ctx, path, binary_profiles=False):
+        self._ctx = ctx
+        self._path = path
+        self._binary_profiles = binary_profiles
+
+        # sqlite3 connections can't be shared across threads
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA mmap_size=268435456")
+            self._local.conn = conn
+        return conn
+
+    def create_table(self):
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS taar_profile "
+                "(client_id TEXT PRIMARY KEY, payload BLOB NOT NULL) WITHOUT ROWID"
+            )
+
+    def set_client_profile(self, client_profile):
+        self.set_client_profiles([client_profile])
+
+    def set_client_profiles(self, client_profiles):
+        rows = [
+            (
+                client_profile["client_id"],
+                encode_profile(client_profile, binary=self._binary_profiles),
+            )
+            for client_profile in client_profiles
+        ]
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO taar_profile (client_id, payload) VALUES (?, ?)",
+                rows,
+            )
+        return []
+
+    def get_client_profile(self, client_id):
+        try:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT payload FROM taar_profile WHERE client_id = ?", (client_id,)
+                )
+                .fetchone()
+            )
+            if row is None:
+                return None
+            return decode_profile(row[0])
+        except Exception:
+            logger = self._ctx[IMozLogging].get_logger("taar")
+            logger.warning(f"Error loading client profile for {client_id}")
+            return PROFILE_UNAVAILABLE
+
+    def get_client_profiles(self, client_ids):
+        pending = list(dict.fromkeys(client_ids))
+        if not pending:
+            return
+
+        found = set()
+        missing = None
+        try:
+            # Stay well below SQLite's limit on bound parameters
+            for offset in range(0, len(pending), self.MAX_BATCH_SIZE):
+                chunk = pending[offset:offset + self.MAX_BATCH_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self._connection().execute(
+                    f"SELECT client_id, payload FROM taar_profile WHERE client_id IN ({placeholders})",
+                    chunk,
+                )
+                for client_id, payload in cursor:
+                    found.add(client_id)
+                    try:
+                        profile = decode_profile(payload)
+                    except Exception:
+                        profile = PROFILE_UNAVAILABLE
+                    yield client_id, profile
+        except Exception:
+            logger = self._ctx[IMozLogging].get_logger("taar")
+            logger.warning(f"Error reading {len(pending)} client profiles")
+            missing = PROFILE_UNAVAILABLE
+
+        for client_id in pending:
+            if client_id not in found:
+                yield client_id, missing
+
+
+def build_profile_controller(ctx, backend=None, binary_profiles=None):
+    """
+    Construct the profile controller selected by PROFILE_BACKEND
+    """
+    if backend is None:
+        backend = AppSettings.PROFILE_BACKEND
+    if binary_profiles is None:
+        binary_profiles = AppSettings.BIGTABLE_WRITE_BINARY_PROFILES
+
+    if backend == "bigtable":
+        return BigTableProfileController(
+            ctx,
+            project_id=AppSettings.BIGTABLE_PROJECT_ID,
+            instance_id=AppSettings.BIGTABLE_INSTANCE_ID,
+            table_id=AppSettings.BIGTABLE_TABLE_ID,
+            pool_size=AppSettings.BIGTABLE_CHANNEL_POOL_SIZE,
+            binary_profiles=binary_profiles,
+        )
+    elif backend == "sqlite":
+        return SQLiteProfileController(
+            ctx, AppSettings.PROFILE_SQLITE_PATH, binary_profiles=binary_profiles
+        )
+    elif backend == "memory":
+        return InMemoryProfileController(ctx, binary_profiles=binary_profiles)
+    raise ValueError(f"Unknown profile backend: {backend}")
 
 
 class ProfileFetcher:
@@ -93,22 +363,115 @@ class ProfileFetcher:
         self.logger = self._ctx[IMozLogging].get_logger("taar")
         self.__client = None
 
+        self._profile_cache = LRUTTLCache(
+            AppSettings.PROFILE_CACHE_SIZE, AppSettings.PROFILE_CACHE_TTL
+        )
+
     @property
     def _client(self):
         if self.__client is None:
-            self.__client = BigTableProfileController(
-                self._ctx,
-                project_id=AppSettings.BIGTABLE_PROJECT_ID,
-                instance_id=AppSettings.BIGTABLE_INSTANCE_ID,
-                table_id=AppSettings.BIGTABLE_TABLE_ID,
-            )
+            self.__client = build_profile_controller(self._ctx)
         return self.__client
 
     def set_client(self, client):
         self.__client = client
+        self._profile_cache.clear()
 
-    @metrics.timer_decorator("bigtable_read")
     def get(self, client_id):
+        """
+        Return the parsed profile for a client, or None if no profile
+        exists or it could not be read.  Profiles and misses are cached
+        in process, read errors are not.
+        """
+        hit, profile = self._get_cached(client_id)
+        if hit:
+            return profile
+
+        return self._cache_profile(client_id, self._fetch(client_id))
+
+    def get_many(self, client_ids):
+        """
+        Return a generator of (client_id, profile) 2-tuples for many
+        clients.  Clients which are not already cached are read in a
+        single batch from the backing datastore.
+        """
+        to_fetch = []
+        for client_id in dict.fromkeys(client_ids):
+            hit, profile = self._get_cached(client_id)
+            if hit:
+                yield client_id, profile
+            else:
+                to_fetch.append(client_id)
+
+        if not to_fetch:
+            return
+
+        with metrics.timer("bigtable_read_many"):
+            for client_id, profile_data in self._client.get_client_profiles(to_fetch):
+                profile = profile_data
+                if profile_data is not None and profile_data is not PROFILE_UNAVAILABLE:
+                    try:
+                        profile = self._remap_profile(client_id, profile_data)
+                    except Exception:
+                        self.logger.exception(f"Error parsing client data for {client_id}")
+                        profile = PROFILE_UNAVAILABLE
+
+                yield client_id, self._cache_profile(client_id, profile)
+
+    def _get_cached(self, client_id):
+        """
+        Look up a client in the profile cache.  This returns a (hit,
+        profile) 2-tuple where profile is None for clients known to
+        have no profile.
+        """
+        cached = self._profile_cache.get(client_id)
+        if cached is PROFILE_NOT_FOUND:
+            metrics.incr("profile_cache_negative_hit")
+            return True, None
+        elif cached is not None:
+            metrics.incr("profile_cache_hit")
+            # Callers may annotate the profile so hand out a copy
+            return True, cached.copy()
+
+        metrics.incr("profile_cache_miss")
+        return False, None
+
+    def _cache_profile(self, client_id, profile):
+        """
+        Store a freshly fetched profile, or the absence of one, and
+        return a copy for the caller.  PROFILE_UNAVAILABLE is returned
+        to the caller as None without being cached.
+        """
+        if profile is PROFILE_UNAVAILABLE:
+            metrics.incr("profile_fetch_error", value=1)
+            return None
+
+        if profile is None:
+            self._profile_cache.set(
+                client_id, PROFILE_NOT_FOUND, ttl=AppSettings.PROFILE_NEGATIVE_CACHE_TTL
+            )
+            return None
+
+        self._profile_cache.set(client_id, profile)
+        return profile.copy()
+
+    def _remap_profile(self, client_id, profile_data):
+        """
+        Convert the profile stored in the datastore into the
+        ClientProfile used by the recommenders.  Binary profile records
+        are already derived at write time.
+        """
+        if not isinstance(profile_data, DerivedProfile):
+            profile_data = derive_profile(profile_data)
+
+        return ClientProfile(profile_data, client_id=client_id)
+
+    @metrics.timer_decorator("bigtable_read")
+    def _fetch(self, client_id):
+        """
+        Return the ClientProfile for a client, None if it has no
+        profile, or PROFILE_UNAVAILABLE if it could not be read
+        """
         try:
             profile_data = self._client.get_client_profile(client_id)
 
@@ -117,34 +480,12 @@ class ProfileFetcher:
                     "Client profile not found", extra={"client_id": client_id}
                 )
                 return None
+            if profile_data is PROFILE_UNAVAILABLE:
+                return PROFILE_UNAVAILABLE
 
-            addon_ids = [
-                addon["addon_id"]
-                for addon in profile_data.get("active_addons", [])
-                if not addon.get("is_system", False)
-            ]
-
-            return {
-                "client_id": client_id,
-                "geo_city": profile_data.get("city", ""),
-                "subsession_length": profile_data.get("subsession_length", 0),
-                "locale": profile_data.get("locale", ""),
-                "os": profile_data.get("os", ""),
-                "installed_addons": addon_ids,
-                "disabled_addons_ids": profile_data.get("disabled_addons_ids", []),
-                "bookmark_count": profile_data.get("places_bookmarks_count", 0),
-                "tab_open_count": profile_data.get(
-                    "scalar_parent_browser_engagement_tab_open_event_count", 0
-                ),
-                "total_uri": profile_data.get(
-                    "scalar_parent_browser_engagement_total_uri_count", 0
-                ),
-                "unique_tlds": profile_data.get(
-                    "scalar_parent_browser_engagement_unique_domains_count", 0
-                ),
-            }
+            return self._remap_profile(client_id, profile_data)
         except Exception as e:
             # We just want to catch any kind of error here to make
             # sure nothing breaks
             self.logger.error("Error loading client data", e)
-            return None
+            return PROFILE_UNAVAILABLE
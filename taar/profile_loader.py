@@ -0,0 +1,141 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Bulk loading of client profiles into the profile database.
+
+Profiles are streamed from newline delimited JSON dumps, grouped into
+batches and written with one set_client_profiles call per batch.  A
+bounded number of batches are in flight at once so memory use stays
+flat no matter how large the dump is.
+"""
+
+import bz2
+import gzip
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def open_profile_dump(path):
+    """
+    Open a profile dump for reading as text.  Files ending in .gz or
+    .bz2 are decompressed on the fly and "-" reads from stdin.
+    """
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf8")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf8")
+    return open(path, "r", encoding="utf8")
+
+
+def iter_ndjson_profiles(lines, stats=None, logger=None):
+    """
+    Yield one raw client profile for each non-blank line of newline
+    delimited JSON.
+
+    Lines which aren't valid JSON are logged, counted as failed in the
+    optional LoadStats and skipped.
+    """
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            if logger is not None:
+                logger.exception(f"Skipping malformed client profile on line {line_number}")
+            if stats is not None:
+                stats.failed += 1
+
+
+def batched(iterable, size):
+    """
+    Split an iterable into lists of at most size items
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class LoadStats:
+    def __init__(self):
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._start = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self._start
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+        return self.written / elapsed
+
+    def __str__(self):
+        return (
+            f"{self.written} profiles written, {self.failed} failed "
+            f"in {self.batches} batches, {self.elapsed:.1f}s "
+            f"({self.rate:.0f} profiles/s)"
+        )
+
+
+def load_profiles(
+    controller, profiles, batch_size=1000, concurrency=4, progress=None, logger=None, stats=None
+):
+    """
+    Write an iterable of raw client profiles with the controller's
+    set_client_profiles method.
+
+    At most `concurrency` batches are written at the same time.  The
+    optional progress callable is invoked with the LoadStats after
+    every completed batch.  A batch whose write raises is counted as
+    failed and the load carries on with the next one.  Counts are
+    added to stats if one is given, otherwise to a new LoadStats.
+    """
+    if stats is None:
+        stats = LoadStats()
+
+    def record(future, batch_len):
+        try:
+            failed = len(future.result())
+        except Exception:
+            if logger is not None:
+                logger.exception(f"Error writing a batch of {batch_len} client profiles")
+            failed = batch_len
+        stats.batches += 1
+        stats.failed += failed
+        stats.written += batch_len - failed
+        if progress is not None:
+            progress(stats)
+
+    with ThreadPoolExecutor(
+        max_workers=max(concurrency, 1), thread_name_prefix="taar-loader"
+    ) as executor:
+        in_flight = {}
+        for batch in batched(profiles, batch_size):
+            if len(in_flight) >= max(concurrency, 1):
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(future, in_flight.pop(future))
+
+            future = executor.submit(controller.set_client_profiles, batch)
+            in_flight[future] = len(batch)
+
+        for future in list(in_flight):
+            record(future, in_flight.pop(future))
+
+    return stats
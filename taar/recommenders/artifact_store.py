@@ -0,0 +1,214 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Storage backends for the model artifacts loaded by TAARCache.
+
+Artifacts are addressed by a bucket and a key.  Every store can open
+an artifact as a binary stream and describe the version of an
+artifact that it currently holds.  The store is selected with the
+TAAR_ARTIFACT_STORE_URL setting:
+
+* gs://              Google Cloud Storage (the default)
+* file:///some/root  files laid out as /some/root/<bucket>/<key>
+* memory://          an in-process store, mostly useful for tests and
+                     benchmarks
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from urllib.parse import urlparse
+
+from google.cloud import storage
+
+
+class ArtifactStore:
+    def open(self, bucket, key):
+        """
+        Return a context manager which yields a binary stream of the
+        artifact contents
+        """
+        raise NotImplementedError()
+
+    def describe(self, bucket, key):
+        """
+        Return a dict with the 'generation' and 'md5_hash' of the
+        artifact, or None if it doesn't exist.  The generation changes
+        every time the artifact is replaced.
+        """
+        raise NotImplementedError()
+
+
+class GCSArtifactStore(ArtifactStore):
+    """
+    Artifacts in Google Cloud Storage.
+
+    All requests share one lazily created storage client.  If a
+    cache_dir is given, downloads are kept on local disk and reused
+    while their GCS generation and md5 still match.
+    """
+
+    def __init__(self, logger, cache_dir=None):
+        self.logger = logger
+        self._cache_dir = cache_dir
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = storage.Client()
+            return self._client
+
+    def describe(self, bucket, key):
+        blob = self._get_client().bucket(bucket).get_blob(key)
+        if blob is None:
+            return None
+        return {"generation": str(blob.generation), "md5_hash": blob.md5_hash}
+
+    @contextlib.contextmanager
+    def open(self, bucket, key):
+        if self._cache_dir:
+            with open(self._cached_artifact(bucket, key), "rb") as fin:
+                yield fin
+            return
+
+        with tempfile.TemporaryFile() as tmpfile:
+            blob = self._get_client().get_bucket(bucket).blob(key)
+            blob.download_to_file(tmpfile)
+            tmpfile.seek(0)
+            yield tmpfile
+
+    def _cached_artifact(self, bucket, key):
+        """
+        Return the path to an up to date local copy of a GCS object,
+        downloading it only if the cached copy doesn't match the
+        generation and md5 of the object in GCS.
+
+        If GCS can't be reached, a stale cached copy is used.
+        """
+        cache_dir = self._cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_key = hashlib.sha256(f"{bucket}/{key}".encode("utf8")).hexdigest()
+        data_path = os.path.join(cache_dir, cache_key + ".data")
+        meta_path = os.path.join(cache_dir, cache_key + ".meta.json")
+
+        try:
+            with open(meta_path, "r") as fin:
+                cached_meta = json.load(fin)
+        except (OSError, ValueError):
+            cached_meta = None
+        if not os.path.exists(data_path):
+            cached_meta = None
+
+        try:
+            blob = self._get_client().bucket(bucket).get_blob(key)
+        except Exception:
+            if cached_meta is None:
+                raise
+            self.logger.warning(
+                f"Can't reach gcs://{bucket}/{key}, using cached generation {cached_meta['generation']}"
+            )
+            return data_path
+
+        if blob is None:
+            raise FileNotFoundError(f"gcs://{bucket}/{key} does not exist")
+
+        meta = {"generation": str(blob.generation), "md5_hash": blob.md5_hash}
+        if cached_meta == meta:
+            self.logger.info(f"Using cached copy of gcs://{bucket}/{key} generation {blob.generation}")
+            return data_path
+
+        # Download next to the cached copy and atomically replace it so
+        # that concurrent readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=cache_key, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fout:
+                blob.download_to_file(fout)
+            os.replace(tmp_path, data_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=cache_key, suffix=".tmp")
+        with os.fdopen(fd, "w") as fout:
+            json.dump(meta, fout)
+        os.replace(tmp_path, meta_path)
+
+        self.logger.info(f"Cached gcs://{bucket}/{key} generation {blob.generation}")
+        return data_path
+
+
+class FileArtifactStore(ArtifactStore):
+    """
+    Artifacts on a local filesystem laid out as <root>/<bucket>/<key>
+    """
+
+    def __init__(self, root):
+        self._root = root
+
+    def path(self, bucket, key):
+        return os.path.join(self._root, bucket, key)
+
+    def open(self, bucket, key):
+        return open(self.path(bucket, key), "rb")
+
+    def describe(self, bucket, key):
+        try:
+            stat = os.stat(self.path(bucket, key))
+        except FileNotFoundError:
+            return None
+        # Hashing every artifact would cost as much as reading it, so
+        # the generation is derived from the modification time and
+        # size instead.
+        return {"generation": f"{stat.st_mtime_ns}-{stat.st_size}", "md5_hash": None}
+
+
+class MemoryArtifactStore(ArtifactStore):
+    """
+    Artifacts held in process memory
+    """
+
+    def __init__(self):
+        self._artifacts = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def put(self, bucket, key, payload):
+        with self._lock:
+            self._generation += 1
+            self._artifacts[(bucket, key)] = (str(self._generation), payload)
+
+    def open(self, bucket, key):
+        try:
+            _, payload = self._artifacts[(bucket, key)]
+        except KeyError:
+            raise FileNotFoundError(f"memory://{bucket}/{key} does not exist")
+        return io.BytesIO(payload)
+
+    def describe(self, bucket, key):
+        try:
+            generation, payload = self._artifacts[(bucket, key)]
+        except KeyError:
+            return None
+        return {"generation": generation, "md5_hash": hashlib.md5(payload).hexdigest()}
+
+
+def build_artifact_store(url, logger, cache_dir=None):
+    """
+    Construct the artifact store for a TAAR_ARTIFACT_STORE_URL
+    """
+    parsed = urlparse(url or "gs://")
+    if parsed.scheme in ("gs", "gcs"):
+        return GCSArtifactStore(logger, cache_dir=cache_dir or None)
+    elif parsed.scheme == "file":
+        return FileArtifactStore(parsed.netloc + parsed.path)
+    elif parsed.scheme == "memory":
+        return MemoryArtifactStore()
+    raise ValueError(f"Unsupported artifact store: {url}")
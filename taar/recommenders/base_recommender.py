@@ -4,11 +4,14 @@ from abc import ABCMeta, abstractmethod
 class AbstractRecommender:
     """Base class for recommenders.
 
-    Subclasses must implement can_recommend and recommend.
+    Subclasses must implement can_recommend and recommend.  DATA_GROUPS
+    names the model cache update groups the recommender reads.
     """
 
     __metaclass__ = ABCMeta
 
+    DATA_GROUPS = ()
+
     @abstractmethod
     def can_recommend(self, client_data, extra_data={}):
         """Tell whether this recommender can recommend the given client."""
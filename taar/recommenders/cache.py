@@ -1,10 +1,25 @@
 import numpy as np
 import bz2
+import collections
+import contextlib
 import io
 import json
-from google.cloud import storage
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import markus
 
 from taar.interfaces import IMozLogging, ITAARCache
+from taar.recommenders.artifact_store import build_artifact_store
+from taar.recommenders.cache_snapshot import (
+    CacheSnapshot,
+    load_snapshot,
+    save_snapshot,
+    snapshot_lock,
+)
+from taar.recommenders.guid_index import GUID_ID_DTYPE, GuidIndex
+from taar.recommenders.json_stream import iter_json_array_items, iter_json_object_items
 
 # taarlite guid guid coinstallation matrix
 COINSTALL_PREFIX = "coinstall|"
@@ -52,6 +67,116 @@ ENSEMBLE_WEIGHTS = "taar_ensemble_weights|"
 # TAAR: whitelist data
 WHITELIST_DATA = "taar_whitelist_data|"
 
+metrics = markus.get_metrics("taar")
+
+# Number of keys written to the DB at once while loading artifacts
+DB_WRITE_BATCH_SIZE = 1000
+
+# Every model artifact, as the names of the settings holding its
+# bucket and key
+ARTIFACTS = {
+    "ranking": ("TAARLITE_GUID_COINSTALL_BUCKET", "TAARLITE_GUID_RANKING_KEY"),
+    "coinstall": ("TAARLITE_GUID_COINSTALL_BUCKET", "TAARLITE_GUID_COINSTALL_KEY"),
+    "locale": ("TAAR_LOCALE_BUCKET", "TAAR_LOCALE_KEY"),
+    "addon_mapping": ("TAAR_ADDON_MAPPING_BUCKET", "TAAR_ADDON_MAPPING_KEY"),
+    "item_matrix": ("TAAR_ITEM_MATRIX_BUCKET", "TAAR_ITEM_MATRIX_KEY"),
+    "similarity_donors": ("TAAR_SIMILARITY_BUCKET", "TAAR_SIMILARITY_DONOR_KEY"),
+    "similarity_lrcurves": ("TAAR_SIMILARITY_BUCKET", "TAAR_SIMILARITY_LRCURVES_KEY"),
+    "ensemble_weights": ("TAAR_ENSEMBLE_BUCKET", "TAAR_ENSEMBLE_KEY"),
+    "whitelist": ("TAAR_WHITELIST_BUCKET", "TAAR_WHITELIST_KEY"),
+}
+
+# The per-GUID TAARlite tables
+TAARLITE_PREFIXES = (
+    RANKING_PREFIX,
+    MIN_INSTALLS_PREFIX,
+    COINSTALL_PREFIX,
+    FILTERED_COINSTALL_PREFIX,
+    NORMDATA_COUNT_MAP_PREFIX,
+    NORMDATA_ROWCOUNT_PREFIX,
+    NORMDATA_GUID_ROW_NORM_PREFIX,
+)
+
+# A set of artifacts which are loaded together.
+#
+# updates are the _update_* methods which load the artifacts, in
+# order.  prefixes are the keys those methods write to the DB, and
+# context_builder is the method which derives the group's part of the
+# cache context from the DB.
+UpdateGroup = collections.namedtuple(
+    "UpdateGroup", ["name", "artifacts", "updates", "prefixes", "context_builder"]
+)
+
+UPDATE_GROUPS = [
+    # The coinstall data is filtered by the minimum install count
+    # computed from the ranking data
+    UpdateGroup(
+        "taarlite",
+        ("ranking", "coinstall"),
+        ("_update_rank_data", "_update_coinstall_data"),
+        TAARLITE_PREFIXES,
+        None,
+    ),
+    UpdateGroup(
+        "locale",
+        ("locale",),
+        ("_update_locale_data",),
+        (LOCALE_DATA,),
+        "_build_locale_context",
+    ),
+    UpdateGroup(
+        "collaborative",
+        ("item_matrix", "addon_mapping"),
+        ("_update_collab_data",),
+        (COLLAB_ITEM_MATRIX, COLLAB_MAPPING_DATA),
+        "_build_collab_context",
+    ),
+    UpdateGroup(
+        "similarity",
+        ("similarity_donors", "similarity_lrcurves"),
+        ("_update_similarity_data",),
+        (SIMILARITY_DONORS, SIMILARITY_LRCURVES),
+        "_build_similarity_context",
+    ),
+    UpdateGroup(
+        "ensemble",
+        ("ensemble_weights",),
+        ("_update_ensemble_data",),
+        (ENSEMBLE_WEIGHTS,),
+        "_build_ensemble_context",
+    ),
+    UpdateGroup(
+        "whitelist",
+        ("whitelist",),
+        ("_update_whitelist_data",),
+        (WHITELIST_DATA,),
+        "_build_whitelist_context",
+    ),
+]
+
+
+def empty_cache_context():
+    """
+    The cache context handed out before any data is loaded.  Every
+    recommender declines to recommend with it.
+    """
+    return {
+        "lr_curves": None,
+        "num_donors": 0,
+        "continuous_features": None,
+        "categorical_features": None,
+        "donors_pool": None,
+        "addon_mapping": None,
+        "raw_item_matrix": None,
+        "top_addons_per_locale": None,
+        "whitelist": None,
+        "ensemble_weights": None,
+        "collab_model": None,
+        "donor_guid_index": None,
+        "donor_addon_ids": None,
+        "donor_addon_offsets": None,
+    }
+
 
 class TAARCache(ITAARCache):
     _instance = None
@@ -66,15 +191,34 @@ class TAARCache(ITAARCache):
         """
         Don't call this directly - use get_instance instace
         """
-        self._dict_db = {}
+        # The currently published CacheSnapshot
+        self._snapshot = None
+
+        # Held by the one thread loading the first snapshot
+        self._load_lock = threading.Lock()
 
-        self._similarity_num_donors = 0
-        self._similarity_continuous_features = None
-        self._similarity_categorical_features = None
+        # Serializes publishing new snapshots, see _publish
+        self._publish_lock = threading.Lock()
+
+        # The artifacts which failed to load during the snapshot build
+        # running on this thread
+        self._build_errors = threading.local()
+
+        # The names of the update groups required by the recommenders
+        # using this cache, or None to load every group
+        self._required_groups = None
 
         self._ctx = ctx
         self._last_db = None
 
+        # The artifact store is built on first use
+        self._artifact_store = None
+        self._artifact_store_lock = threading.Lock()
+
+        # Background refresh of the snapshot
+        self._refresh_thread = None
+        self._refresh_stop = threading.Event()
+
         self.logger = None
 
         moz_logging = self._ctx.get(IMozLogging)
@@ -89,30 +233,353 @@ class TAARCache(ITAARCache):
 
     # TAARCacheRedis compatibility
 
-    def safe_load_data(self):
-        if len(self._dict_db) == 0:
-            self._copy_data(self._dict_db)
-            self._build_cache_context(self._dict_db)
+    def safe_load_data(self, wait=True):
+        """
+        Load the first snapshot if nothing is loaded yet.
+
+        Only one thread loads the data.  Other threads either block
+        until the load completes or, with wait=False, return
+        immediately.  Returns True if data is loaded.
+        """
+        if self._snapshot is not None:
+            return True
+
+        if not self._load_lock.acquire(blocking=False):
+            if not wait:
+                metrics.incr("cache_not_ready", value=1)
+                return False
+
+            metrics.incr("cache_load_waiter", value=1)
+            with metrics.timer("cache_load_wait"):
+                self._load_lock.acquire()
+
+        try:
+            # The data may have been loaded while we were waiting.  If
+            # that load failed, the next waiter retries it.
+            if self._snapshot is None:
+                manifest = self._build_manifest()
+
+                def build():
+                    with metrics.timer("cache_load"):
+                        return self._build_snapshot(manifest, allow_missing=True)
+
+                self._publish(self._shared_snapshot(manifest, build), None)
+                self.start_refresher()
+        finally:
+            self._load_lock.release()
+        return True
+
+    def _publish(self, snapshot, previous):
+        """
+        Publish snapshot if previous is still the published snapshot.
+
+        Snapshots are built without holding a lock, so another thread
+        may have published in the meantime.  Returns False in that
+        case, and the caller has to rebuild on top of the newer
+        snapshot.
+        """
+        with self._publish_lock:
+            if self._snapshot is not previous:
+                metrics.incr("cache_publish_conflict", value=1)
+                return False
+            self._snapshot = snapshot
+            return True
+
+    def _build_snapshot(self, manifest=None, previous=None, groups=None, allow_missing=False):
+        """
+        Build a new snapshot without modifying anything that is
+        currently published.
+
+        With no previous snapshot every artifact is loaded.  Otherwise
+        the new snapshot starts as a copy of previous and only the
+        update groups listed in groups are reloaded and rederived.
+
+        If an artifact can't be loaded the build fails, unless
+        allow_missing is set.  In that case the artifact is left out
+        of the manifest, so the next refresh loads it again.
+        """
+        failed = self._build_errors.failed = []
+        try:
+            if previous is None:
+                db = {}
+                groups = self._enabled_groups()
+                self._copy_data(db, groups)
+                context = self._build_cache_context(db, groups=groups)
+            else:
+                db = self._copy_db_except(previous.db, [p for g in groups for p in g.prefixes])
+                self._copy_data(db, groups)
+                context = self._build_cache_context(db, groups=groups, previous=previous.context)
+        finally:
+            self._build_errors.failed = None
+
+        if failed:
+            if not allow_missing:
+                raise IOError("Error loading artifacts " + ", ".join(failed))
+            if manifest is not None:
+                manifest = {
+                    name: entry for name, entry in manifest.items()
+                    if f"{entry['bucket']}/{entry['key']}" not in failed
+                }
+        return CacheSnapshot(db, context, f"{time.time():.6f}", manifest)
+
+    def _build_manifest(self, groups=None):
+        """
+        Describe the current version of the artifacts of every enabled
+        update group, or return None if the artifact store can't be
+        queried.
+        """
+        if groups is None:
+            groups = self._enabled_groups()
+        store = self._get_artifact_store()
+        manifest = {}
+        try:
+            for name in [a for g in groups for a in g.artifacts]:
+                bucket, key = self._artifact_location(name)
+                manifest[name] = {"bucket": bucket, "key": key, "info": store.describe(bucket, key)}
+        except Exception:
+            self.logger.warning("Error reading the artifact manifest, all artifacts will be reloaded")
+            return None
+        return manifest
+
+    def _changed_groups(self, previous_manifest, manifest):
+        """
+        Return the enabled update groups with at least one artifact
+        which differs between the two manifests
+        """
+        changed = {
+            name for name in ARTIFACTS if previous_manifest.get(name) != manifest.get(name)
+        }
+        return [g for g in self._enabled_groups() if changed.intersection(g.artifacts)]
+
+    def refresh(self):
+        """
+        Build a new snapshot and publish it.  The current snapshot is
+        kept if the new one can't be built.
+
+        If the current snapshot has a manifest, only the artifacts
+        which changed since it was loaded are reloaded.  If another
+        snapshot is published while this one is built, the refresh
+        starts over from that snapshot.
+        """
+        while True:
+            manifest = self._build_manifest()
+            current = self._snapshot
+
+            previous = None
+            groups = None
+            if current is not None and current.manifest is not None and manifest is not None:
+                groups = self._changed_groups(current.manifest, manifest)
+                if not groups:
+                    metrics.incr("cache_refresh_unchanged", value=1)
+                    self.logger.info("TAAR cache artifacts are unchanged")
+                    return True
+                previous = current
+                self.logger.info(
+                    "Reloading TAAR cache artifacts for " + ", ".join(g.name for g in groups)
+                )
+
+            def build():
+                with metrics.timer("cache_refresh"):
+                    return self._build_snapshot(manifest, previous=previous, groups=groups)
+
+            try:
+                snapshot = self._shared_snapshot(manifest, build)
+            except Exception:
+                self.logger.exception("Error refreshing the TAAR cache, keeping the current data")
+                return False
+
+            if self._publish(snapshot, current):
+                self.logger.info(f"Published TAAR cache generation {snapshot.generation}")
+                return True
+            self.logger.info("TAAR cache changed during the refresh, rebuilding")
+
+    def _shared_snapshot(self, manifest, build):
+        """
+        Return a snapshot for manifest, calling build to create it if
+        no saved snapshot can be used.
+
+        With TAAR_CACHE_SNAPSHOT_DIR set, one process on the host
+        builds and saves the snapshot while the others wait for it.
+        Everyone then loads the saved snapshot, so the model matrices
+        are memory mapped from the same file by every worker.
+        """
+        snapshot_dir = self._settings.TAAR_CACHE_SNAPSHOT_DIR
+        if not snapshot_dir:
+            return build()
+
+        with snapshot_lock(snapshot_dir):
+            snapshot = self._load_saved_snapshot(manifest)
+            if snapshot is None:
+                snapshot = self._save_snapshot(build())
+        return snapshot
+
+    def _load_saved_snapshot(self, manifest):
+        """
+        Return the snapshot saved in TAAR_CACHE_SNAPSHOT_DIR if it was
+        built from the artifacts in manifest, or None
+        """
+        snapshot_dir = self._settings.TAAR_CACHE_SNAPSHOT_DIR
+        if not snapshot_dir:
+            return None
+
+        try:
+            with metrics.timer("cache_warm_start"):
+                snapshot = load_snapshot(snapshot_dir, manifest)
+        except Exception:
+            self.logger.exception("Error loading the saved TAAR cache snapshot")
+            return None
+
+        if snapshot is None:
+            metrics.incr("cache_warm_start_miss", value=1)
+            return None
+
+        self.logger.info(f"Loaded saved TAAR cache generation {snapshot.generation}")
+        return snapshot
+
+    def _save_snapshot(self, snapshot):
+        """
+        Save a snapshot to TAAR_CACHE_SNAPSHOT_DIR and return it
+        reloaded from disk with its matrices and TAARlite tables
+        memory mapped.
+
+        Snapshots without a manifest can't be validated, so they are
+        not saved.  If saving fails the in-memory snapshot is
+        returned.
+        """
+        snapshot_dir = self._settings.TAAR_CACHE_SNAPSHOT_DIR
+        if not snapshot_dir or snapshot.manifest is None:
+            return snapshot
+
+        try:
+            with metrics.timer("cache_snapshot_save"):
+                save_snapshot(snapshot, snapshot_dir, mapped_prefixes=TAARLITE_PREFIXES)
+            return load_snapshot(snapshot_dir, snapshot.manifest) or snapshot
+        except Exception:
+            self.logger.exception("Error saving the TAAR cache snapshot")
+            return snapshot
+
+    def require_data(self, group_names):
+        """
+        Declare the update groups which a recommender reads.
+
+        Until something is declared every group is loaded.  After
+        that only the declared groups are, so a process which only
+        creates some recommenders skips the data of the others.
+        Groups declared after the data was loaded are loaded
+        immediately.  If that load fails the groups are not registered,
+        so declaring them again retries the load.
+        """
+        with self._load_lock:
+            if self._required_groups is None:
+                # Nothing was loaded or everything was
+                self._required_groups = frozenset(group_names)
+                return
+
+            new_names = set(group_names) - self._required_groups
+            if not new_names:
+                return
+            required = self._required_groups
+            self._required_groups = required.union(new_names)
+            try:
+                self._load_required_groups(new_names)
+            except Exception:
+                self._required_groups = required
+                raise
+
+    def _load_required_groups(self, names):
+        """
+        Load the update groups named in names into the published
+        snapshot, if there is one
+        """
+        groups = [g for g in self._enabled_groups() if g.name in names]
+        if not groups:
+            return
+
+        self.logger.info("Loading TAAR cache artifacts for " + ", ".join(g.name for g in groups))
+        while True:
+            current = self._snapshot
+            if current is None:
+                return
+
+            manifest = None
+            if current.manifest is not None:
+                added = self._build_manifest(groups)
+                if added is not None:
+                    manifest = dict(current.manifest, **added)
+
+            def build():
+                with metrics.timer("cache_load"):
+                    return self._build_snapshot(manifest, previous=current, groups=groups)
+
+            if self._publish(self._shared_snapshot(manifest, build), current):
+                return
+
+    def start_refresher(self, interval=None):
+        """
+        Start a daemon thread which refreshes the snapshot every
+        interval seconds.  This is a no-op if the interval is 0 or a
+        refresher is already running.
+        """
+        if interval is None:
+            interval = self._settings.TAAR_CACHE_REFRESH_SECONDS
+        if interval <= 0 or self._refresh_thread is not None:
+            return
+
+        def run():
+            while not self._refresh_stop.wait(interval):
+                self.refresh()
+
+        self._refresh_stop.clear()
+        self._refresh_thread = threading.Thread(target=run, name="taar-cache-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_refresher(self):
+        if self._refresh_thread is None:
+            return
+        self._refresh_stop.set()
+        self._refresh_thread.join()
+        self._refresh_thread = None
+
+    def _current_db(self):
+        if not self.safe_load_data(wait=self._settings.TAAR_CACHE_WAIT_FOR_LOAD):
+            return {}
+        return self._snapshot.db
 
     def _db_get(self, key, default=None, db=None):
-        self.safe_load_data()
-        return (db or self._dict_db).get(key, default)
+        if db is None:
+            db = self._current_db()
+        return db.get(key, default)
 
     def _db_set(self, key, val, db):
-        self._dict_db[key] = val
+        db[key] = val
+
+    def _db_set_many(self, items, db):
+        """
+        Write an iterable of (key, value) pairs
+        """
+        db.update(items)
 
     def is_active(self):
         """
         return True if data is loaded
         """
-        return len(self._dict_db) > 0
+        return self._snapshot is not None
 
     def ensure_db_loaded(self):
         self.safe_load_data()
 
     def cache_context(self):
-        self.ensure_db_loaded()
-        return self._cache_context
+        if not self.safe_load_data(wait=self._settings.TAAR_CACHE_WAIT_FOR_LOAD):
+            return empty_cache_context()
+        return self._snapshot.context
+
+    def cache_generation(self):
+        """
+        The in-memory cache is stamped with the time the data was
+        loaded
+        """
+        snapshot = self._snapshot
+        return snapshot.generation if snapshot is not None else None
 
     # Getters
 
@@ -196,23 +663,20 @@ class TAARCache(ITAARCache):
         """
         precomputed similarity recommender continuous features cache
         """
-        self.ensure_db_loaded()
-        return self._similarity_continuous_features
+        return self.cache_context()["continuous_features"]
 
     def similarity_categorical_features(self):
         """
         precomputed similarity recommender categorical features cache
         """
-        self.ensure_db_loaded()
-        return self._similarity_categorical_features
+        return self.cache_context()["categorical_features"]
 
     @property
     def similarity_num_donors(self):
         """
         precomputed similarity recommender categorical features cache
         """
-        self.ensure_db_loaded()
-        return self._similarity_num_donors
+        return self.cache_context()["num_donors"]
 
     def ensemble_weights(self):
         return self._db_get(ENSEMBLE_WEIGHTS)
@@ -220,92 +684,151 @@ class TAARCache(ITAARCache):
     def whitelist_data(self):
         return self._db_get(WHITELIST_DATA)
 
-    # GCS fetching
+    # Artifact fetching
+
+    def _artifact_location(self, name):
+        """
+        Return the (bucket, key) of an artifact
+        """
+        bucket_setting, key_setting = ARTIFACTS[name]
+        return getattr(self._settings, bucket_setting), getattr(self._settings, key_setting)
+
+    def _get_artifact_store(self):
+        with self._artifact_store_lock:
+            if self._artifact_store is None:
+                self._artifact_store = self._ctx.get("artifact_store") or build_artifact_store(
+                    self._settings.TAAR_ARTIFACT_STORE_URL,
+                    self.logger,
+                    cache_dir=self._settings.TAAR_ARTIFACT_CACHE_DIR,
+                )
+            return self._artifact_store
+
+    @contextlib.contextmanager
+    def _open_artifact(self, bucket, path):
+        """
+        Yield a binary stream of the contents of an artifact.
 
-    def _load_from_gcs(self, bucket, path):
+        If the path ends with '.bz2', the stream is decompressed as it
+        is read.
         """
-        Load a JSON object off of a GCS bucket and path.
+        with self._get_artifact_store().open(bucket, path) as fin:
+            if path.endswith(".bz2"):
+                with bz2.BZ2File(fin) as bz2_fin:
+                    yield bz2_fin
+            else:
+                yield fin
+
+    def _load_artifact(self, bucket, path):
+        """
+        Load a JSON object off of an artifact store bucket and path.
 
         If the path ends with '.bz2', decompress the object prior to JSON
         decode.
         """
         try:
-            with io.BytesIO() as tmpfile:
-                client = storage.Client()
-                bucket = client.get_bucket(bucket)
-                blob = bucket.blob(path)
-                blob.download_to_file(tmpfile)
-                tmpfile.seek(0)
-                payload = tmpfile.read()
-
-                if path.endswith(".bz2"):
-                    payload = bz2.decompress(payload)
-                    path = path[:-4]
-
-                if path.endswith(".json"):
-                    payload = json.loads(payload.decode("utf8"))
-
-                return payload
+            with self._open_artifact(bucket, path) as fin:
+                name = path[:-4] if path.endswith(".bz2") else path
+
+                if name.endswith(".json"):
+                    return json.load(io.TextIOWrapper(fin, encoding="utf8"))
+
+                return fin.read()
         except Exception:
-            self.logger.exception(f"Error loading from gcs://{bucket}/{path}")
+            self.logger.exception(f"Error loading artifact {bucket}/{path}")
+            self._artifact_failed(bucket, path)
 
         return None
 
+    def _artifact_failed(self, bucket, path):
+        """
+        Record that an artifact could not be loaded by the snapshot
+        build on this thread, if any
+        """
+        failed = getattr(self._build_errors, "failed", None)
+        if failed is not None:
+            failed.append(f"{bucket}/{path}")
+
+    def _stream_artifact(self, bucket, path, iter_items):
+        """
+        Incrementally parse a JSON object or array off of an artifact
+        store bucket and path, yielding one member at a time with
+        iter_items.
+
+        Nothing but the current member and a small read buffer is held
+        in memory.
+        """
+        try:
+            with self._open_artifact(bucket, path) as fin:
+                yield from iter_items(io.TextIOWrapper(fin, encoding="utf8"))
+        except Exception:
+            self.logger.exception(f"Error streaming artifact {bucket}/{path}")
+            self._artifact_failed(bucket, path)
+            raise
+
     def _fetch_coinstall_data(self):
-        return self._load_from_gcs(self._settings.TAARLITE_GUID_COINSTALL_BUCKET,
-                                   self._settings.TAARLITE_GUID_COINSTALL_KEY)
+        """
+        Returns an iterator of (guid, coinstall map) 2-tuples
+        """
+        return self._stream_artifact(*self._artifact_location("coinstall"), iter_json_object_items)
 
     def _fetch_ranking_data(self):
-        return self._load_from_gcs(self._settings.TAARLITE_GUID_COINSTALL_BUCKET,
-                                   self._settings.TAARLITE_GUID_RANKING_KEY)
+        """
+        Returns an iterator of (guid, install count) 2-tuples
+        """
+        return self._stream_artifact(*self._artifact_location("ranking"), iter_json_object_items)
 
     def _fetch_locale_data(self):
-        return self._load_from_gcs(self._settings.TAAR_LOCALE_BUCKET, self._settings.TAAR_LOCALE_KEY)
+        return self._load_artifact(*self._artifact_location("locale"))
 
     def _fetch_collaborative_mapping_data(self):
-        return self._load_from_gcs(self._settings.TAAR_ADDON_MAPPING_BUCKET, self._settings.TAAR_ADDON_MAPPING_KEY)
+        return self._load_artifact(*self._artifact_location("addon_mapping"))
 
     def _fetch_collaborative_item_matrix(self):
-        return self._load_from_gcs(self._settings.TAAR_ITEM_MATRIX_BUCKET, self._settings.TAAR_ITEM_MATRIX_KEY)
+        return self._load_artifact(*self._artifact_location("item_matrix"))
 
     def _fetch_similarity_donors(self):
-        return self._load_from_gcs(self._settings.TAAR_SIMILARITY_BUCKET, self._settings.TAAR_SIMILARITY_DONOR_KEY)
+        try:
+            return list(self._stream_artifact(*self._artifact_location("similarity_donors"),
+                                              iter_json_array_items))
+        except Exception:
+            return None
 
     def _fetch_similarity_lrcurves(self):
-        return self._load_from_gcs(self._settings.TAAR_SIMILARITY_BUCKET, self._settings.TAAR_SIMILARITY_LRCURVES_KEY)
+        return self._load_artifact(*self._artifact_location("similarity_lrcurves"))
 
     def _fetch_ensemble_weights(self):
-        return self._load_from_gcs(self._settings.TAAR_ENSEMBLE_BUCKET, self._settings.TAAR_ENSEMBLE_KEY)
+        return self._load_artifact(*self._artifact_location("ensemble_weights"))
 
     def _fetch_whitelist(self):
-        return self._load_from_gcs(self._settings.TAAR_WHITELIST_BUCKET, self._settings.TAAR_WHITELIST_KEY)
+        return self._load_artifact(*self._artifact_location("whitelist"))
 
     # Data update
 
-    def _build_cache_context(self, db):
-
-        self._build_similarity_features_caches(db)
-
-        """
-        Fetch from redis once per request
+    def _build_cache_context(self, db, groups=None, previous=None):
         """
-        tmp = {
-            # Similarity stuff
-            "lr_curves": self.similarity_lrcurves(),
-            "num_donors": self.similarity_num_donors,
-            "continuous_features": self.similarity_continuous_features(),
-            "categorical_features": self.similarity_categorical_features(),
-            "donors_pool": self.similarity_donors(),
-            # Collaborative
-            "addon_mapping": self.collab_addon_mapping(),
-            "raw_item_matrix": self.collab_raw_item_matrix(),
-            # Locale
-            "top_addons_per_locale": self.top_addons_per_locale(),
-            # Ensemble
-            "whitelist": self.whitelist_data(),
-            "ensemble_weights": self.ensemble_weights(),
-        }
+        Build the context handed to the recommenders from db.  This is
+        fetched once per request.
 
+        By default the context is built from every update group.  If
+        a previous context is given, only the parts derived from the
+        listed update groups are rebuilt and the rest is reused.
+        """
+        if previous is None:
+            tmp = empty_cache_context()
+            if groups is None:
+                groups = UPDATE_GROUPS
+        else:
+            tmp = dict(previous)
+
+        for group in groups:
+            if group.context_builder is not None:
+                tmp.update(getattr(self, group.context_builder)(db))
+        return tmp
+
+    def _build_locale_context(self, db):
+        return {"top_addons_per_locale": self._db_get(LOCALE_DATA, db=db)}
+
+    def _build_collab_context(self, db):
         def compute_collab_model(val):
             if val not in (None, ""):
                 num_rows = len(val)
@@ -318,16 +841,70 @@ class TAARCache(ITAARCache):
                 model = None
             return model
 
-        tmp["collab_model"] = compute_collab_model(tmp["raw_item_matrix"])
-        self._cache_context = tmp
+        raw_item_matrix = self._db_get(COLLAB_ITEM_MATRIX, db=db)
+        return {
+            "addon_mapping": self._db_get(COLLAB_MAPPING_DATA, db=db),
+            "raw_item_matrix": raw_item_matrix,
+            "collab_model": compute_collab_model(raw_item_matrix),
+        }
 
-    def _build_similarity_features_caches(self, db):
+    def _build_similarity_context(self, db):
+        (
+            num_donors,
+            continuous_features,
+            categorical_features,
+        ) = self._build_similarity_features_caches(db)
+
+        donors_pool = self._db_get(SIMILARITY_DONORS, db=db)
+        return {
+            "lr_curves": self._db_get(SIMILARITY_LRCURVES, db=db),
+            "num_donors": num_donors,
+            "continuous_features": continuous_features,
+            "categorical_features": categorical_features,
+            "donors_pool": donors_pool,
+            **self._build_donor_addon_ids(donors_pool),
+        }
+
+    def _build_donor_addon_ids(self, donors_pool):
+        """
+        Flatten the active addons of every donor into one array of
+        ids from a GuidIndex of the donors' addons.  The addons of
+        donor i are
+        donor_addon_ids[donor_addon_offsets[i]:donor_addon_offsets[i + 1]].
+
+        The index only covers the current donors and is rebuilt along
+        with them.  The donors' active_addons lists are removed once
+        they are converted, so each GUID string is only held once, by
+        the index.
         """
-        This function build two feature cache matrices and sets the
-        number of donors (self.similarity_num_donors)
+        if donors_pool is None:
+            return {"donor_guid_index": None, "donor_addon_ids": None, "donor_addon_offsets": None}
+
+        guid_index = GuidIndex(g for d in donors_pool for g in d.get("active_addons", []))
+        per_donor = [guid_index.ids(d.pop("active_addons", [])) for d in donors_pool]
+        offsets = np.zeros(len(per_donor) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in per_donor], out=offsets[1:])
+        if per_donor:
+            addon_ids = np.concatenate(per_donor)
+        else:
+            addon_ids = np.zeros(0, dtype=GUID_ID_DTYPE)
+        return {
+            "donor_guid_index": guid_index,
+            "donor_addon_ids": addon_ids,
+            "donor_addon_offsets": offsets,
+        }
+
+    def _build_ensemble_context(self, db):
+        return {"ensemble_weights": self._db_get(ENSEMBLE_WEIGHTS, db=db)}
 
-        That's the self.categorical_features and
-        self.continuous_features attributes.
+    def _build_whitelist_context(self, db):
+        return {"whitelist": self._db_get(WHITELIST_DATA, db=db)}
+
+    def _build_similarity_features_caches(self, db):
+        """
+        This function builds two feature cache matrices and returns
+        them with the number of donors as a (num_donors,
+        continuous_features, categorical_features) 3-tuple.
 
         One matrix is for the continuous features and the other is for
         the categorical features. This is needed to speed up the similarity
@@ -339,31 +916,27 @@ class TAARCache(ITAARCache):
 
         donors_pool = self._db_get(SIMILARITY_DONORS, db=db)
         if donors_pool is None:
-            return
+            return 0, None, None
 
-        self._similarity_num_donors = len(donors_pool)
+        num_donors = len(donors_pool)
 
         # Build a numpy matrix cache for the continuous features.
-        continuous_features = np.zeros(
-            (self.similarity_num_donors, len(CONTINUOUS_FEATURES))
-        )
+        continuous_features = np.zeros((num_donors, len(CONTINUOUS_FEATURES)))
 
         for idx, d in enumerate(donors_pool):
             features = [d.get(specified_key) for specified_key in CONTINUOUS_FEATURES]
             continuous_features[idx] = features
-        self._similarity_continuous_features = continuous_features
 
         # Build the cache for categorical features.
         categorical_features = np.zeros(
-            (self.similarity_num_donors, len(CATEGORICAL_FEATURES)), dtype="object",
+            (num_donors, len(CATEGORICAL_FEATURES)), dtype="object",
         )
         for idx, d in enumerate(donors_pool):
             features = [d.get(specified_key) for specified_key in CATEGORICAL_FEATURES]
             categorical_features[idx] = np.array([features], dtype="object")
 
-        self._similarity_categorical_features = categorical_features
-
         self.logger.info("Reconstructed matrices for similarity recommender")
+        return num_donors, continuous_features, categorical_features
 
     def _update_whitelist_data(self, db):
         """
@@ -418,57 +991,113 @@ class TAARCache(ITAARCache):
     def _update_coinstall_data(self, db):
         """
         Load the TAAR Lite GUID GUID coinstallation data
+
+        The coinstall maps are written as they are streamed in, while
+        their entries are collected into parallel arrays.  The
+        normalization tables are then computed from those arrays with
+        NumPy group-bys and written in bulk.
         """
 
         data = self._fetch_coinstall_data()
 
-        items = data.items()
-        len_items = len(items)
+        # This is either a dict or a stream of (guid, coinstalls) items
+        items = data.items() if isinstance(data, dict) else data
 
-        guid_count_map = {}
-        row_count = {}
-        guid_row_norm = {}
+        # Read the threshold once rather than for every coinstall
+        min_installs = self.min_installs(db)
 
-        for i, (guid, coinstalls) in enumerate(items):
+        # Dense ids for the coinstalled GUIDs, in order of first
+        # appearance
+        guid_ids = {}
 
-            tmp = dict(
-                [(k, v) for (k, v) in coinstalls.items() if v >= self.min_installs(db)]
-            )
+        # One entry per coinstall: the coinstalled GUID id and count
+        target_ids = []
+        counts = []
 
-            self._db_set(FILTERED_COINSTALL_PREFIX + guid, tmp, db)
-            rowsum = sum(coinstalls.values())
+        # Number of coinstalls in each row
+        row_lengths = []
 
-            for coinstall_guid, coinstall_count in coinstalls.items():
-                # Capture the total number of time a GUID was
-                # coinstalled with other guids
-                guid_count_map.setdefault(coinstall_guid, 0)
-                guid_count_map[coinstall_guid] += coinstall_count
+        batch = []
+        for i, (guid, coinstalls) in enumerate(items):
+            batch.append(
+                (
+                    FILTERED_COINSTALL_PREFIX + guid,
+                    {k: v for (k, v) in coinstalls.items() if v >= min_installs},
+                )
+            )
+            batch.append((COINSTALL_PREFIX + guid, coinstalls))
 
-                # Capture the unique number of times a GUID is
-                # coinstalled with other guids
-                row_count.setdefault(coinstall_guid, 0)
-                row_count[coinstall_guid] += 1
+            for coinstall_guid in coinstalls:
+                target_ids.append(guid_ids.setdefault(coinstall_guid, len(guid_ids)))
+            counts.extend(coinstalls.values())
+            row_lengths.append(len(coinstalls))
 
-                if coinstall_guid not in guid_row_norm:
-                    guid_row_norm[coinstall_guid] = []
-                guid_row_norm[coinstall_guid].append(1.0 * coinstall_count / rowsum)
+            if len(batch) >= DB_WRITE_BATCH_SIZE:
+                self._db_set_many(batch, db)
+                batch = []
 
-            self._db_set(COINSTALL_PREFIX + guid, coinstalls, db)
             if i % 1000 == 0:
                 self.logger.info(
-                    f"Loaded {i + 1} of {len_items} GUID-GUID coinstall records into redis"
+                    f"Loaded {i + 1} GUID-GUID coinstall records into redis"
                 )
+        self._db_set_many(batch, db)
 
         self.logger.info("guidmaps computed - saving")
 
-        for guid, guid_count in guid_count_map.items():
-            self._db_set(NORMDATA_COUNT_MAP_PREFIX + guid, guid_count, db)
-
-        for coinstall_guid, coinstall_count in row_count.items():
-            self._db_set(NORMDATA_ROWCOUNT_PREFIX + coinstall_guid, coinstall_count, db)
-
-        for coinstall_guid, norm_val in guid_row_norm.items():
-            self._db_set(NORMDATA_GUID_ROW_NORM_PREFIX + coinstall_guid, norm_val, db)
+        target_ids = np.array(target_ids, dtype=np.int64)
+        count_values = counts
+        counts = np.array(count_values)
+        row_lengths = np.array(row_lengths, dtype=np.int64)
+        num_guids = len(guid_ids)
+
+        # The total of each row, spread back over its coinstalls
+        rows = np.repeat(np.arange(len(row_lengths)), row_lengths)
+        row_sums = np.bincount(rows, weights=counts, minlength=len(row_lengths))
+        empty = (row_sums == 0) & (row_lengths > 0)
+        if empty.any():
+            raise ZeroDivisionError(f"{empty.sum()} coinstall rows have a total of 0")
+        row_norms = counts / row_sums[rows]
+
+        # Capture the total number of time a GUID was coinstalled with
+        # other guids
+        guid_counts = np.bincount(target_ids, weights=counts, minlength=num_guids)
+        if counts.dtype.kind in "iu":
+            guid_counts = guid_counts.astype(np.int64).tolist()
+        else:
+            # Totals of GUIDs with only int counts stay ints, even if
+            # other GUIDs have float counts
+            float_counts = np.fromiter(
+                (not isinstance(v, int) for v in count_values), dtype=bool, count=len(count_values)
+            )
+            is_int = np.bincount(target_ids, weights=float_counts, minlength=num_guids) == 0
+            guid_counts = [
+                int(c) if i else c for c, i in zip(guid_counts.tolist(), is_int.tolist())
+            ]
+        del count_values
+
+        # Capture the unique number of times a GUID is coinstalled
+        # with other guids
+        row_counts = np.bincount(target_ids, minlength=num_guids)
+
+        # Group the row norms by coinstalled GUID, keeping them in row
+        # order
+        order = np.argsort(target_ids, kind="stable")
+        guid_row_norms = np.split(row_norms[order], np.cumsum(row_counts)[:-1])
+
+        guids = list(guid_ids)
+        self._db_set_many(
+            zip([NORMDATA_COUNT_MAP_PREFIX + g for g in guids], guid_counts), db
+        )
+        self._db_set_many(
+            zip([NORMDATA_ROWCOUNT_PREFIX + g for g in guids], row_counts.tolist()), db
+        )
+        self._db_set_many(
+            zip(
+                [NORMDATA_GUID_ROW_NORM_PREFIX + g for g in guids],
+                (norms.tolist() for norms in guid_row_norms),
+            ),
+            db,
+        )
 
         self.logger.info("finished saving guidmaps")
 
@@ -476,40 +1105,87 @@ class TAARCache(ITAARCache):
 
         data = self._fetch_ranking_data()
 
-        items = data.items()
-        len_items = len(items)
+        # This is either a dict or a stream of (guid, count) items
+        items = data.items() if isinstance(data, dict) else data
 
+        total = 0
+        num_items = 0
+        batch = []
         for i, (guid, count) in enumerate(items):
-            self._db_set(RANKING_PREFIX + guid, count, db)
+            batch.append((RANKING_PREFIX + guid, count))
+            total += count
+            num_items += 1
+
+            if len(batch) >= DB_WRITE_BATCH_SIZE:
+                self._db_set_many(batch, db)
+                batch = []
 
             if i % 1000 == 0:
-                self.logger.info(f"Loaded {i + 1} of {len_items} GUID ranking into redis")
+                self.logger.info(f"Loaded {i + 1} GUID ranking into redis")
+        self._db_set_many(batch, db)
 
-        min_installs = np.mean(list(data.values())) * 0.05
+        min_installs = (total / num_items if num_items else np.nan) * 0.05
         self._db_set(MIN_INSTALLS_PREFIX, min_installs, db)
 
         self.logger.info(f"Updated MIN_INSTALLS: {min_installs}")
 
-    def _copy_data(self, db):
-
-        # Update TAARlite
-        # it loads a lot of data which we don't need for Ensemble Spark job
-        if not self._settings.DISABLE_TAAR_LITE:
-            self._update_rank_data(db)
-            self._update_coinstall_data(db)
-
-        # Update TAAR locale data
-        self._update_locale_data(db)
-
-        # Update TAAR collaborative data
-        self._update_collab_data(db)
+    def _enabled_groups(self):
+        """
+        Return the update groups loaded with the current settings and
+        the groups required by the recommenders
+        """
+        disabled = set()
+        if self._settings.DISABLE_TAAR_LITE:
+            # it loads a lot of data which we don't need for Ensemble Spark job
+            disabled.add("taarlite")
+        if self._settings.DISABLE_ENSEMBLE:
+            disabled.update(["ensemble", "whitelist"])
+        required = self._required_groups
+        return [
+            g for g in UPDATE_GROUPS
+            if g.name not in disabled and (required is None or g.name in required)
+        ]
+
+    def _copy_db_except(self, db, prefixes):
+        """
+        Copy a snapshot DB into a new dict, leaving out every key
+        under prefixes.  Memory mapped entries are read back into
+        memory until the new snapshot is saved.
+        """
+        prefixes = tuple(prefixes)
+        return {k: v for k, v in db.items() if not k.startswith(prefixes)}
 
-        # Update TAAR similarity data
-        self._update_similarity_data(db)
+    def _copy_data(self, db, groups=None):
+        """
+        Download and preprocess model artifacts into db.  By default
+        every enabled update group is loaded.
 
-        if not self._settings.DISABLE_ENSEMBLE:
-            # Update TAAR ensemble data
-            self._update_ensemble_data(db)
+        Independent update groups are loaded concurrently.  The
+        updates within a group run in order on a single worker.
+        """
+        if groups is None:
+            groups = self._enabled_groups()
+        chains = [[getattr(self, update) for update in group.updates] for group in groups]
+        if not chains:
+            return
 
-            # Update TAAR ensemble data
-            self._update_whitelist_data(db)
+        # Artifact failures are recorded for the build on the calling
+        # thread
+        failed = getattr(self._build_errors, "failed", None)
+
+        def run_chain(chain):
+            self._build_errors.failed = failed
+            try:
+                for update in chain:
+                    update(db)
+            finally:
+                self._build_errors.failed = None
+
+        max_workers = max(min(self._settings.TAAR_ARTIFACT_FETCH_THREADS, len(chains)), 1)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="taar-artifacts") as executor:
+            futures = [executor.submit(run_chain, chain) for chain in chains]
+
+        # Surface the first failure the same way a sequential load
+        # would have
+        for future in futures:
+            future.result()
@@ -0,0 +1,252 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Snapshots of the in-memory TAARCache and their on-disk format.
+
+A saved snapshot lets a worker start without downloading and
+preprocessing the model artifacts again.  Each snapshot is written to
+its own directory under the snapshot root:
+
+    <root>/CURRENT                 name of the latest snapshot directory
+    <root>/LOCK                    held while a snapshot is built
+    <root>/<name>/manifest.json    format version, generation and the
+                                   artifact manifest
+    <root>/<name>/arrays/<key>.npy matrices from the cache context
+    <root>/<name>/data.pickle      the dict DB and the rest of the context
+    <root>/<name>/kv/              DB entries under the mapped prefixes,
+                                   as a SortedKeyStore
+
+CURRENT is replaced atomically once a snapshot is completely written,
+so readers never see a partial snapshot.  A snapshot is only loaded
+if its manifest matches the current artifact manifest.
+
+The matrices are opened read-only with np.load(mmap_mode="r"), so
+every worker process on a host which loads the same snapshot shares
+one copy of them in the page cache.  The same goes for the large
+per-GUID TAARlite tables, which are moved out of the dict DB into a
+memory mapped SortedKeyStore.
+
+The pickle is only ever read from a directory written by TAAR itself,
+never from an untrusted source.
+"""
+
+import contextlib
+import fcntl
+import itertools
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from collections.abc import Mapping
+
+import numpy as np
+
+from taar.recommenders.sorted_key_store import SortedKeyStore, write_sorted_key_store
+
+SNAPSHOT_FORMAT = 6
+
+CURRENT = "CURRENT"
+LOCK = "LOCK"
+MANIFEST_FILE = "manifest.json"
+ARRAYS_DIR = "arrays"
+DATA_FILE = "data.pickle"
+KV_DIR = "kv"
+
+
+class CacheSnapshot:
+    """
+    A complete, immutable generation of the in-memory cache: the
+    dict DB and the cache context derived from it.
+
+    Snapshots are built off to the side and published with a single
+    reference assignment, so requests which already hold a snapshot
+    keep using it while a newer one is swapped in.
+    """
+
+    __slots__ = ("db", "context", "generation", "manifest")
+
+    def __init__(self, db, context, generation, manifest=None):
+        self.db = db
+        self.context = context
+        self.generation = generation
+
+        # The artifact versions this snapshot was loaded from
+        self.manifest = manifest
+
+
+class SnapshotDB(Mapping):
+    """
+    A read-only snapshot DB split between a dict and a memory mapped
+    SortedKeyStore
+    """
+
+    def __init__(self, data, store):
+        self._data = data
+        self._store = store
+
+    def __getitem__(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            return self._store[key]
+
+    def __contains__(self, key):
+        return key in self._data or key in self._store
+
+    def __iter__(self):
+        return itertools.chain(self._data, self._store)
+
+    def __len__(self):
+        return len(self._data) + len(self._store)
+
+
+def _mappable_array(value):
+    """
+    Return value as an array which can be memory mapped, or None.
+
+    Object arrays can't be mapped.  The categorical feature matrix is
+    stored as a fixed width unicode array when it only holds strings;
+    it otherwise stays in the pickle so missing (None) values keep
+    comparing equal to each other.
+    """
+    if not isinstance(value, np.ndarray):
+        return None
+    if value.dtype != object:
+        return value
+    if value.size and all(isinstance(v, str) for v in value.flat):
+        return value.astype(str)
+    return None
+
+
+@contextlib.contextmanager
+def snapshot_lock(root):
+    """
+    Hold an exclusive lock on the snapshot root, so that only one
+    process on the host builds a snapshot at a time
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, LOCK), "a") as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+def save_snapshot(snapshot, root, mapped_prefixes=()):
+    """
+    Write a snapshot under root and make it the current snapshot.
+    DB entries with keys starting with one of mapped_prefixes are
+    written to a SortedKeyStore.  Returns the path of the snapshot
+    directory.
+    """
+    os.makedirs(root, exist_ok=True)
+    path = tempfile.mkdtemp(dir=root, prefix="snapshot-")
+
+    mapped_prefixes = tuple(mapped_prefixes)
+    db = {}
+    mapped = []
+    for key, value in snapshot.db.items():
+        if mapped_prefixes and key.startswith(mapped_prefixes):
+            mapped.append((key, value))
+        else:
+            db[key] = value
+    if mapped:
+        write_sorted_key_store(os.path.join(path, KV_DIR), mapped)
+        del mapped
+
+    arrays = {}
+    context = {}
+    for key, value in snapshot.context.items():
+        array = _mappable_array(value)
+        if array is None:
+            context[key] = value
+        else:
+            arrays[key] = array
+
+    os.mkdir(os.path.join(path, ARRAYS_DIR))
+    for key, array in arrays.items():
+        np.save(os.path.join(path, ARRAYS_DIR, key + ".npy"), array, allow_pickle=False)
+    with open(os.path.join(path, DATA_FILE), "wb") as fout:
+        pickle.dump(
+            {"db": db, "context": context},
+            fout,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+
+    # The manifest is written last, a directory without one is
+    # incomplete
+    with open(os.path.join(path, MANIFEST_FILE), "w") as fout:
+        json.dump(
+            {
+                "format": SNAPSHOT_FORMAT,
+                "generation": snapshot.generation,
+                "manifest": snapshot.manifest,
+            },
+            fout,
+        )
+
+    fd, tmp_current = tempfile.mkstemp(dir=root, prefix=CURRENT)
+    with os.fdopen(fd, "w") as fout:
+        fout.write(os.path.basename(path))
+    os.replace(tmp_current, os.path.join(root, CURRENT))
+
+    _remove_stale_snapshots(root, keep=os.path.basename(path))
+    return path
+
+
+def _remove_stale_snapshots(root, keep):
+    for name in os.listdir(root):
+        if name.startswith("snapshot-") and name != keep:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def read_snapshot_manifest(root):
+    """
+    Return the (path, metadata) of the current snapshot under root,
+    or (None, None) if there is no complete snapshot
+    """
+    try:
+        with open(os.path.join(root, CURRENT), "r") as fin:
+            path = os.path.join(root, fin.read().strip())
+        with open(os.path.join(path, MANIFEST_FILE), "r") as fin:
+            return path, json.load(fin)
+    except (OSError, ValueError):
+        return None, None
+
+
+def load_snapshot(root, manifest):
+    """
+    Load the current snapshot under root if it was built from exactly
+    the artifacts described by manifest.  Returns None otherwise.
+
+    The context matrices and the SortedKeyStore are memory mapped
+    read-only.
+    """
+    if manifest is None:
+        return None
+
+    path, meta = read_snapshot_manifest(root)
+    if meta is None:
+        return None
+    if meta.get("format") != SNAPSHOT_FORMAT or meta.get("manifest") != manifest:
+        return None
+
+    with open(os.path.join(path, DATA_FILE), "rb") as fin:
+        data = pickle.load(fin)
+
+    context = data["context"]
+    arrays_dir = os.path.join(path, ARRAYS_DIR)
+    for filename in os.listdir(arrays_dir):
+        key = filename[: -len(".npy")]
+        context[key] = np.load(os.path.join(arrays_dir, filename), mmap_mode="r", allow_pickle=False)
+
+    db = data["db"]
+    kv_path = os.path.join(path, KV_DIR)
+    if os.path.isdir(kv_path):
+        db = SnapshotDB(db, SortedKeyStore(kv_path))
+
+    return CacheSnapshot(db, context, meta["generation"], manifest)
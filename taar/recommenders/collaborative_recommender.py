@@ -6,6 +6,7 @@ from taar.interfaces import IMozLogging, ITAARCache
 import numpy as np
 import operator as op
 
+from taar.client_profile import ClientProfile
 from taar.recommenders.base_recommender import AbstractRecommender
 
 
@@ -20,6 +21,12 @@ def positive_hash(s):
     return java_string_hashcode(s) & 0x7FFFFF
 
 
+def _installed_addons(client_data):
+    if isinstance(client_data, ClientProfile):
+        return client_data.installed_addon_set
+    return client_data.get("installed_addons", [])
+
+
 class CollaborativeRecommender(AbstractRecommender):
     """ The addon recommendation interface to the collaborative filtering model.
 
@@ -29,12 +36,15 @@ class CollaborativeRecommender(AbstractRecommender):
         dists = recommender.recommend(client_info)
     """
 
+    DATA_GROUPS = ("collaborative",)
+
     def __init__(self, ctx):
         self._ctx = ctx
 
         self.logger = self._ctx[IMozLogging].get_logger("taar")
 
         self._cache = self._ctx[ITAARCache]
+        self._cache.require_data(self.DATA_GROUPS)
 
     def _get_cache(self, extra_data):
         tmp = extra_data.get("cache", None)
@@ -62,10 +72,9 @@ class CollaborativeRecommender(AbstractRecommender):
     def _recommend(self, client_data, limit, extra_data):
         cache = self._get_cache(extra_data)
 
-        installed_addons_as_hashes = [
-            positive_hash(addon_id)
-            for addon_id in client_data.get("installed_addons", [])
-        ]
+        installed_addons_as_hashes = {
+            positive_hash(addon_id) for addon_id in _installed_addons(client_data)
+        }
 
         # Build the query vector by setting the position of the queried addons to 1.0
         # and the other to 0.0.
@@ -7,6 +7,7 @@ import itertools
 import markus
 from sentry_sdk import capture_exception
 
+from taar.client_profile import ClientProfile
 from taar.interfaces import IMozLogging, ITAARCache
 from taar.recommenders.debug import log_timer_debug
 from taar.utils import hasher
@@ -29,11 +30,15 @@ class EnsembleRecommender(AbstractRecommender):
     addons for users.
     """
 
+    # The whitelist is used for test clients
+    DATA_GROUPS = ("ensemble", "whitelist")
+
     def __init__(self, ctx):
         self.RECOMMENDER_KEYS = ["collaborative", "similarity", "locale"]
         self._ctx = ctx
 
         self._redis_cache = self._ctx[ITAARCache]
+        self._redis_cache.require_data(self.DATA_GROUPS)
         self.logger = self._ctx[IMozLogging].get_logger("taar.ensemble")
 
         assert "recommender_factory" in self._ctx
@@ -111,7 +116,10 @@ class EnsembleRecommender(AbstractRecommender):
         """
         cache = self._get_cache(extra_data)
         self.logger.debug("Ensemble recommend invoked")
-        preinstalled_addon_ids = client_data.get("installed_addons", [])
+        if isinstance(client_data, ClientProfile):
+            preinstalled_addon_ids = client_data.installed_addon_set
+        else:
+            preinstalled_addon_ids = set(client_data.get("installed_addons", []))
 
         # Compute an extended limit by adding the length of
         # the list of any preinstalled addons.
@@ -48,11 +48,14 @@ class GuidBasedRecommender:
     # Define recursion levels for guid-ception
     RECURSION_LEVELS = 3
 
+    DATA_GROUPS = ("taarlite",)
+
     def __init__(self, ctx):
         self._ctx = ctx
         self.logger = self._ctx[IMozLogging].get_logger("taarlite")
 
         self._cache = ctx[ITAARCache]
+        self._cache.require_data(self.DATA_GROUPS)
         self.logger.info("GUIDBasedRecommender is initialized")
 
     def cache_ready(self):
@@ -0,0 +1,69 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Dense integer ids for addon GUIDs.
+
+The similarity recommender scores the addons of its donors with
+np.bincount over arrays of GUID ids, and only turns ids back into GUID
+strings for the response.
+"""
+
+import numpy as np
+
+GUID_ID_DTYPE = np.int32
+
+
+class GuidIndex:
+    """
+    An immutable two way mapping between GUIDs and dense int ids,
+    numbered in order of first appearance
+    """
+
+    __slots__ = ("_guids", "_ids")
+
+    def __init__(self, guids=()):
+        self._guids = []
+        self._ids = {}
+        self._add(guids)
+
+    def _add(self, guids):
+        for guid in guids:
+            if guid not in self._ids:
+                self._ids[guid] = len(self._guids)
+                self._guids.append(guid)
+
+    def __len__(self):
+        return len(self._guids)
+
+    def __contains__(self, guid):
+        return guid in self._ids
+
+    def id_of(self, guid, default=None):
+        return self._ids.get(guid, default)
+
+    def guid_of(self, guid_id):
+        return self._guids[guid_id]
+
+    def ids(self, guids):
+        """
+        Return the ids of known GUIDs as an int array, skipping
+        unknown GUIDs
+        """
+        ids = self._ids
+        return np.fromiter(
+            (ids[g] for g in guids if g in ids), dtype=GUID_ID_DTYPE
+        )
+
+    def guids(self, guid_ids):
+        return [self._guids[i] for i in guid_ids]
+
+    # Only the GUID list is pickled, the reverse mapping is rebuilt
+    def __getstate__(self):
+        return (self._guids,)
+
+    def __setstate__(self, state):
+        self._guids = []
+        self._ids = {}
+        self._add(state[0])
@@ -0,0 +1,136 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Incremental parsing of large JSON documents.
+
+The model artifacts are a single top level JSON object or array.
+These helpers read such a document from a text stream in chunks and
+yield one member at a time, so only the current member and a small
+read buffer are held in memory rather than the whole document.
+"""
+
+import json
+
+_WHITESPACE = " \t\n\r"
+
+# Characters which can continue a JSON number
+_NUMBER_CHARS = ".eE+-0123456789"
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+
+class _JSONStreamReader:
+    def __init__(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._fileobj = fileobj
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, min_size=None):
+        """
+        Read more text into the buffer.  Returns False at the end of
+        the stream.
+        """
+        if self._eof:
+            return False
+
+        # Drop everything that has already been consumed
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+        chunk = self._fileobj.read(max(self._chunk_size, min_size or 0))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf += chunk
+        return True
+
+    def peek(self):
+        """
+        Return the next non whitespace character without consuming
+        it, or "" at the end of the stream
+        """
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in JSON stream, found {found!r}")
+        self._pos += 1
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # The value is split across chunks.  Grow the read size
+                # with the buffer so large values aren't re-parsed too
+                # many times.
+                if not self._fill(len(self._buf)):
+                    raise
+                continue
+
+            # A number which reaches the end of the buffer, or stops
+            # at a character which could continue it (as with "1." or
+            # "1e"), may continue in the next chunk
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and not self._eof:
+                if end == len(self._buf) or self._buf[end] in _NUMBER_CHARS:
+                    if self._fill(len(self._buf)):
+                        continue
+
+            self._pos = end
+            return value
+
+
+def iter_json_object_items(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the (key, value) members of a top level JSON object
+    """
+    reader = _JSONStreamReader(fileobj, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+
+    while True:
+        key = reader.decode_value()
+        if not isinstance(key, str):
+            raise ValueError("JSON object keys must be strings")
+        reader.expect(":")
+        yield key, reader.decode_value()
+
+        if reader.peek() == ",":
+            reader.expect(",")
+            continue
+        reader.expect("}")
+        return
+
+
+def iter_json_array_items(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the elements of a top level JSON array
+    """
+    reader = _JSONStreamReader(fileobj, chunk_size)
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+
+    while True:
+        yield reader.decode_value()
+
+        if reader.peek() == ",":
+            reader.expect(",")
+            continue
+        reader.expect("]")
+        return
@@ -19,12 +19,15 @@ class LocaleRecommender(AbstractRecommender):
     may not work.
     """
 
+    DATA_GROUPS = ("locale",)
+
     def __init__(self, ctx):
         self._ctx = ctx
 
         self.logger = self._ctx[IMozLogging].get_logger("taar")
 
         self._cache = self._ctx[ITAARCache]
+        self._cache.require_data(self.DATA_GROUPS)
 
     def _get_cache(self, extra_data):
         tmp = extra_data.get("cache", None)
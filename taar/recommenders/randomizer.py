@@ -1,8 +1,11 @@
 """
-This module re-orders the (GUID, weight) 2-tuples using
-numpy.random.choice
+This module re-orders the (GUID, weight) 2-tuples using weighted
+random sampling without replacement
 """
 
+import hashlib
+import time
+
 import numpy as np
 
 
@@ -18,29 +21,69 @@ def in_experiment(client_id, xp_prob=0.5):
     return int((int_client % 100) < (xp_prob * 100))
 
 
-def reorder_guids(guid_weight_tuples, size=None):
+def seeded_rng(client_id, generation=None, bucket_seconds=3600, now=None):
+    """
+    Return a numpy.random.Generator seeded from the client_id, the
+    cache generation and the current time bucket.
+
+    The same client will get the same random stream for as long as
+    the time bucket and the loaded model data don't change.  A
+    bucket_seconds of 0 pins the stream to the cache generation.
+    """
+    if bucket_seconds > 0:
+        if now is None:
+            now = time.time()
+        bucket = int(now // bucket_seconds)
+    else:
+        bucket = 0
+
+    seed_material = f"{client_id}|{generation}|{bucket}".encode("utf8")
+    digest = hashlib.sha256(seed_material).digest()
+    return np.random.default_rng(int.from_bytes(digest[:8], "little"))
+
+
+def reorder_guids(guid_weight_tuples, size=None, rng=None):
     """
     This reorders (GUID, weight) 2-tuples based on the weight using
     random selection, without replacement.
 
+    Selection uses the Efraimidis-Spirakis exponential keys method:
+    each GUID draws a key of Exp(1) / weight and the GUIDs with the
+    smallest keys are selected in ascending key order.  This is the
+    same distribution as drawing GUIDs one at a time with
+    numpy.random.choice(replace=False, p=...), but only a single
+    vectorized pass is needed.
+
     @size denotes the length of the output.
+    @rng is an optional numpy.random.Generator.  The global numpy
+    random state is used if no generator is passed in.
     """
     if guid_weight_tuples is None or len(guid_weight_tuples) == 0:
         return []
 
-    weights = np.array([weight for (guid, weight) in guid_weight_tuples])
-    guids = [guid for (guid, weight) in guid_weight_tuples]
-    guid_map = dict(zip(guids, guid_weight_tuples))
+    num_guids = len(guid_weight_tuples)
+    weights = np.fromiter(
+        (weight for (guid, weight) in guid_weight_tuples), dtype=float, count=num_guids
+    )
 
     if size is None:
-        size = len(guids)
+        size = num_guids
     else:
-        size = min(size, len(guids))
+        size = min(size, num_guids)
 
-    # Normalize the weights so that they're probabilities
-    # Scale first, weights can be negative (for example, collaborative filtering similarity scores)
+    # Scale first, weights can be negative (for example, collaborative
+    # filtering similarity scores).  The keys are invariant to
+    # normalizing the weights into probabilities so we skip that.
     scaled_weights = weights - np.min(weights) + np.finfo(float).eps
-    probabilities = scaled_weights / np.sum(scaled_weights)
 
-    choices = np.random.choice(guids, size=size, replace=False, p=probabilities)
-    return [guid_map[guid] for guid in choices]
+    if rng is None:
+        rng = np.random
+    keys = rng.standard_exponential(num_guids) / scaled_weights
+
+    if size < num_guids:
+        selected = np.argpartition(keys, size - 1)[:size]
+    else:
+        selected = np.arange(num_guids)
+    selected = selected[np.argsort(keys[selected], kind="stable")]
+
+    return [guid_weight_tuples[idx] for idx in selected]
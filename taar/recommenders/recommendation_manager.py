@@ -2,6 +2,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
 import markus
 
 from taar.interfaces import IMozLogging, ITAARCache
@@ -10,7 +13,9 @@ from taar.recommenders.ensemble_recommender import (
     EnsembleRecommender,
     is_test_client,
 )
-from taar.recommenders.randomizer import reorder_guids
+from taar.recommenders.randomizer import reorder_guids, seeded_rng
+from taar.recommenders.result_cache import result_cache_key
+from taar.settings import AppSettings
 
 metrics = markus.get_metrics("taar")
 
@@ -56,6 +61,52 @@ class RecommendationManager:
 
         self._cache = self._ctx[ITAARCache]
 
+        # Optional cache of the weighted ensemble results
+        self._result_cache = self._ctx.get("result_cache")
+
+        self._seeded_randomization = self._ctx.get(
+            "TAAR_SEEDED_RANDOMIZATION", AppSettings.TAAR_SEEDED_RANDOMIZATION
+        )
+        self._randomization_bucket_seconds = self._ctx.get(
+            "TAAR_RANDOMIZATION_BUCKET_SECONDS",
+            AppSettings.TAAR_RANDOMIZATION_BUCKET_SECONDS,
+        )
+
+        # Profile fetches and, under a request deadline, cache reads
+        # run on this pool
+        self._request_timeout = self._ctx.get(
+            "TAAR_REQUEST_TIMEOUT", AppSettings.TAAR_REQUEST_TIMEOUT
+        )
+        # Under a deadline every request runs both its profile read and
+        # its cache read on the pool, so it gets a thread for each
+        io_threads = AppSettings.TAAR_IO_THREADS
+        if self._request_timeout > 0:
+            io_threads *= 2
+        self._io_executor = ThreadPoolExecutor(
+            max_workers=io_threads, thread_name_prefix="taar-io"
+        )
+
+    def _result_key(self, client_id, generation, extra_data):
+        """
+        Compute the result cache key for this request or None if the
+        results for this request should not be cached.
+        """
+        if self._result_cache is None or is_test_client(client_id):
+            return None
+
+        if generation is None:
+            return None
+        return result_cache_key(generation, client_id, extra_data.get("locale"))
+
+    def _rng(self, client_id, generation):
+        """
+        Return the random generator used to reorder the results for
+        this request, or None to use the global numpy random state.
+        """
+        if not self._seeded_randomization:
+            return None
+        return seeded_rng(client_id, generation, self._randomization_bucket_seconds)
+
     @metrics.timer_decorator("profile_recommendation")
     def recommend(self, client_id, limit, extra_data={}):
         """Return recommendations for the given client.
@@ -69,34 +120,28 @@ class RecommendationManager:
         """
 
         with log_timer_debug("recommmend executed", self.logger):
-            # Read everything from redis now
-            with log_timer_debug("redis read", self.logger):
-                extra_data["cache"] = self._cache.cache_context()
-
-            if is_test_client(client_id):
-                # Just create a stub client_info blob
-                client_info = {
-                    "client_id": client_id,
-                }
-            else:
-                with log_timer_debug("bigtable fetched data", self.logger):
-                    client_info = self.profile_fetcher.get(client_id)
-
-                if client_info is None:
-                    self.logger.warning(
-                        "Defaulting to empty results.  No client info fetched from storage backend."
-                    )
+            deadline = None
+            if self._request_timeout > 0:
+                deadline = time.monotonic() + self._request_timeout
+
+            generation = None
+            if self._result_cache is not None or self._seeded_randomization:
+                generation = self._cache.cache_generation()
+
+            cache_key = self._result_key(client_id, generation, extra_data)
+            results = None
+            if cache_key is not None:
+                results = self._result_cache.get(cache_key)
+
+            if results is None:
+                results = self._recommend_weighted(client_id, extra_data, deadline)
+                if results is None:
                     return []
+                # Don't pin empty results from a crashed ensemble
+                if cache_key is not None and results:
+                    self._result_cache.set(cache_key, results)
 
-            # Fetch back all possible whitelisted addons for this
-            # client
-            extra_data["guid_randomization"] = True
-            whitelist = extra_data["cache"]["whitelist"]
-            results = self._ensemble_recommender.recommend(
-                client_info, len(whitelist), extra_data
-            )
-
-            results = reorder_guids(results, limit)
+            results = reorder_guids(results, limit, rng=self._rng(client_id, generation))
 
             self.logger.info(
                 f"Client recommendations results",
@@ -104,3 +149,84 @@ class RecommendationManager:
             )
 
             return results
+
+    def _await(self, future, deadline):
+        """
+        Return the result of future, raising TimeoutError if it isn't
+        done by the deadline
+        """
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - time.monotonic(), 0)
+        return future.result(timeout=timeout)
+
+    def _deadline_exceeded(self, client_id, what, futures):
+        # Free up the pool for other requests.  Reads which are already
+        # running can't be interrupted, but queued ones are dropped.
+        for future in futures:
+            if future is not None:
+                future.cancel()
+
+        metrics.incr("request_deadline_exceeded", value=1)
+        self.logger.warning(
+            f"Defaulting to empty results.  {what} exceeded the request deadline.",
+            extra={"client_id": client_id},
+        )
+
+    def _recommend_weighted(self, client_id, extra_data, deadline=None):
+        """
+        Compute the full list of weighted ensemble results prior to
+        randomization, or None if no client profile could be found
+        before the deadline.
+        """
+        if is_test_client(client_id):
+            # Just create a stub client_info blob
+            profile_future = None
+            client_info = {
+                "client_id": client_id,
+            }
+        else:
+            # Start the BigTable read and read the cache while it is
+            # in flight.
+            profile_future = self._io_executor.submit(self.profile_fetcher.get, client_id)
+
+        # Read everything from redis now
+        with log_timer_debug("redis read", self.logger):
+            if deadline is None:
+                extra_data["cache"] = self._cache.cache_context()
+            else:
+                context_future = self._io_executor.submit(self._cache.cache_context)
+                try:
+                    extra_data["cache"] = self._await(context_future, deadline)
+                except TimeoutError:
+                    self._deadline_exceeded(
+                        client_id, "Model cache read", [context_future, profile_future]
+                    )
+                    return None
+
+        if profile_future is not None:
+            with log_timer_debug("bigtable fetched data", self.logger):
+                try:
+                    client_info = self._await(profile_future, deadline)
+                except TimeoutError:
+                    self._deadline_exceeded(client_id, "Profile fetch", [profile_future])
+                    return None
+
+            if client_info is None:
+                self.logger.warning(
+                    "Defaulting to empty results.  No client info fetched from storage backend."
+                )
+                return None
+
+        # Fetch back all possible whitelisted addons for this
+        # client
+        extra_data["guid_randomization"] = True
+        whitelist = extra_data["cache"]["whitelist"]
+        if whitelist is None:
+            self.logger.warning(
+                "Defaulting to empty results.  The model cache is not loaded yet."
+            )
+            return None
+        return self._ensemble_recommender.recommend(
+            client_info, len(whitelist), extra_data
+        )
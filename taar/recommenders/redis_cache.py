@@ -5,15 +5,26 @@
 import json
 import os
 import threading
+import time
 import redis
 
-from taar.recommenders.cache import TAARCache, RANKING_PREFIX, COINSTALL_PREFIX
+from taar.recommenders.cache import (
+    TAARCache,
+    DB_WRITE_BATCH_SIZE,
+    RANKING_PREFIX,
+    COINSTALL_PREFIX,
+)
 
 
 # This marks which of the redis databases is currently
 # active for read
 ACTIVE_DB = "active_db"
 
+# This is a unique stamp for each load of data into redis.  ACTIVE_DB
+# only flips between 1 and 2 so it can't identify a generation of
+# data on its own.
+ACTIVE_GENERATION = "active_generation"
+
 # This is a mutex to block multiple writers from redis
 UPDATE_CHECK = "update_mutex|"
 
@@ -60,6 +71,7 @@ class TAARCacheRedis(TAARCache):
         self._last_db = None
         # Keep an integer handle (or None) on the last known database
         self._last_db = None
+        self._cache_context = None
 
         rcon = self.init_redis_connections()
 
@@ -128,6 +140,12 @@ class TAARCacheRedis(TAARCache):
             self._r0.delete(UPDATE_CHECK)
             self.logger.info("UPDATE_CHECK field is cleared")
 
+    def require_data(self, group_names):
+        """
+        Redis is shared by every process and is always loaded with
+        every group by the taar-redis job
+        """
+
     def _db_get(self, key, default=None, db=None):
         tmp = (db or self._db()).get(key)
         if tmp:
@@ -137,6 +155,22 @@ class TAARCacheRedis(TAARCache):
     def _db_set(self, key, val, db):
         db.set(key, json.dumps(val))
 
+    def _db_set_many(self, items, db):
+        """
+        Write an iterable of (key, value) pairs with one MSET per
+        batch, sent over a single pipeline
+        """
+        pipe = db.pipeline(transaction=False)
+        batch = {}
+        for key, val in items:
+            batch[key] = json.dumps(val)
+            if len(batch) >= DB_WRITE_BATCH_SIZE:
+                pipe.mset(batch)
+                batch = {}
+        if batch:
+            pipe.mset(batch)
+        pipe.execute()
+
     def key_iter_ranking(self):
         return PrefixStripper(
             RANKING_PREFIX, self._db().scan_iter(match=RANKING_PREFIX + "*")
@@ -154,9 +188,19 @@ class TAARCacheRedis(TAARCache):
         # Any value in ACTIVE_DB indicates that data is live
         return self._r0.get(ACTIVE_DB) is not None
 
+    def cache_generation(self):
+        tmp = self._r0.get(ACTIVE_GENERATION)
+        if tmp is None:
+            return None
+        return tmp.decode("utf8")
+
     def ensure_db_loaded(self):
         _ = self._db()  # make sure we've computed data from the live redis instance
 
+    def cache_context(self):
+        self.ensure_db_loaded()
+        return self._cache_context
+
     def _db(self):
         """
         This dereferences the ACTIVE_DB pointer to get the current
@@ -187,7 +231,7 @@ class TAARCacheRedis(TAARCache):
 
         self._last_db = db_num
 
-        self._build_cache_context(db)
+        self._cache_context = self._build_cache_context(db)
         self.logger.info("Completed precomputing normalized data")
 
     @property
@@ -216,5 +260,11 @@ class TAARCacheRedis(TAARCache):
 
         self._copy_data(db)
 
-        self._r0.set(ACTIVE_DB, next_active_db)
+        # Flip the active database and its generation stamp atomically
+        self._r0.mset(
+            {
+                ACTIVE_DB: next_active_db,
+                ACTIVE_GENERATION: f"{next_active_db}:{time.time():.6f}",
+            }
+        )
         self.logger.info(f"Active DB is set to {next_active_db}")
@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Caches for the weighted, pre-randomization output of the
+EnsembleRecommender.
+
+Entries are keyed on the cache generation of the model data so that
+loading new models implicitly invalidates every cached result.
+Randomization of the tail is applied on top of the cached list on
+each request, so responses are still shuffled.
+"""
+
+import json
+
+import markus
+
+from taar.utils import LRUTTLCache
+
+metrics = markus.get_metrics("taar")
+
+RESULT_CACHE_PREFIX = "taar_result|"
+
+
+def result_cache_key(generation, client_id, locale=None):
+    return f"{RESULT_CACHE_PREFIX}{generation}|{client_id}|{locale or ''}"
+
+
+class InMemoryResultCache:
+    """
+    A per-process bounded LRU of recommendation results
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._lru = LRUTTLCache(maxsize, ttl)
+
+    def get(self, key):
+        result = self._lru.get(key)
+        metrics.incr("result_cache_hit" if result is not None else "result_cache_miss")
+        return result
+
+    def set(self, key, results):
+        self._lru.set(key, list(results))
+
+
+class RedisResultCache:
+    """
+    A recommendation result cache shared by all processes through a
+    dedicated redis database
+    """
+
+    def __init__(self, redis_conn, ttl):
+        self._r = redis_conn
+        self._ttl = ttl
+
+    def get(self, key):
+        tmp = self._r.get(key)
+        if tmp is None:
+            metrics.incr("result_cache_miss")
+            return None
+        metrics.incr("result_cache_hit")
+        return [tuple(row) for row in json.loads(tmp.decode("utf8"))]
+
+    def set(self, key, results):
+        self._r.set(key, json.dumps(results), ex=self._ttl)
+
+
+def build_result_cache(app_settings):
+    """
+    Construct the result cache selected by TAAR_RESULT_CACHE or None
+    if result caching is disabled.
+    """
+    backend = app_settings.TAAR_RESULT_CACHE
+    if backend == "memory":
+        return InMemoryResultCache(
+            app_settings.TAAR_RESULT_CACHE_SIZE, app_settings.TAAR_RESULT_CACHE_TTL
+        )
+    elif backend == "redis":
+        import redis
+        from taar.settings import RedisCacheSettings
+
+        rcon = redis.Redis(
+            host=RedisCacheSettings.REDIS_HOST,
+            port=RedisCacheSettings.REDIS_PORT,
+            db=app_settings.TAAR_RESULT_CACHE_REDIS_DB,
+        )
+        return RedisResultCache(rcon, app_settings.TAAR_RESULT_CACHE_TTL)
+    return None
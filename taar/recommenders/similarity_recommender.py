@@ -5,20 +5,12 @@
 from taar.recommenders.base_recommender import AbstractRecommender
 from itertools import groupby
 from scipy.spatial import distance
+from taar.client_profile import CATEGORICAL_FEATURES, CONTINUOUS_FEATURES, ClientProfile
 from taar.interfaces import IMozLogging, ITAARCache
 import numpy as np
 
 FLOOR_DISTANCE_ADJUSTMENT = 0.001
 
-CATEGORICAL_FEATURES = ["geo_city", "locale", "os"]
-CONTINUOUS_FEATURES = [
-    "subsession_length",
-    "bookmark_count",
-    "tab_open_count",
-    "total_uri",
-    "unique_tlds",
-]
-
 
 class SimilarityRecommender(AbstractRecommender):
     """ A recommender class that returns top N addons based on the
@@ -38,10 +30,13 @@ class SimilarityRecommender(AbstractRecommender):
     collaborative_recommender may not work.
     """
 
+    DATA_GROUPS = ("similarity",)
+
     def __init__(self, ctx):
         self._ctx = ctx
 
         self._cache = self._ctx[ITAARCache]
+        self._cache.require_data(self.DATA_GROUPS)
 
         self.logger = self._ctx[IMozLogging].get_logger("taar")
 
@@ -108,17 +103,22 @@ class SimilarityRecommender(AbstractRecommender):
     # https://github.com/mozilla/python_mozetl/blob/master/mozetl/taar/taar_similarity.py
     #
     def compute_clients_dist(self, client_data, cache):
-        client_categorical_feats = [
-            client_data.get(specified_key) for specified_key in CATEGORICAL_FEATURES
-        ]
-        client_continuous_feats = [
-            client_data.get(specified_key) for specified_key in CONTINUOUS_FEATURES
-        ]
+        if isinstance(client_data, ClientProfile):
+            # The feature vectors are built once per cached profile
+            client_categorical_feats = client_data.categorical_features
+            client_continuous_feats = client_data.continuous_features
+        else:
+            client_categorical_feats = [
+                client_data.get(specified_key) for specified_key in CATEGORICAL_FEATURES
+            ]
+            client_continuous_feats = np.array(
+                [[client_data.get(specified_key) for specified_key in CONTINUOUS_FEATURES]]
+            )
 
         # Compute the distances between the user and the cached continuous features.
         cont_features = distance.cdist(
             cache["continuous_features"],
-            np.array([client_continuous_feats]),
+            client_continuous_feats,
             "canberra",
         )
 
@@ -184,18 +184,21 @@ class SimilarityRecommender(AbstractRecommender):
 
         # Retrieve the indices of the highest ranked donors and then append their
         # installed addons.
-        index_lrs_iter = zip(indices[donor_log_lrs > 0.0], donor_log_lrs)
-        recommendations = []
-        for (index, lrs) in index_lrs_iter:
-            for term in cache["donors_pool"][index]["active_addons"]:
-                candidate = (term, lrs)
-                recommendations.append(candidate)
-        # Sort recommendations on key (guid name)
-        recommendations = sorted(recommendations, key=lambda x: x[0])
-        recommendations_out = []
-        # recommendations must be sorted for this to work.
-        for guid_key, group in groupby(recommendations, key=lambda x: x[0]):
-            recommendations_out.append((guid_key, sum(j for i, j in group)))
+        if cache.get("donor_addon_ids") is not None:
+            recommendations_out = self._score_donor_addons(cache, indices, donor_log_lrs)
+        else:
+            index_lrs_iter = zip(indices[donor_log_lrs > 0.0], donor_log_lrs)
+            recommendations = []
+            for (index, lrs) in index_lrs_iter:
+                for term in cache["donors_pool"][index]["active_addons"]:
+                    candidate = (term, lrs)
+                    recommendations.append(candidate)
+            # Sort recommendations on key (guid name)
+            recommendations = sorted(recommendations, key=lambda x: x[0])
+            recommendations_out = []
+            # recommendations must be sorted for this to work.
+            for guid_key, group in groupby(recommendations, key=lambda x: x[0]):
+                recommendations_out.append((guid_key, sum(j for i, j in group)))
         # now re-sort on the basis of LLR.
         recommendations_out = sorted(recommendations_out, key=lambda x: -x[1])
 
@@ -209,6 +212,32 @@ class SimilarityRecommender(AbstractRecommender):
         )
         return recommendations_out
 
+    def _score_donor_addons(self, cache, indices, donor_log_lrs):
+        """
+        Sum the log likelihood ratios of the donors with a positive
+        ratio for each of their active addons, using the GUID ids
+        precomputed in the cache.  Returns (guid, score) pairs sorted
+        by GUID.
+        """
+        positive = donor_log_lrs > 0.0
+        donors = indices[positive]
+        weights = donor_log_lrs[positive]
+
+        offsets = cache["donor_addon_offsets"]
+        starts = offsets[donors]
+        counts = offsets[donors + 1] - starts
+        if not counts.sum():
+            return []
+
+        # Gather the addon ids of the selected donors, in donor order
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        addon_ids = cache["donor_addon_ids"][positions]
+
+        guid_index = cache["donor_guid_index"]
+        scores = np.bincount(addon_ids, weights=np.repeat(weights, counts), minlength=len(guid_index))
+        candidates = np.unique(addon_ids)
+        return sorted(zip(guid_index.guids(candidates), scores[candidates]))
+
     def recommend(self, client_data, limit, extra_data={}):
         recommendations_out = self._recommend(client_data, limit, extra_data)
         return recommendations_out[:limit]
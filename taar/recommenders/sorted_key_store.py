@@ -0,0 +1,155 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+An immutable, memory mapped string keyed store.
+
+The store is a directory of flat arrays:
+
+    keys.npy            the utf8 encoded keys, concatenated in sorted order
+    key_offsets.npy     where each key starts in keys.npy, plus the end
+    values.npy          the pickled values, concatenated in key order
+    value_offsets.npy   where each value starts in values.npy, plus the end
+    hashes.npy          a 64 bit hash of every key, sorted
+    hash_order.npy      the index of the key for each entry of hashes.npy
+
+Every array is opened with np.load(mmap_mode="r"), so processes which
+open the same store share its pages and only the parts which are
+actually read become resident.  Lookups search the sorted hashes with
+a single np.searchsorted call, and the most recently used values are
+kept decoded in a bounded per-process cache.
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+from collections.abc import Mapping
+
+import numpy as np
+
+KEYS = "keys.npy"
+KEY_OFFSETS = "key_offsets.npy"
+VALUES = "values.npy"
+VALUE_OFFSETS = "value_offsets.npy"
+HASHES = "hashes.npy"
+HASH_ORDER = "hash_order.npy"
+
+# Number of decoded values, including misses, kept by each store
+DEFAULT_CACHE_SIZE = 4096
+
+_MISSING = object()
+
+
+def _key_hash(encoded):
+    """
+    A hash of an encoded key which is stable across processes
+    """
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "little")
+
+
+def _pack(blobs):
+    """
+    Concatenate byte strings into a uint8 array and an array of their
+    offsets
+    """
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in blobs], out=offsets[1:])
+    data = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+    return data, offsets
+
+
+def write_sorted_key_store(path, items):
+    """
+    Write an iterable of (str key, picklable value) items to a new
+    store directory at path
+    """
+    packed = sorted((key.encode("utf8"), value) for key, value in items)
+
+    keys, key_offsets = _pack([k for k, _ in packed])
+    values, value_offsets = _pack(
+        [pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL) for _, v in packed]
+    )
+    hashes = np.fromiter((_key_hash(k) for k, _ in packed), dtype=np.uint64, count=len(packed))
+    hash_order = np.argsort(hashes, kind="stable").astype(np.int64)
+
+    os.makedirs(path)
+    np.save(os.path.join(path, KEYS), keys)
+    np.save(os.path.join(path, KEY_OFFSETS), key_offsets)
+    np.save(os.path.join(path, VALUES), values)
+    np.save(os.path.join(path, VALUE_OFFSETS), value_offsets)
+    np.save(os.path.join(path, HASHES), hashes[hash_order])
+    np.save(os.path.join(path, HASH_ORDER), hash_order)
+
+
+class _SortedKeys:
+    """
+    A read-only sequence view of the encoded keys
+    """
+
+    def __init__(self, keys, offsets):
+        # Slicing a memoryview of the mapped array is much cheaper
+        # than slicing the np.memmap itself
+        self._keys = memoryview(keys)
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        return self._keys[self._offsets.item(idx):self._offsets.item(idx + 1)].tobytes()
+
+
+class SortedKeyStore(Mapping):
+    """
+    A read-only mapping over a store written by write_sorted_key_store.
+
+    Like the values of a dict, the values returned are shared between
+    lookups and must not be modified.
+    """
+
+    def __init__(self, path, cache_size=DEFAULT_CACHE_SIZE):
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r", allow_pickle=False)
+
+        self._keys = _SortedKeys(load(KEYS), load(KEY_OFFSETS))
+        self._values = memoryview(load(VALUES))
+        self._value_offsets = load(VALUE_OFFSETS)
+        self._hashes = load(HASHES)
+        self._hash_order = load(HASH_ORDER)
+        self._lookup = functools.lru_cache(maxsize=cache_size)(self._decode)
+
+    def _index(self, key):
+        encoded = key.encode("utf8")
+        key_hash = _key_hash(encoded)
+        pos = int(self._hashes.searchsorted(np.uint64(key_hash)))
+        while pos < len(self._hashes) and self._hashes.item(pos) == key_hash:
+            idx = self._hash_order.item(pos)
+            if self._keys[idx] == encoded:
+                return idx
+            pos += 1
+        return None
+
+    def _decode(self, key):
+        idx = self._index(key)
+        if idx is None:
+            return _MISSING
+        start, end = self._value_offsets.item(idx), self._value_offsets.item(idx + 1)
+        return pickle.loads(self._values[start:end])
+
+    def __getitem__(self, key):
+        value = self._lookup(key) if isinstance(key, str) else _MISSING
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self._lookup(key) is not _MISSING
+
+    def __iter__(self):
+        for idx in range(len(self._keys)):
+            yield self._keys[idx].decode("utf8")
+
+    def __len__(self):
+        return len(self._keys)
@@ -16,6 +16,27 @@ class AppSettings:
     TAAR_MAX_RESULTS = config("TAAR_MAX_RESULTS", default=10, cast=int)
     TAARLITE_MAX_RESULTS = config("TAARLITE_MAX_RESULTS", default=4, cast=int)
 
+    # Cache the weighted ensemble output per client. Valid backends
+    # are "memory" and "redis".  Leave blank to disable caching.
+    TAAR_RESULT_CACHE = config("TAAR_RESULT_CACHE", default="", cast=str)
+    TAAR_RESULT_CACHE_SIZE = config("TAAR_RESULT_CACHE_SIZE", default=10000, cast=int)
+    TAAR_RESULT_CACHE_TTL = config("TAAR_RESULT_CACHE_TTL", default=60 * 15, cast=int)
+    TAAR_RESULT_CACHE_REDIS_DB = config("TAAR_RESULT_CACHE_REDIS_DB", default=3, cast=int)
+
+    # Seed the tail randomization from the client_id, the cache
+    # generation and a time bucket so that responses are stable
+    # within each bucket.
+    TAAR_SEEDED_RANDOMIZATION = config("TAAR_SEEDED_RANDOMIZATION", default=False, cast=bool)
+    TAAR_RANDOMIZATION_BUCKET_SECONDS = config(
+        "TAAR_RANDOMIZATION_BUCKET_SECONDS", default=60 * 60, cast=int
+    )
+
+    # Profile fetches run on a small I/O pool so that they overlap
+    # with reading the model cache.  TAAR_REQUEST_TIMEOUT is the
+    # deadline in seconds for both to complete (0 disables it).
+    TAAR_IO_THREADS = config("TAAR_IO_THREADS", default=8, cast=int)
+    TAAR_REQUEST_TIMEOUT = config("TAAR_REQUEST_TIMEOUT", default=0.0, cast=float)
+
     # Bigtable config
     BIGTABLE_PROJECT_ID = config(
         "BIGTABLE_PROJECT_ID", default="cfr-personalization-experiment"
@@ -23,6 +44,35 @@ class AppSettings:
     BIGTABLE_INSTANCE_ID = config("BIGTABLE_INSTANCE_ID", default="taar-profile")
     BIGTABLE_TABLE_ID = config("BIGTABLE_TABLE_ID", default="taar_profile")
 
+    # Number of gRPC channels to BigTable.  This should match the
+    # number of gunicorn threads per worker.
+    BIGTABLE_CHANNEL_POOL_SIZE = config("BIGTABLE_CHANNEL_POOL_SIZE", default=8, cast=int)
+
+    # Write profiles as compact binary records rather than zlib
+    # compressed JSON.  Both formats are always accepted on read.
+    BIGTABLE_WRITE_BINARY_PROFILES = config("BIGTABLE_WRITE_BINARY_PROFILES", default=False, cast=bool)
+
+    # Async profile reads time out after BIGTABLE_TIMEOUT seconds (0
+    # disables the timeout).  A second, hedged read is issued when the
+    # first is slower than the BIGTABLE_HEDGE_PERCENTILE of recent
+    # reads (0 disables hedging).
+    BIGTABLE_TIMEOUT = config("BIGTABLE_TIMEOUT", default=1.0, cast=float)
+    BIGTABLE_HEDGE_PERCENTILE = config("BIGTABLE_HEDGE_PERCENTILE", default=95.0, cast=float)
+    BIGTABLE_HEDGE_MIN_DELAY = config("BIGTABLE_HEDGE_MIN_DELAY", default=0.01, cast=float)
+
+    # Where client profiles are read from.  Valid backends are
+    # "bigtable", "sqlite" and "memory".  The sqlite backend reads the
+    # database file at PROFILE_SQLITE_PATH, which is useful to
+    # benchmark the full recommendation path on a single machine.
+    PROFILE_BACKEND = config("PROFILE_BACKEND", default="bigtable", cast=str)
+    PROFILE_SQLITE_PATH = config("PROFILE_SQLITE_PATH", default="taar_profiles.sqlite3", cast=str)
+
+    # In-process cache of parsed client profiles.  Clients without a
+    # profile are remembered for PROFILE_NEGATIVE_CACHE_TTL seconds.
+    PROFILE_CACHE_SIZE = config("PROFILE_CACHE_SIZE", default=10000, cast=int)
+    PROFILE_CACHE_TTL = config("PROFILE_CACHE_TTL", default=60 * 10, cast=int)
+    PROFILE_NEGATIVE_CACHE_TTL = config("PROFILE_NEGATIVE_CACHE_TTL", default=60, cast=int)
+
 
 class DefaultCacheSettings:
     DISABLE_TAAR_LITE = config("DISABLE_TAAR_LITE", False, cast=bool)
@@ -46,6 +96,39 @@ class DefaultCacheSettings:
     TAAR_SIMILARITY_DONOR_KEY = config("TAAR_SIMILARITY_DONOR_KEY", default="test_similarity_donor_key")
     TAAR_SIMILARITY_LRCURVES_KEY = config("TAAR_SIMILARITY_LRCURVES_KEY", default="test_similarity_lrcurves_key")
 
+    # Number of model artifacts downloaded and decoded concurrently
+    # when the cache is loaded.
+    TAAR_ARTIFACT_FETCH_THREADS = config("TAAR_ARTIFACT_FETCH_THREADS", default=8, cast=int)
+
+    # Rebuild the in-memory cache in a background thread every
+    # TAAR_CACHE_REFRESH_SECONDS (0 disables the refresh).  This only
+    # applies when DISABLE_REDIS is set.
+    TAAR_CACHE_REFRESH_SECONDS = config("TAAR_CACHE_REFRESH_SECONDS", default=0, cast=int)
+
+    # Only one thread loads the in-memory cache.  When this is False,
+    # requests that arrive during the first load are answered from an
+    # empty cache instead of waiting for it.
+    TAAR_CACHE_WAIT_FOR_LOAD = config("TAAR_CACHE_WAIT_FOR_LOAD", default=True, cast=bool)
+
+    # Where model artifacts are loaded from.  Use gs:// for Google
+    # Cloud Storage, file:///some/root to read <root>/<bucket>/<key>
+    # from local disk, or memory:// for an in-process store.
+    TAAR_ARTIFACT_STORE_URL = config("TAAR_ARTIFACT_STORE_URL", default="gs://", cast=str)
+
+    # Keep a copy of every downloaded GCS artifact in this directory.
+    # A copy is reused while its GCS generation and md5 still match,
+    # and is used as a fallback when GCS can't be reached.  Leave
+    # blank to disable the disk cache.
+    TAAR_ARTIFACT_CACHE_DIR = config("TAAR_ARTIFACT_CACHE_DIR", default="", cast=str)
+
+    # Local directory for a serialized snapshot of the built in-memory
+    # cache.  Workers start from the snapshot instead of downloading
+    # and preprocessing the artifacts if it was built from the current
+    # artifact versions.  Only one worker on a host builds the
+    # snapshot, and the model matrices are memory mapped from it so all
+    # workers share one copy.  Leave blank to disable snapshots.
+    TAAR_CACHE_SNAPSHOT_DIR = config("TAAR_CACHE_SNAPSHOT_DIR", default="", cast=str)
+
     # TAAR-lite configuration below
 
     TAARLITE_GUID_COINSTALL_BUCKET = config("TAARLITE_GUID_COINSTALL_BUCKET", "telemetry-parquet")
@@ -3,7 +3,60 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import hashlib
+import threading
+import time
+from collections import OrderedDict
 
 
 def hasher(client_id):
     return hashlib.new("sha256", client_id.encode("utf8")).hexdigest()
+
+
+class LRUTTLCache:
+    """
+    A bounded, thread safe LRU map where every entry expires after a
+    time to live.
+
+    Entries may be stored with their own TTL which is useful to keep
+    negative results around for a shorter period of time than
+    positive results.
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return default
+
+            if expires_at <= self._timer():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self._maxsize <= 0:
+            return
+
+        expires_at = self._timer() + (self._ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import bz2
+import json
+import logging
+
+import pytest
+
+from taar.recommenders.artifact_store import (
+    FileArtifactStore,
+    GCSArtifactStore,
+    MemoryArtifactStore,
+    build_artifact_store,
+)
+from taar.recommenders.cache import TAARCache
+from taar.settings import DefaultCacheSettings
+
+logger = logging.getLogger("taar")
+
+
+def test_build_artifact_store(tmpdir):
+    assert isinstance(build_artifact_store("gs://", logger), GCSArtifactStore)
+    assert isinstance(build_artifact_store("", logger), GCSArtifactStore)
+    assert isinstance(build_artifact_store("memory://", logger), MemoryArtifactStore)
+
+    store = build_artifact_store(f"file://{tmpdir}", logger)
+    assert isinstance(store, FileArtifactStore)
+    assert store.path("bucket", "a/b.json") == str(tmpdir.join("bucket", "a", "b.json"))
+
+    with pytest.raises(ValueError):
+        build_artifact_store("ftp://example.com", logger)
+
+
+def test_file_artifact_store(tmpdir):
+    tmpdir.mkdir("bucket").join("data.json").write_binary(b"[1, 2]")
+    store = FileArtifactStore(str(tmpdir))
+
+    with store.open("bucket", "data.json") as fin:
+        assert fin.read() == b"[1, 2]"
+
+    info = store.describe("bucket", "data.json")
+    assert info["generation"]
+    assert store.describe("bucket", "missing.json") is None
+
+    with pytest.raises(FileNotFoundError):
+        store.open("bucket", "missing.json")
+
+
+def test_memory_artifact_store():
+    store = MemoryArtifactStore()
+    store.put("bucket", "data.json", b"{}")
+    first = store.describe("bucket", "data.json")
+
+    store.put("bucket", "data.json", b"[]")
+    second = store.describe("bucket", "data.json")
+
+    assert first["generation"] != second["generation"]
+    assert first["md5_hash"] != second["md5_hash"]
+    with store.open("bucket", "data.json") as fin:
+        assert fin.read() == b"[]"
+    assert store.describe("bucket", "missing.json") is None
+
+
+def test_cache_loads_from_file_store(test_ctx, tmpdir, TAARLITE_MOCK_DATA):
+    class Settings(DefaultCacheSettings):
+        TAAR_ARTIFACT_STORE_URL = f"file://{tmpdir}"
+        TAARLITE_GUID_COINSTALL_BUCKET = "models"
+        TAARLITE_GUID_COINSTALL_KEY = "coinstall.json.bz2"
+
+    tmpdir.mkdir("models").join("coinstall.json.bz2").write_binary(
+        bz2.compress(json.dumps(TAARLITE_MOCK_DATA).encode("utf8"))
+    )
+    test_ctx["cache_settings"] = Settings
+    cache = TAARCache(test_ctx)
+
+    assert dict(cache._fetch_coinstall_data()) == TAARLITE_MOCK_DATA
+
+
+def test_cache_uses_artifact_store_from_context(test_ctx):
+    store = MemoryArtifactStore()
+    store.put("bucket", "locale.json", json.dumps({"en": []}).encode("utf8"))
+
+    test_ctx["cache_settings"] = DefaultCacheSettings
+    test_ctx["artifact_store"] = store
+    cache = TAARCache(test_ctx)
+
+    assert cache._load_artifact("bucket", "locale.json") == {"en": []}
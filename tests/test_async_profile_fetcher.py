@@ -0,0 +1,105 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import time
+
+from markus import INCR
+from markus.testing import MetricsMock
+
+from taar.async_profile_fetcher import AsyncProfileController, AsyncProfileFetcher
+from taar.profile_fetcher import PROFILE_UNAVAILABLE
+from taar.settings import AppSettings
+
+from .test_profile_fetcher import MOCK_DATA
+
+
+class SlowProfileController:
+    """
+    A profile controller where the read with index `slow_call` blocks
+    for `delay` seconds
+    """
+
+    def __init__(self, profile, slow_call=None, delay=0.5):
+        self._profile = profile
+        self._slow_call = slow_call
+        self._delay = delay
+        self.calls = 0
+
+    def get_client_profile(self, client_id):
+        call = self.calls
+        self.calls += 1
+        if call == self._slow_call:
+            time.sleep(self._delay)
+        return self._profile
+
+
+def test_async_fetcher_returns_dict(test_ctx):
+    fetcher = AsyncProfileFetcher(test_ctx)
+    fetcher.set_client(SlowProfileController(MOCK_DATA["profile"]))
+
+    profile = asyncio.run(fetcher.get_async("random-client-id"))
+    assert profile == MOCK_DATA["expected_result"]
+
+    # The blocking and async paths share the profile cache
+    assert fetcher.get("random-client-id") == MOCK_DATA["expected_result"]
+
+
+def test_async_read_times_out(test_ctx):
+    controller = SlowProfileController(MOCK_DATA["profile"], slow_call=0, delay=0.5)
+    async_controller = AsyncProfileController(
+        test_ctx, controller, timeout=0.05, hedge_percentile=0
+    )
+
+    with MetricsMock() as mm:
+        start_time = time.monotonic()
+        result = asyncio.run(async_controller.get_client_profile("random-client-id"))
+        assert result is PROFILE_UNAVAILABLE
+        assert time.monotonic() - start_time < 0.4
+        assert mm.has_record(INCR, stat="taar.bigtable_read_timeout")
+
+
+def test_timed_out_profile_is_not_cached(test_ctx, monkeypatch):
+    monkeypatch.setattr(AppSettings, "BIGTABLE_TIMEOUT", 0.05)
+    monkeypatch.setattr(AppSettings, "BIGTABLE_HEDGE_PERCENTILE", 0)
+
+    controller = SlowProfileController(MOCK_DATA["profile"], slow_call=0, delay=0.5)
+    fetcher = AsyncProfileFetcher(test_ctx)
+    fetcher.set_client(controller)
+
+    assert asyncio.run(fetcher.get_async("random-client-id")) is None
+
+    # The next request reads the profile again
+    profile = asyncio.run(fetcher.get_async("random-client-id"))
+    assert profile == MOCK_DATA["expected_result"]
+    assert controller.calls == 2
+
+
+def test_async_hedged_read(test_ctx):
+    slow_call = AsyncProfileController.MIN_HEDGE_SAMPLES
+    controller = SlowProfileController(
+        MOCK_DATA["profile"], slow_call=slow_call, delay=0.5
+    )
+    async_controller = AsyncProfileController(
+        test_ctx, controller, timeout=2.0, hedge_percentile=95, hedge_min_delay=0.01
+    )
+
+    async def run():
+        # Warm up the latency samples with fast reads
+        for i in range(slow_call):
+            await async_controller.get_client_profile("random-client-id")
+        assert async_controller.hedge_delay() is not None
+
+        start_time = time.monotonic()
+        result = await async_controller.get_client_profile("random-client-id")
+        return result, time.monotonic() - start_time
+
+    with MetricsMock() as mm:
+        result, elapsed = asyncio.run(run())
+
+        # The hedged read wins the race against the slow read
+        assert result == MOCK_DATA["profile"]
+        assert elapsed < 0.4
+        assert controller.calls == slow_call + 2
+        assert mm.has_record(INCR, stat="taar.bigtable_hedged_read")
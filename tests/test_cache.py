@@ -0,0 +1,687 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import bz2
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+
+import mock
+import pytest
+from markus import INCR, TIMING
+from markus.testing import MetricsMock
+
+from taar.recommenders.artifact_store import MemoryArtifactStore
+from taar.recommenders.cache import (
+    ARTIFACTS,
+    COINSTALL_PREFIX,
+    ENSEMBLE_WEIGHTS,
+    FILTERED_COINSTALL_PREFIX,
+    LOCALE_DATA,
+    MIN_INSTALLS_PREFIX,
+    NORMDATA_COUNT_MAP_PREFIX,
+    NORMDATA_GUID_ROW_NORM_PREFIX,
+    NORMDATA_ROWCOUNT_PREFIX,
+    RANKING_PREFIX,
+    SIMILARITY_DONORS,
+    UPDATE_GROUPS,
+    TAARCache,
+)
+from taar.settings import DefaultCacheSettings
+
+
+@pytest.fixture
+def cache(test_ctx):
+    test_ctx["cache_settings"] = DefaultCacheSettings
+    test_ctx["artifact_store"] = MemoryArtifactStore()
+    return TAARCache(test_ctx)
+
+
+@pytest.fixture
+def gcs_cache(test_ctx):
+    test_ctx["cache_settings"] = DefaultCacheSettings
+    return TAARCache(test_ctx)
+
+
+UPDATE_METHODS = [
+    "_update_rank_data",
+    "_update_coinstall_data",
+    "_update_locale_data",
+    "_update_collab_data",
+    "_update_similarity_data",
+    "_update_ensemble_data",
+    "_update_whitelist_data",
+]
+
+
+def test_copy_data_runs_updates_concurrently(cache):
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0}
+    calls = []
+
+    def make_update(name):
+        def update(db):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+                calls.append(name)
+            time.sleep(0.05)
+            with lock:
+                state["active"] -= 1
+
+        return update
+
+    for name in UPDATE_METHODS:
+        setattr(cache, name, make_update(name))
+
+    cache._copy_data({})
+
+    assert sorted(calls) == sorted(UPDATE_METHODS)
+    assert state["peak"] > 1
+
+    # The coinstall data depends on the ranking data
+    assert calls.index("_update_rank_data") < calls.index("_update_coinstall_data")
+
+
+def test_copy_data_raises_update_errors(cache):
+    for name in UPDATE_METHODS:
+        setattr(cache, name, lambda db: None)
+
+    def broken(db):
+        raise ValueError("broken artifact")
+
+    cache._update_locale_data = broken
+
+    with pytest.raises(ValueError):
+        cache._copy_data({})
+
+
+def test_storage_client_is_shared(gcs_cache):
+    with mock.patch("taar.recommenders.artifact_store.storage.Client") as client:
+        gcs_cache._load_artifact("bucket", "a.json")
+        gcs_cache._load_artifact("bucket", "b.json")
+
+    assert client.call_count == 1
+
+
+def mock_gcs_object(payload):
+    """
+    Patch the storage client so every blob downloads payload
+    """
+    client = mock.MagicMock()
+    blob = client.return_value.get_bucket.return_value.blob.return_value
+    blob.download_to_file.side_effect = lambda fout: fout.write(payload)
+    return mock.patch("taar.recommenders.artifact_store.storage.Client", client)
+
+
+def test_load_artifact_decompresses_bz2(gcs_cache):
+    with mock_gcs_object(bz2.compress(json.dumps({"a": [1, 2]}).encode("utf8"))):
+        assert gcs_cache._load_artifact("bucket", "data.json.bz2") == {"a": [1, 2]}
+
+
+def test_coinstall_data_is_streamed(gcs_cache, TAARLITE_MOCK_DATA):
+    payload = json.dumps(TAARLITE_MOCK_DATA).encode("utf8")
+    with mock_gcs_object(payload):
+        data = gcs_cache._fetch_coinstall_data()
+
+        # A lazy stream of items rather than a parsed dict
+        assert not isinstance(data, dict)
+        assert dict(data) == TAARLITE_MOCK_DATA
+
+
+def test_update_coinstall_data_accepts_item_streams(cache, TAARLITE_MOCK_DATA):
+    from_dict = {}
+    from_stream = {}
+
+    cache._fetch_coinstall_data = lambda: TAARLITE_MOCK_DATA
+    cache._update_coinstall_data(from_dict)
+
+    cache._fetch_coinstall_data = lambda: iter(TAARLITE_MOCK_DATA.items())
+    cache._update_coinstall_data(from_stream)
+
+    assert from_stream == from_dict
+    assert from_dict
+
+
+def test_update_rank_data_accepts_item_streams(cache):
+    db = {}
+    cache._fetch_ranking_data = lambda: iter([("guid-1", 100), ("guid-2", 300)])
+    cache._update_rank_data(db)
+
+    assert cache.min_installs(db) == pytest.approx(10.0)
+
+
+class MockBlob:
+    def __init__(self, payload, generation):
+        self.payload = payload
+        self.generation = generation
+        self.md5_hash = hashlib.md5(payload).hexdigest()
+        self.downloads = 0
+
+    def download_to_file(self, fout):
+        self.downloads += 1
+        fout.write(self.payload)
+
+
+@pytest.fixture
+def disk_cache(test_ctx, tmpdir):
+    class Settings(DefaultCacheSettings):
+        TAAR_ARTIFACT_CACHE_DIR = str(tmpdir.join("artifacts"))
+
+    test_ctx["cache_settings"] = Settings
+    return TAARCache(test_ctx)
+
+
+def test_artifact_disk_cache(disk_cache):
+    blob = MockBlob(json.dumps({"a": 1}).encode("utf8"), generation=1)
+    with mock.patch("taar.recommenders.artifact_store.storage.Client") as client:
+        client.return_value.bucket.return_value.get_blob.return_value = blob
+
+        assert disk_cache._load_artifact("bucket", "data.json") == {"a": 1}
+        assert disk_cache._load_artifact("bucket", "data.json") == {"a": 1}
+        assert blob.downloads == 1
+
+        # A new generation is downloaded again
+        new_blob = MockBlob(json.dumps({"a": 2}).encode("utf8"), generation=2)
+        client.return_value.bucket.return_value.get_blob.return_value = new_blob
+        assert disk_cache._load_artifact("bucket", "data.json") == {"a": 2}
+        assert new_blob.downloads == 1
+
+
+def test_artifact_disk_cache_survives_gcs_outage(disk_cache):
+    blob = MockBlob(json.dumps({"a": 1}).encode("utf8"), generation=1)
+    with mock.patch("taar.recommenders.artifact_store.storage.Client") as client:
+        client.return_value.bucket.return_value.get_blob.return_value = blob
+        assert disk_cache._load_artifact("bucket", "data.json") == {"a": 1}
+
+        client.return_value.bucket.return_value.get_blob.side_effect = IOError("GCS is down")
+        assert disk_cache._load_artifact("bucket", "data.json") == {"a": 1}
+
+        # Nothing cached for this artifact yet
+        assert disk_cache._load_artifact("bucket", "other.json") is None
+
+
+def stub_copy_data(cache, versions):
+    """
+    Replace the artifact downloads with a locale table that records
+    which load produced it
+    """
+
+    def copy_data(db, groups=None):
+        version = next(versions)
+        cache._db_set(LOCALE_DATA, {"en": [[f"addon-{version}", 1.0]]}, db)
+
+    cache._copy_data = copy_data
+
+
+def publish_artifact(cache, name, payload=b"{}"):
+    """
+    Publish a new version of an artifact to the cache's artifact store
+    """
+    bucket, key = cache._artifact_location(name)
+    cache._get_artifact_store().put(bucket, key, payload)
+
+
+def test_refresh_swaps_snapshots(cache):
+    stub_copy_data(cache, itertools.count())
+
+    assert not cache.is_active()
+    first_context = cache.cache_context()
+    first_generation = cache.cache_generation()
+    assert first_context["top_addons_per_locale"] == {"en": [["addon-0", 1.0]]}
+
+    publish_artifact(cache, "locale")
+    assert cache.refresh()
+
+    # Requests holding on to the old context are unaffected
+    assert first_context["top_addons_per_locale"] == {"en": [["addon-0", 1.0]]}
+    assert cache.cache_context()["top_addons_per_locale"] == {"en": [["addon-1", 1.0]]}
+    assert cache.top_addons_per_locale() == {"en": [["addon-1", 1.0]]}
+    assert cache.cache_generation() != first_generation
+
+
+def test_failed_refresh_keeps_current_snapshot(cache):
+    stub_copy_data(cache, itertools.count())
+    context = cache.cache_context()
+
+    def broken(db, groups=None):
+        raise IOError("GCS is down")
+
+    cache._copy_data = broken
+    publish_artifact(cache, "locale")
+    assert not cache.refresh()
+    assert cache.cache_context() is context
+
+
+def test_background_refresher(cache):
+    stub_copy_data(cache, itertools.count())
+    cache.cache_context()
+    publish_artifact(cache, "locale")
+
+    refreshed = threading.Event()
+    refresh = cache.refresh
+
+    def refresh_and_signal():
+        result = refresh()
+        refreshed.set()
+        return result
+
+    cache.refresh = refresh_and_signal
+    cache.start_refresher(interval=0.01)
+    try:
+        assert refreshed.wait(5)
+    finally:
+        cache.stop_refresher()
+
+    assert cache.cache_context()["top_addons_per_locale"] != {"en": [["addon-0", 1.0]]}
+
+
+def test_single_flight_load(cache):
+    started = threading.Event()
+    release = threading.Event()
+    loads = []
+
+    def copy_data(db, groups=None):
+        loads.append(1)
+        started.set()
+        release.wait(5)
+        cache._db_set(LOCALE_DATA, {"en": []}, db)
+
+    cache._copy_data = copy_data
+
+    contexts = []
+    with MetricsMock() as mm:
+        threads = [
+            threading.Thread(target=lambda: contexts.append(cache.cache_context()))
+            for _ in range(8)
+        ]
+        threads[0].start()
+        assert started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join()
+
+        assert mm.has_record(INCR, stat="taar.cache_load_waiter")
+        assert mm.has_record(TIMING, stat="taar.cache_load")
+
+    assert len(loads) == 1
+    assert len(contexts) == 8
+    assert all(c is contexts[0] for c in contexts)
+
+
+def test_not_ready_fast_path(test_ctx):
+    class Settings(DefaultCacheSettings):
+        TAAR_CACHE_WAIT_FOR_LOAD = False
+
+    test_ctx["cache_settings"] = Settings
+    test_ctx["artifact_store"] = MemoryArtifactStore()
+    cache = TAARCache(test_ctx)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def copy_data(db, groups=None):
+        started.set()
+        release.wait(5)
+        cache._db_set(LOCALE_DATA, {"en": []}, db)
+
+    cache._copy_data = copy_data
+
+    loader = threading.Thread(target=cache.cache_context)
+    loader.start()
+    try:
+        assert started.wait(5)
+        with MetricsMock() as mm:
+            context = cache.cache_context()
+            assert mm.has_record(INCR, stat="taar.cache_not_ready")
+
+        assert context["whitelist"] is None
+        assert cache.top_addons_per_locale() is None
+    finally:
+        release.set()
+        loader.join()
+
+    assert cache.top_addons_per_locale() == {"en": []}
+
+
+def test_failed_load_is_retried(cache):
+    attempts = []
+
+    def copy_data(db, groups=None):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise IOError("GCS is down")
+        cache._db_set(LOCALE_DATA, {"en": []}, db)
+
+    cache._copy_data = copy_data
+
+    with pytest.raises(IOError):
+        cache.cache_context()
+    assert not cache.is_active()
+
+    assert cache.cache_context()["top_addons_per_locale"] == {"en": []}
+
+
+@pytest.fixture
+def counting_cache(cache):
+    """
+    A cache where every update just records that it ran and writes a
+    versioned value under each of its group's prefixes
+    """
+    calls = []
+    versions = itertools.count()
+
+    for group in UPDATE_GROUPS:
+        for update in group.updates:
+
+            def make_update(update, group):
+                def run(db):
+                    calls.append(update)
+                    version = next(versions)
+                    for prefix in group.prefixes:
+                        cache._db_set(prefix + f"v{version}", version, db)
+
+                return run
+
+            setattr(cache, update, make_update(update, group))
+
+    for name in ARTIFACTS:
+        publish_artifact(cache, name)
+
+    cache.calls = calls
+    return cache
+
+
+def test_unchanged_manifest_skips_refresh(counting_cache):
+    counting_cache.cache_context()
+    snapshot = counting_cache._snapshot
+    counting_cache.calls.clear()
+
+    with MetricsMock() as mm:
+        assert counting_cache.refresh()
+        assert mm.has_record(INCR, stat="taar.cache_refresh_unchanged")
+
+    assert counting_cache.calls == []
+    assert counting_cache._snapshot is snapshot
+
+
+def test_refresh_reloads_only_changed_artifacts(counting_cache):
+    context = counting_cache.cache_context()
+    db = counting_cache._snapshot.db
+    counting_cache.calls.clear()
+
+    publish_artifact(counting_cache, "ensemble_weights")
+    with mock.patch.object(
+        counting_cache,
+        "_build_similarity_features_caches",
+        side_effect=AssertionError("similarity was rebuilt"),
+    ):
+        assert counting_cache.refresh()
+
+    assert counting_cache.calls == ["_update_ensemble_data"]
+    new_context = counting_cache.cache_context()
+    assert new_context["continuous_features"] is context["continuous_features"]
+
+    # Only the ensemble keys were replaced
+    new_db = counting_cache._snapshot.db
+    changed = {k for k in set(db) | set(new_db) if db.get(k) != new_db.get(k)}
+    assert changed
+    assert all(k.startswith(ENSEMBLE_WEIGHTS) for k in changed)
+
+
+def test_refresh_reloads_whole_update_group(counting_cache):
+    counting_cache.cache_context()
+    old_keys = set(counting_cache._snapshot.db)
+    counting_cache.calls.clear()
+
+    # New rankings change the coinstall filtering too
+    publish_artifact(counting_cache, "ranking")
+    assert counting_cache.refresh()
+
+    assert counting_cache.calls == ["_update_rank_data", "_update_coinstall_data"]
+
+    # Stale taarlite keys were removed
+    new_db = counting_cache._snapshot.db
+    stale = [k for k in old_keys if k.startswith(RANKING_PREFIX)]
+    assert stale
+    assert not any(k in new_db for k in stale)
+    assert any(k.startswith(RANKING_PREFIX) for k in new_db)
+
+
+def test_donor_addon_ids(cache):
+    db = {
+        LOCALE_DATA: {"en": [["guid-locale", 1.0]]},
+        SIMILARITY_DONORS: [{"active_addons": ["guid-a", "guid-b"]}, {"active_addons": ["guid-b"]}],
+    }
+    context = cache._build_cache_context(db)
+
+    # Only the donors' addons are indexed
+    index = context["donor_guid_index"]
+    assert len(index) == 2
+    assert "guid-locale" not in index
+    assert context["donor_addon_offsets"].tolist() == [0, 2, 3]
+    assert index.guids(context["donor_addon_ids"]) == ["guid-a", "guid-b", "guid-b"]
+    assert all("active_addons" not in d for d in context["donors_pool"])
+
+    # Other groups reuse the donor ids
+    locale = [g for g in UPDATE_GROUPS if g.name == "locale"]
+    new_context = cache._build_cache_context(db, groups=locale, previous=context)
+    assert new_context["donor_addon_ids"] is context["donor_addon_ids"]
+
+    # New donors get a new index, without the addons nobody has anymore
+    db[SIMILARITY_DONORS] = [{"active_addons": ["guid-c"]}]
+    similarity = [g for g in UPDATE_GROUPS if g.name == "similarity"]
+    new_context = cache._build_cache_context(db, groups=similarity, previous=context)
+    assert new_context["donor_guid_index"].guids(range(1)) == ["guid-c"]
+    assert new_context["donor_addon_ids"].tolist() == [0]
+
+
+def test_only_required_groups_are_loaded(counting_cache):
+    counting_cache.require_data(["taarlite"])
+    context = counting_cache.cache_context()
+
+    assert counting_cache.calls == ["_update_rank_data", "_update_coinstall_data"]
+    assert context["donors_pool"] is None
+    assert set(counting_cache._snapshot.manifest) == {"ranking", "coinstall"}
+
+
+def test_late_required_groups_are_loaded(counting_cache):
+    counting_cache.require_data(["taarlite"])
+    counting_cache.cache_context()
+    generation = counting_cache.cache_generation()
+    counting_cache.calls.clear()
+
+    counting_cache.require_data(["taarlite", "locale"])
+    assert counting_cache.calls == ["_update_locale_data"]
+    assert counting_cache.cache_generation() != generation
+    assert any(k.startswith(LOCALE_DATA) for k in counting_cache._snapshot.db)
+
+    # The new artifacts are part of the manifest
+    counting_cache.calls.clear()
+    assert counting_cache.refresh()
+    assert counting_cache.calls == []
+
+
+def flaky_open(store, failures):
+    """
+    Make the next `failures` artifact reads from store raise
+    """
+    open_artifact = store.open
+    remaining = [failures]
+
+    def open(bucket, key):
+        if remaining[0]:
+            remaining[0] -= 1
+            raise IOError("artifact store is down")
+        return open_artifact(bucket, key)
+
+    store.open = open
+
+
+@pytest.fixture
+def ensemble_cache(test_ctx):
+    class Settings(DefaultCacheSettings):
+        TAAR_ENSEMBLE_KEY = "ensemble.json"
+
+    test_ctx["cache_settings"] = Settings
+    test_ctx["artifact_store"] = MemoryArtifactStore()
+    cache = TAARCache(test_ctx)
+    cache.require_data(["ensemble"])
+    return cache
+
+
+def test_failed_artifact_fetch_keeps_current_snapshot(ensemble_cache):
+    cache = ensemble_cache
+    publish_artifact(cache, "ensemble_weights", json.dumps({"ensemble_weights": {"collaborative": 1}}).encode())
+    assert cache.ensemble_weights() == {"collaborative": 1}
+    snapshot = cache._snapshot
+
+    publish_artifact(cache, "ensemble_weights", json.dumps({"ensemble_weights": {"collaborative": 2}}).encode())
+    flaky_open(cache._get_artifact_store(), 1)
+    assert not cache.refresh()
+    assert cache._snapshot is snapshot
+    assert cache.ensemble_weights() == {"collaborative": 1}
+
+    # The new artifact is loaded by the next refresh
+    assert cache.refresh()
+    assert cache.ensemble_weights() == {"collaborative": 2}
+
+
+def test_artifact_missing_from_first_load_is_retried(ensemble_cache):
+    cache = ensemble_cache
+    publish_artifact(cache, "ensemble_weights", json.dumps({"ensemble_weights": {"collaborative": 1}}).encode())
+    flaky_open(cache._get_artifact_store(), 1)
+
+    # The first load serves what it could load
+    assert cache.ensemble_weights() is None
+    assert "ensemble_weights" not in cache._snapshot.manifest
+
+    assert cache.refresh()
+    assert cache.ensemble_weights() == {"collaborative": 1}
+
+
+def test_refresh_does_not_overwrite_concurrent_load(counting_cache):
+    counting_cache.require_data(["taarlite"])
+    counting_cache.cache_context()
+    counting_cache.calls.clear()
+
+    # A recommender declares more data while the refresh is building
+    update_rank_data = counting_cache._update_rank_data
+
+    def update_and_require(db):
+        update_rank_data(db)
+        if counting_cache.calls.count("_update_rank_data") == 1:
+            counting_cache.require_data(["taarlite", "locale"])
+
+    counting_cache._update_rank_data = update_and_require
+    publish_artifact(counting_cache, "ranking")
+    with MetricsMock() as mm:
+        assert counting_cache.refresh()
+        assert mm.has_record(INCR, stat="taar.cache_publish_conflict")
+
+    # The refresh was rebuilt on top of the snapshot with the locale data
+    assert counting_cache.calls.count("_update_locale_data") == 1
+    assert counting_cache.calls.count("_update_rank_data") == 2
+    db = counting_cache._snapshot.db
+    assert any(k.startswith(LOCALE_DATA) for k in db)
+    assert set(counting_cache._snapshot.manifest) == {"ranking", "coinstall", "locale"}
+
+
+def test_failed_late_load_is_retried(counting_cache):
+    counting_cache.require_data(["locale"])
+    counting_cache.cache_context()
+    counting_cache.calls.clear()
+
+    update_rank_data = counting_cache._update_rank_data
+    counting_cache._update_rank_data = mock.Mock(side_effect=IOError("artifact store is down"))
+    with pytest.raises(IOError):
+        counting_cache.require_data(["taarlite"])
+    assert [g.name for g in counting_cache._enabled_groups()] == ["locale"]
+
+    # Declaring the group again loads it
+    counting_cache._update_rank_data = update_rank_data
+    counting_cache.require_data(["taarlite"])
+    assert counting_cache.calls == ["_update_rank_data", "_update_coinstall_data"]
+    assert any(k.startswith(RANKING_PREFIX) for k in counting_cache._snapshot.db)
+
+
+def test_recommenders_declare_their_data(cache):
+    from taar.interfaces import ITAARCache
+    from taar.recommenders.guid_based_recommender import GuidBasedRecommender
+    from taar.recommenders.locale_recommender import LocaleRecommender
+
+    ctx = cache._ctx.child()
+    ctx[ITAARCache] = cache
+    GuidBasedRecommender(ctx)
+    assert [g.name for g in cache._enabled_groups()] == ["taarlite"]
+
+    LocaleRecommender(ctx)
+    assert [g.name for g in cache._enabled_groups()] == ["taarlite", "locale"]
+
+
+def reference_coinstall_tables(coinstall_data, min_installs):
+    """
+    The coinstall tables computed one entry at a time
+    """
+    db = {}
+    guid_count_map = {}
+    row_count = {}
+    guid_row_norm = {}
+    for guid, coinstalls in coinstall_data.items():
+        db[FILTERED_COINSTALL_PREFIX + guid] = {k: v for k, v in coinstalls.items() if v >= min_installs}
+        db[COINSTALL_PREFIX + guid] = coinstalls
+        rowsum = sum(coinstalls.values())
+        for coinstall_guid, coinstall_count in coinstalls.items():
+            guid_count_map[coinstall_guid] = guid_count_map.get(coinstall_guid, 0) + coinstall_count
+            row_count[coinstall_guid] = row_count.get(coinstall_guid, 0) + 1
+            guid_row_norm.setdefault(coinstall_guid, []).append(1.0 * coinstall_count / rowsum)
+    for guid, value in guid_count_map.items():
+        db[NORMDATA_COUNT_MAP_PREFIX + guid] = value
+    for guid, value in row_count.items():
+        db[NORMDATA_ROWCOUNT_PREFIX + guid] = value
+    for guid, value in guid_row_norm.items():
+        db[NORMDATA_GUID_ROW_NORM_PREFIX + guid] = value
+    return db
+
+
+def test_update_coinstall_data_matches_reference(cache, TAARLITE_MOCK_DATA):
+    rng = random.Random(42)
+    guids = [f"guid-{i}" for i in range(50)]
+    generated = {
+        guid: {other: rng.randint(1, 1000) for other in rng.sample(guids, rng.randint(1, 20))}
+        for guid in guids
+    }
+
+    # Counts of the first ten GUIDs are floats, the rest stay ints
+    mixed = {
+        guid: {other: count + 0.5 if other in guids[:10] else count for other, count in coinstalls.items()}
+        for guid, coinstalls in generated.items()
+    }
+
+    for coinstall_data in (TAARLITE_MOCK_DATA, generated, mixed, {}):
+        db = {MIN_INSTALLS_PREFIX: 100.0}
+        cache._fetch_coinstall_data = lambda: iter(coinstall_data.items())
+        cache._update_coinstall_data(db)
+        del db[MIN_INSTALLS_PREFIX]
+
+        expected = reference_coinstall_tables(coinstall_data, 100.0)
+        assert db == expected
+        for key, value in db.items():
+            assert type(value) is type(expected[key])
+
+
+def test_update_coinstall_data_zero_row_total(cache):
+    coinstall_data = {"guid-1": {"guid-2": 5}, "guid-3": {"guid-2": 0, "guid-4": 0}}
+    with pytest.raises(ZeroDivisionError):
+        reference_coinstall_tables(coinstall_data, 100.0)
+
+    cache._fetch_coinstall_data = lambda: iter(coinstall_data.items())
+    with pytest.raises(ZeroDivisionError):
+        cache._update_coinstall_data({MIN_INSTALLS_PREFIX: 100.0})
@@ -0,0 +1,224 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import threading
+
+import numpy as np
+import pytest
+from markus import INCR, TIMING
+from markus.testing import MetricsMock
+
+from taar.recommenders.artifact_store import MemoryArtifactStore
+from taar.recommenders.cache import (
+    COINSTALL_PREFIX,
+    LOCALE_DATA,
+    RANKING_PREFIX,
+    TAARLITE_PREFIXES,
+    TAARCache,
+)
+from taar.recommenders.cache_snapshot import (
+    CURRENT,
+    CacheSnapshot,
+    SnapshotDB,
+    load_snapshot,
+    save_snapshot,
+)
+from taar.settings import DefaultCacheSettings
+
+MANIFEST = {"locale": {"bucket": "b", "key": "k", "info": {"generation": "1", "md5_hash": "x"}}}
+
+
+def make_snapshot(manifest=MANIFEST):
+    db = {LOCALE_DATA: {"en": [["addon-1", 1.0]]}, "min_installs|": 2.5}
+    context = {
+        "num_donors": 2,
+        "continuous_features": np.array([[1.0, 2.0], [3.0, 4.0]]),
+        "categorical_features": np.array([["en", "Linux"], ["de", "Darwin"]], dtype="object"),
+        "top_addons_per_locale": db[LOCALE_DATA],
+        "whitelist": None,
+    }
+    return CacheSnapshot(db, context, "123.000000", manifest)
+
+
+def test_snapshot_roundtrip(tmpdir):
+    snapshot = make_snapshot()
+    save_snapshot(snapshot, str(tmpdir))
+
+    loaded = load_snapshot(str(tmpdir), MANIFEST)
+    assert loaded.db == snapshot.db
+    assert loaded.generation == snapshot.generation
+    assert loaded.manifest == MANIFEST
+    assert set(loaded.context) == set(snapshot.context)
+    assert loaded.context["num_donors"] == 2
+    assert loaded.context["whitelist"] is None
+    np.testing.assert_array_equal(
+        loaded.context["continuous_features"], snapshot.context["continuous_features"]
+    )
+    np.testing.assert_array_equal(
+        loaded.context["categorical_features"], snapshot.context["categorical_features"]
+    )
+
+    # The matrices are memory mapped rather than read into memory
+    assert isinstance(loaded.context["continuous_features"], np.memmap)
+    assert isinstance(loaded.context["categorical_features"], np.memmap)
+    assert loaded.context["categorical_features"].dtype.kind == "U"
+    assert not loaded.context["continuous_features"].flags.writeable
+
+
+def test_categorical_features_with_missing_values_are_not_mapped(tmpdir):
+    snapshot = make_snapshot()
+    snapshot.context["categorical_features"] = np.array([["en", None]], dtype="object")
+    save_snapshot(snapshot, str(tmpdir))
+
+    loaded = load_snapshot(str(tmpdir), MANIFEST)
+    assert loaded.context["categorical_features"].dtype == object
+    assert loaded.context["categorical_features"][0, 1] is None
+
+
+def test_snapshot_must_match_manifest(tmpdir):
+    save_snapshot(make_snapshot(), str(tmpdir))
+
+    changed = {"locale": dict(MANIFEST["locale"], info={"generation": "2", "md5_hash": "y"})}
+    assert load_snapshot(str(tmpdir), changed) is None
+    assert load_snapshot(str(tmpdir), None) is None
+    assert load_snapshot(str(tmpdir.join("missing")), MANIFEST) is None
+
+
+def test_only_current_snapshot_is_kept(tmpdir):
+    save_snapshot(make_snapshot(), str(tmpdir))
+    path = save_snapshot(make_snapshot(), str(tmpdir))
+
+    assert sorted(os.listdir(str(tmpdir))) == sorted([CURRENT, os.path.basename(path)])
+    assert load_snapshot(str(tmpdir), MANIFEST) is not None
+
+
+def test_taarlite_tables_are_memory_mapped(tmpdir):
+    snapshot = make_snapshot()
+    snapshot.db[COINSTALL_PREFIX + "guid-1"] = {"guid-2": 10}
+    snapshot.db[RANKING_PREFIX + "guid-1"] = 400
+    save_snapshot(snapshot, str(tmpdir), mapped_prefixes=TAARLITE_PREFIXES)
+
+    loaded = load_snapshot(str(tmpdir), MANIFEST)
+    assert isinstance(loaded.db, SnapshotDB)
+    assert loaded.db.get(COINSTALL_PREFIX + "guid-1") == {"guid-2": 10}
+    assert loaded.db.get(RANKING_PREFIX + "guid-1") == 400
+    assert loaded.db.get(RANKING_PREFIX + "guid-2") is None
+    assert loaded.db.get(LOCALE_DATA) == snapshot.db[LOCALE_DATA]
+    assert dict(loaded.db) == snapshot.db
+
+
+@pytest.fixture
+def snapshot_settings(tmpdir):
+    class Settings(DefaultCacheSettings):
+        TAAR_CACHE_SNAPSHOT_DIR = str(tmpdir.join("snapshot"))
+
+    return Settings
+
+
+def make_cache(test_ctx, settings, store, loads):
+    ctx = test_ctx.child()
+    ctx["cache_settings"] = settings
+    ctx["artifact_store"] = store
+    cache = TAARCache(ctx)
+
+    def copy_data(db, groups=None):
+        loads.append(1)
+        cache._db_set(LOCALE_DATA, {"en": [["addon", float(len(loads))]]}, db)
+
+    cache._copy_data = copy_data
+    cache._build_similarity_context = lambda db: {
+        "continuous_features": np.ones((3, 2)),
+    }
+    return cache
+
+
+def test_warm_start_from_saved_snapshot(test_ctx, snapshot_settings):
+    store = MemoryArtifactStore()
+    loads = []
+
+    first = make_cache(test_ctx, snapshot_settings, store, loads)
+    bucket, key = first._artifact_location("locale")
+    store.put(bucket, key, b"{}")
+    context = first.cache_context()
+    assert loads == [1]
+
+    # A new worker with the same artifacts skips the load entirely
+    second = make_cache(test_ctx, snapshot_settings, store, loads)
+    with MetricsMock() as mm:
+        assert second.cache_context()["top_addons_per_locale"] == context["top_addons_per_locale"]
+        assert mm.has_record(TIMING, stat="taar.cache_warm_start")
+        assert not mm.has_record(TIMING, stat="taar.cache_load")
+    assert loads == [1]
+    assert second.cache_generation() == first.cache_generation()
+
+
+def test_stale_snapshot_is_rebuilt(test_ctx, snapshot_settings):
+    store = MemoryArtifactStore()
+    loads = []
+
+    first = make_cache(test_ctx, snapshot_settings, store, loads)
+    first.cache_context()
+
+    bucket, key = first._artifact_location("locale")
+    store.put(bucket, key, b"{}")
+
+    second = make_cache(test_ctx, snapshot_settings, store, loads)
+    with MetricsMock() as mm:
+        context = second.cache_context()
+        assert mm.has_record(INCR, stat="taar.cache_warm_start_miss")
+    assert loads == [1, 1]
+    assert context["top_addons_per_locale"] == {"en": [["addon", 2.0]]}
+
+    # The rebuilt snapshot replaced the stale one
+    third = make_cache(test_ctx, snapshot_settings, store, loads)
+    third.cache_context()
+    assert loads == [1, 1]
+
+
+def test_built_snapshot_is_memory_mapped(test_ctx, snapshot_settings):
+    cache = make_cache(test_ctx, snapshot_settings, MemoryArtifactStore(), [])
+    assert isinstance(cache.cache_context()["continuous_features"], np.memmap)
+
+
+def test_one_worker_builds_the_shared_snapshot(test_ctx, snapshot_settings):
+    store = MemoryArtifactStore()
+    loads = []
+    caches = [make_cache(test_ctx, snapshot_settings, store, loads) for _ in range(4)]
+    bucket, key = caches[0]._artifact_location("locale")
+    store.put(bucket, key, b"{}")
+
+    threads = [threading.Thread(target=c.cache_context) for c in caches]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert loads == [1]
+    assert len({c.cache_generation() for c in caches}) == 1
+
+
+def test_refresh_of_mapped_snapshot(test_ctx, snapshot_settings):
+    store = MemoryArtifactStore()
+    cache = make_cache(test_ctx, snapshot_settings, store, [])
+
+    def copy_data(db, groups=None):
+        names = {g.name for g in groups} if groups is not None else {"taarlite", "locale"}
+        if "taarlite" in names:
+            db[COINSTALL_PREFIX + "guid-1"] = {"guid-2": 10}
+        if "locale" in names:
+            db[LOCALE_DATA] = {"en": [["addon", float(len(store._artifacts))]]}
+
+    cache._copy_data = copy_data
+    cache.cache_context()
+    assert isinstance(cache._snapshot.db, SnapshotDB)
+
+    bucket, key = cache._artifact_location("locale")
+    store.put(bucket, key, b"{}")
+    assert cache.refresh()
+
+    # The unchanged TAARlite tables are carried over
+    assert cache.get_coinstalls("guid-1") == {"guid-2": 10}
+    assert cache.top_addons_per_locale() == {"en": [["addon", 1.0]]}
+    assert isinstance(cache._snapshot.db, SnapshotDB)
@@ -0,0 +1,90 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import numpy as np
+import pytest
+
+from taar.client_profile import ClientProfile
+
+PROFILE = {
+    "client_id": "test-client-001",
+    "geo_city": "brasilia-br",
+    "subsession_length": 4911,
+    "locale": "br-PT",
+    "os": "mac",
+    "installed_addons": ["addon-a", "addon-b"],
+    "disabled_addons_ids": [],
+    "bookmark_count": 7,
+    "tab_open_count": 4,
+    "total_uri": 222,
+    "unique_tlds": 21,
+}
+
+
+def test_behaves_like_a_dict():
+    profile = ClientProfile(PROFILE)
+
+    assert profile == PROFILE
+    assert profile["locale"] == "br-PT"
+    assert profile.get("no-such-key", "default") == "default"
+    assert "locale" in profile
+    assert set(profile.keys()) == set(PROFILE.keys())
+    assert dict(profile.items()) == PROFILE
+    assert len(profile) == len(PROFILE)
+
+    with pytest.raises(KeyError):
+        profile["no-such-key"]
+
+
+def test_missing_fields_are_not_present():
+    profile = ClientProfile(client_id="test-client-001")
+
+    assert "locale" not in profile
+    assert profile.get("locale") is None
+    with pytest.raises(KeyError):
+        profile["locale"]
+
+    profile["locale"] = "en-US"
+    assert "locale" in profile
+
+    del profile["locale"]
+    assert "locale" not in profile
+
+
+def test_extra_keys_are_kept():
+    profile = ClientProfile(PROFILE)
+    profile["extra"] = 1
+
+    assert profile["extra"] == 1
+    assert profile.to_dict() == dict(PROFILE, extra=1)
+
+
+def test_derived_features():
+    profile = ClientProfile(PROFILE)
+
+    np.testing.assert_array_equal(
+        profile.continuous_features, np.array([[4911.0, 7.0, 4.0, 222.0, 21.0]])
+    )
+    assert profile.categorical_features == ["brasilia-br", "br-PT", "mac"]
+    assert profile.installed_addon_set == {"addon-a", "addon-b"}
+
+    # Updating a field invalidates the derived features
+    profile["bookmark_count"] = 8
+    profile["installed_addons"] = ["addon-c"]
+    assert profile.continuous_features[0][1] == 8.0
+    assert profile.installed_addon_set == {"addon-c"}
+
+
+def test_copy_is_independent():
+    profile = ClientProfile(PROFILE)
+    features = profile.continuous_features
+
+    copied = profile.copy()
+    assert copied == profile
+    assert copied.continuous_features is features
+
+    copied["locale"] = "en-US"
+    copied["extra"] = 1
+    assert profile["locale"] == "br-PT"
+    assert "extra" not in profile
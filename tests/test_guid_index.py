@@ -0,0 +1,33 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pickle
+
+from taar.recommenders.guid_index import GUID_ID_DTYPE, GuidIndex
+
+
+def test_ids_are_dense():
+    index = GuidIndex(["guid-a", "guid-b", "guid-a"])
+    assert len(index) == 2
+    assert index.id_of("guid-a") == 0
+    assert index.id_of("guid-b") == 1
+    assert index.id_of("guid-c") is None
+    assert "guid-c" not in index
+    assert index.guid_of(1) == "guid-b"
+
+
+def test_guid_id_arrays():
+    index = GuidIndex(["guid-a", "guid-b", "guid-c"])
+    ids = index.ids(["guid-c", "unknown", "guid-a"])
+    assert ids.dtype == GUID_ID_DTYPE
+    assert ids.tolist() == [2, 0]
+    assert index.guids(ids) == ["guid-c", "guid-a"]
+    assert index.ids([]).tolist() == []
+
+
+def test_pickle_roundtrip():
+    for guids in ([], ["guid-a", "guid-b"]):
+        index = pickle.loads(pickle.dumps(GuidIndex(guids)))
+        assert index.guids(range(len(index))) == guids
+        assert all(index.id_of(g) == i for i, g in enumerate(guids))
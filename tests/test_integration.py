@@ -197,6 +197,18 @@ def test_locale_recommendation(client, locale_recommendation_manager):
     assert response.data == b'{"results": []}'
 
 
+def test_seeded_recommendation_etag(client, static_recommendation_manager, monkeypatch):
+    monkeypatch.setattr(AppSettings, "TAAR_SEEDED_RANDOMIZATION", True)
+
+    url = url_for("recommendations", hashed_client_id=hasher(uuid.uuid4()))
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
 def test_platform_recommendation(client, platform_recommendation_manager):
     uri = url_for("recommendations", hashed_client_id=hasher(uuid.uuid4())) + "?platform=WOW64"
     response = client.post(uri)
@@ -0,0 +1,58 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import io
+import json
+
+import pytest
+
+from taar.recommenders.json_stream import iter_json_array_items, iter_json_object_items
+
+DOC = {
+    "guid-1": {"guid-2": 1000, "guid-3": 12345678, "guid-4": 0.25},
+    "guid-é": {"guid-1": -7, "nested": [1, [2, {"x": None}], "s,]}"]},
+    "empty": {},
+    "big": 123456789012345678901234567890,
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 16])
+def test_object_items(chunk_size):
+    payload = json.dumps(DOC, indent=2)
+    items = list(iter_json_object_items(io.StringIO(payload), chunk_size=chunk_size))
+    assert items == list(DOC.items())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 16])
+def test_array_items(chunk_size):
+    doc = [{"a": 1}, 2, "three", [4.5, 6e10], None, True]
+    payload = json.dumps(doc)
+    assert list(iter_json_array_items(io.StringIO(payload), chunk_size=chunk_size)) == doc
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 12))
+def test_numbers_split_across_chunks(chunk_size):
+    payload = '{"a": 1.5, "b": 2, "c": 1e5, "d": -2.5E-3, "e": 10.25e+2, "f": [3.0, 7e1]}'
+    items = list(iter_json_object_items(io.StringIO(payload), chunk_size=chunk_size))
+    assert items == list(json.loads(payload).items())
+
+    payload = "[1.5, 2e3, -0.125, 4E+2, 12345.5]"
+    items = list(iter_json_array_items(io.StringIO(payload), chunk_size=chunk_size))
+    assert items == json.loads(payload)
+
+
+def test_empty_containers():
+    assert list(iter_json_object_items(io.StringIO(" { } "))) == []
+    assert list(iter_json_array_items(io.StringIO("[]"))) == []
+
+
+def test_malformed_documents():
+    with pytest.raises(ValueError):
+        list(iter_json_object_items(io.StringIO("[1, 2]")))
+
+    with pytest.raises(ValueError):
+        list(iter_json_object_items(io.StringIO('{"a": 1 "b": 2}')))
+
+    with pytest.raises(ValueError):
+        list(iter_json_array_items(io.StringIO('[1, "unterminated'), chunk_size=4))
@@ -2,9 +2,23 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from taar.profile_fetcher import ProfileFetcher
+from taar.client_profile import ClientProfile
+from taar.profile_fetcher import PROFILE_UNAVAILABLE, ProfileFetcher
 from taar.profile_fetcher import BigTableProfileController
+from taar.profile_fetcher import InMemoryProfileController
+from taar.profile_fetcher import SQLiteProfileController
+from taar.profile_fetcher import build_profile_controller
+from taar.profile_codec import (
+    DerivedProfile,
+    decode_profile,
+    derive_profile,
+    encode_binary_profile,
+    encode_profile,
+)
+from taar.settings import AppSettings
 from google.cloud import bigtable
+from markus import INCR
+from markus.testing import MetricsMock
 import copy
 import json
 import zlib
@@ -70,6 +84,21 @@ def test_profile_fetcher_returns_dict(test_ctx):
     assert fetcher.get("random-client-id") == MOCK_DATA["expected_result"]
 
 
+def test_profile_fetcher_returns_client_profile(test_ctx):
+    fetcher = ProfileFetcher(test_ctx)
+    fetcher.set_client(MockProfileController(MOCK_DATA["profile"]))
+
+    profile = fetcher.get("random-client-id")
+    assert isinstance(profile, ClientProfile)
+    assert profile.installed_addon_set == set(
+        MOCK_DATA["expected_result"]["installed_addons"]
+    )
+
+    # Cached copies don't leak changes back into the cache
+    profile["locale"] = "en-US"
+    assert fetcher.get("random-client-id")["locale"] == "it-IT"
+
+
 def test_dont_crash_without_active_addons(test_ctx):
     mock_data = copy.deepcopy(MOCK_DATA["profile"])
     del mock_data["active_addons"]
@@ -99,7 +128,7 @@ def test_crashy_profile_controller(test_ctx, monkeypatch):
     pc = BigTableProfileController(
         test_ctx, "mock_project_id", "mock_instance_id", "mock_table_id"
     )
-    assert pc.get_client_profile("exception_raising_client_id") is None
+    assert pc.get_client_profile("exception_raising_client_id") is PROFILE_UNAVAILABLE
 
 
 def test_profile_controller(test_ctx, monkeypatch):
@@ -175,3 +204,315 @@ def test_profile_controller_no_user(test_ctx, monkeypatch):
     )
     jdata = pc.get_client_profile("a_mock_client")
     assert jdata is None
+
+
+class CountingProfileController(MockProfileController):
+    calls = 0
+
+    def get_client_profile(self, client_id):
+        self.calls += 1
+        return self._profile
+
+
+def test_profile_fetcher_caches_profiles(test_ctx):
+    controller = CountingProfileController(MOCK_DATA["profile"])
+    fetcher = ProfileFetcher(test_ctx)
+    fetcher.set_client(controller)
+
+    with MetricsMock() as mm:
+        first = fetcher.get("random-client-id")
+        # Annotating the returned profile must not leak into the cache
+        first["locale"] = "xx-XX"
+
+        assert fetcher.get("random-client-id") == MOCK_DATA["expected_result"]
+        assert controller.calls == 1
+
+        assert mm.has_record(INCR, stat="taar.profile_cache_miss")
+        assert mm.has_record(INCR, stat="taar.profile_cache_hit")
+
+
+def test_profile_fetcher_negative_cache(test_ctx, monkeypatch):
+    monkeypatch.setattr(AppSettings, "PROFILE_NEGATIVE_CACHE_TTL", 0)
+
+    controller = CountingProfileController(None)
+    fetcher = ProfileFetcher(test_ctx)
+    fetcher.set_client(controller)
+
+    # A zero TTL expires missing profiles immediately
+    assert fetcher.get("missing-client-id") is None
+    assert fetcher.get("missing-client-id") is None
+    assert controller.calls == 2
+
+    monkeypatch.setattr(AppSettings, "PROFILE_NEGATIVE_CACHE_TTL", 60)
+    with MetricsMock() as mm:
+        assert fetcher.get("missing-client-id") is None
+        assert fetcher.get("missing-client-id") is None
+        assert controller.calls == 3
+        assert mm.has_record(INCR, stat="taar.profile_cache_negative_hit")
+
+
+def test_profile_fetcher_does_not_cache_errors(test_ctx):
+    controller = CountingProfileController(PROFILE_UNAVAILABLE)
+    fetcher = ProfileFetcher(test_ctx)
+    fetcher.set_client(controller)
+
+    with MetricsMock() as mm:
+        assert fetcher.get("random-client-id") is None
+        assert mm.has_record(INCR, stat="taar.profile_fetch_error")
+
+    # The next request reads the profile again
+    controller._profile = MOCK_DATA["profile"]
+    assert fetcher.get("random-client-id") == MOCK_DATA["expected_result"]
+    assert controller.calls == 2
+
+
+def test_profile_fetcher_get_many_does_not_cache_errors(test_ctx):
+    class FailingBatchController(CountingProfileController):
+        def get_client_profiles(self, client_ids):
+            for client_id in client_ids:
+                yield client_id, PROFILE_UNAVAILABLE
+
+    controller = FailingBatchController(MOCK_DATA["profile"])
+    fetcher = ProfileFetcher(test_ctx)
+    fetcher.set_client(controller)
+
+    assert dict(fetcher.get_many(["random-client-id"])) == {"random-client-id": None}
+    assert fetcher.get("random-client-id") == MOCK_DATA["expected_result"]
+    assert controller.calls == 1
+
+
+def test_set_client_clears_profile_cache(test_ctx):
+    fetcher = ProfileFetcher(test_ctx)
+    fetcher.set_client(MockProfileController(MOCK_DATA["profile"]))
+    assert fetcher.get("random-client-id") is not None
+
+    fetcher.set_client(MockProfileController(None))
+    assert fetcher.get("random-client-id") is None
+
+
+def test_in_memory_profile_controller(test_ctx):
+    pc = InMemoryProfileController(test_ctx)
+    for i in range(3):
+        profile = copy.deepcopy(MOCK_DATA["profile"])
+        profile["client_id"] = "client-%d" % i
+        pc.set_client_profile(profile)
+
+    assert pc.get_client_profile("client-1")["client_id"] == "client-1"
+    assert pc.get_client_profile("no-such-client") is None
+
+    results = list(pc.get_client_profiles(["client-2", "no-such-client", "client-0"]))
+    assert [client_id for (client_id, _) in results] == [
+        "client-2",
+        "client-0",
+        "no-such-client",
+    ]
+    assert results[0][1]["client_id"] == "client-2"
+    assert results[-1][1] is None
+
+
+def test_profile_controller_batch_read(test_ctx, monkeypatch):
+    stored = {}
+    for client_id in ["client-a", "client-b"]:
+        profile = {"client_id": client_id}
+        stored[client_id.encode("utf8")] = zlib.compress(json.dumps(profile).encode("utf8"))
+
+    def mock_bigtable_client(*args, **kwargs):
+        class MockRow:
+            def __init__(self, row_key):
+                self.row_key = row_key
+                cell = MagicMock()
+                cell.value = stored[row_key]
+                self.cells = {"profile": {b"payload": [cell]}}
+
+        class MockTable:
+            def __init__(self, table_id):
+                pass
+
+            def read_rows(self, row_set, filter_):
+                for row_key in sorted(stored.keys()):
+                    yield MockRow(row_key)
+
+        class MockInstance:
+            def table(self, table_id):
+                return MockTable(table_id)
+
+        class MockClient:
+            def instance(self, *args, **kwargs):
+                return MockInstance(*args, **kwargs)
+
+        return MockClient
+
+    monkeypatch.setattr(bigtable, "Client", mock_bigtable_client)
+
+    pc = BigTableProfileController(
+        test_ctx, "mock_project_id", "mock_instance_id", "mock_table_id"
+    )
+    results = dict(pc.get_client_profiles(["client-a", "client-b", "client-c"]))
+    assert results == {
+        "client-a": {"client_id": "client-a"},
+        "client-b": {"client_id": "client-b"},
+        "client-c": None,
+    }
+
+
+def test_profile_controller_batch_read_error(test_ctx, monkeypatch):
+    payload = zlib.compress(json.dumps({"client_id": "client-a"}).encode("utf8"))
+
+    def mock_bigtable_client(*args, **kwargs):
+        class MockTable:
+            def __init__(self, table_id):
+                pass
+
+            def read_rows(self, row_set, filter_):
+                row = MagicMock()
+                row.row_key = b"client-a"
+                cell = MagicMock()
+                cell.value = payload
+                row.cells = {"profile": {b"payload": [cell]}}
+                yield row
+                raise IOError("stream reset")
+
+        class MockInstance:
+            def table(self, table_id):
+                return MockTable(table_id)
+
+        class MockClient:
+            def instance(self, *args, **kwargs):
+                return MockInstance(*args, **kwargs)
+
+        return MockClient
+
+    monkeypatch.setattr(bigtable, "Client", mock_bigtable_client)
+
+    pc = BigTableProfileController(
+        test_ctx, "mock_project_id", "mock_instance_id", "mock_table_id"
+    )
+    results = dict(pc.get_client_profiles(["client-a", "client-b"]))
+    assert results == {
+        "client-a": {"client_id": "client-a"},
+        "client-b": PROFILE_UNAVAILABLE,
+    }
+
+
+def test_profile_fetcher_get_many(test_ctx):
+    pc = InMemoryProfileController(test_ctx)
+    profile = copy.deepcopy(MOCK_DATA["profile"])
+    profile["client_id"] = "random-client-id"
+    pc.set_client_profile(profile)
+
+    fetcher = ProfileFetcher(test_ctx)
+    fetcher.set_client(pc)
+
+    results = dict(fetcher.get_many(["random-client-id", "missing-client-id"]))
+    assert results["random-client-id"] == MOCK_DATA["expected_result"]
+    assert results["missing-client-id"] is None
+
+    # Both results are now served from the profile cache
+    assert fetcher.get("random-client-id") == MOCK_DATA["expected_result"]
+    assert fetcher.get("missing-client-id") is None
+
+
+def test_profile_controller_reuses_table_handles(test_ctx, monkeypatch):
+    tables_created = []
+
+    def mock_bigtable_client(*args, **kwargs):
+        class MockTable:
+            def __init__(self, table_id):
+                tables_created.append(self)
+                self.reads = 0
+
+            def read_row(self, *args, **kwargs):
+                self.reads += 1
+                return None
+
+        class MockInstance:
+            def table(self, table_id):
+                return MockTable(table_id)
+
+        class MockClient:
+            def instance(self, *args, **kwargs):
+                return MockInstance(*args, **kwargs)
+
+        return MockClient
+
+    monkeypatch.setattr(bigtable, "Client", mock_bigtable_client)
+
+    pc = BigTableProfileController(
+        test_ctx, "mock_project_id", "mock_instance_id", "mock_table_id", pool_size=2
+    )
+    for i in range(10):
+        pc.get_client_profile("a_mock_client")
+
+    # Table handles are built once and reads are spread over the pool
+    assert len(tables_created) == 2
+    assert [t.reads for t in tables_created] == [5, 5]
+
+
+def test_binary_profile_roundtrip():
+    derived = derive_profile(MOCK_DATA["profile"])
+    value = encode_binary_profile(derived)
+
+    decoded = decode_profile(value)
+    assert isinstance(decoded, DerivedProfile)
+    assert decoded == derived
+
+    # The binary record only keeps the derived fields
+    assert len(value) < len(encode_profile(MOCK_DATA["profile"]))
+
+
+def test_binary_profile_keeps_missing_values():
+    derived = derive_profile({"city": None, "subsession_length": None})
+    decoded = decode_profile(encode_binary_profile(derived))
+    assert decoded["geo_city"] is None
+    assert decoded["subsession_length"] is None
+    assert decoded["installed_addons"] == []
+
+
+def test_profile_fetcher_reads_binary_and_legacy_profiles(test_ctx):
+    legacy = InMemoryProfileController(test_ctx)
+    binary = InMemoryProfileController(test_ctx, binary_profiles=True)
+
+    profile = copy.deepcopy(MOCK_DATA["profile"])
+    profile["client_id"] = "random-client-id"
+    for pc in [legacy, binary]:
+        pc.set_client_profile(profile)
+
+        fetcher = ProfileFetcher(test_ctx)
+        fetcher.set_client(pc)
+        assert fetcher.get("random-client-id") == MOCK_DATA["expected_result"]
+
+
+def test_sqlite_profile_controller(test_ctx, tmpdir):
+    pc = SQLiteProfileController(test_ctx, str(tmpdir.join("profiles.sqlite3")))
+    pc.create_table()
+
+    profile = copy.deepcopy(MOCK_DATA["profile"])
+    profiles = [dict(profile, client_id=f"client-{i}") for i in range(3)]
+    assert pc.set_client_profiles(profiles) == []
+
+    assert pc.get_client_profile("client-1") == profiles[1]
+    assert pc.get_client_profile("no-such-client") is None
+
+    results = dict(pc.get_client_profiles(["client-0", "no-such-client", "client-2"]))
+    assert results == {
+        "client-0": profiles[0],
+        "client-2": profiles[2],
+        "no-such-client": None,
+    }
+
+
+def test_profile_fetcher_sqlite_backend(test_ctx, tmpdir, monkeypatch):
+    path = str(tmpdir.join("profiles.sqlite3"))
+    monkeypatch.setattr(AppSettings, "PROFILE_BACKEND", "sqlite")
+    monkeypatch.setattr(AppSettings, "PROFILE_SQLITE_PATH", path)
+
+    controller = build_profile_controller(test_ctx, binary_profiles=True)
+    assert isinstance(controller, SQLiteProfileController)
+    controller.create_table()
+    controller.set_client_profile(
+        dict(MOCK_DATA["profile"], client_id="random-client-id")
+    )
+
+    fetcher = ProfileFetcher(test_ctx)
+    assert fetcher.get("random-client-id") == MOCK_DATA["expected_result"]
+    assert fetcher.get("missing-client-id") is None
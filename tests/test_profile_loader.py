@@ -0,0 +1,176 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import gzip
+import json
+import threading
+
+import mock
+
+from google.cloud import bigtable
+
+from taar.profile_fetcher import BigTableProfileController, InMemoryProfileController
+from taar.profile_loader import (
+    LoadStats,
+    batched,
+    iter_ndjson_profiles,
+    load_profiles,
+    open_profile_dump,
+)
+
+
+def make_profiles(n):
+    return [
+        {"client_id": f"client-{i}", "locale": "en-US", "active_addons": []}
+        for i in range(n)
+    ]
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
+
+
+def test_iter_ndjson_profiles_skips_blank_lines(tmpdir):
+    profiles = make_profiles(3)
+    path = str(tmpdir.join("profiles.json.gz"))
+    with gzip.open(path, "wt") as fout:
+        for profile in profiles:
+            fout.write(json.dumps(profile) + "\n\n")
+
+    with open_profile_dump(path) as lines:
+        assert list(iter_ndjson_profiles(lines)) == profiles
+
+
+def test_malformed_lines_are_skipped(test_ctx):
+    profiles = make_profiles(3)
+    lines = [
+        json.dumps(profiles[0]),
+        '{"client_id": "client-x", ',
+        json.dumps(profiles[1]),
+        "not json",
+        "",
+        json.dumps(profiles[2]),
+    ]
+
+    controller = InMemoryProfileController(test_ctx)
+    stats = LoadStats()
+    logger = mock.MagicMock()
+    load_profiles(
+        controller, iter_ndjson_profiles(lines, stats=stats, logger=logger), batch_size=2, stats=stats
+    )
+
+    assert stats.written == 3
+    assert stats.failed == 2
+    assert "line 2" in logger.exception.call_args_list[0][0][0]
+    assert "line 4" in logger.exception.call_args_list[1][0][0]
+    assert controller.get_client_profile("client-2") is not None
+
+
+def test_load_profiles(test_ctx):
+    controller = InMemoryProfileController(test_ctx)
+    seen = []
+
+    stats = load_profiles(
+        controller, iter(make_profiles(25)), batch_size=10, progress=seen.append
+    )
+
+    assert stats.written == 25
+    assert stats.failed == 0
+    assert stats.batches == 3
+    assert len(seen) == 3
+    assert controller.get_client_profile("client-24")["locale"] == "en-US"
+
+
+def test_load_profiles_bounds_concurrency(test_ctx):
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0}
+
+    class SlowController:
+        def set_client_profiles(self, client_profiles):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            threading.Event().wait(0.01)
+            with lock:
+                state["active"] -= 1
+            return [client_profiles[0]["client_id"]]
+
+    stats = load_profiles(
+        SlowController(), make_profiles(100), batch_size=5, concurrency=3
+    )
+
+    assert state["peak"] <= 3
+    assert stats.batches == 20
+    assert stats.failed == 20
+    assert stats.written == 80
+
+
+def test_load_profiles_continues_after_failed_batch(test_ctx):
+    class FlakyController(InMemoryProfileController):
+        calls = 0
+
+        def set_client_profiles(self, client_profiles):
+            self.calls += 1
+            if self.calls == 2:
+                raise IOError("mutate_rows failed")
+            return super().set_client_profiles(client_profiles)
+
+    controller = FlakyController(test_ctx)
+    logger = mock.MagicMock()
+    stats = load_profiles(
+        controller, make_profiles(25), batch_size=10, concurrency=1, logger=logger
+    )
+
+    assert stats.batches == 3
+    assert stats.failed == 10
+    assert stats.written == 15
+    assert logger.exception.called
+    assert controller.get_client_profile("client-24") is not None
+    assert controller.get_client_profile("client-15") is None
+
+
+def test_bigtable_set_client_profiles(test_ctx, monkeypatch):
+    mutations = []
+
+    class MockStatus:
+        def __init__(self, code):
+            self.code = code
+
+    class MockRow:
+        def __init__(self, row_key):
+            self.row_key = row_key
+
+        def set_cell(self, *args, **kwargs):
+            pass
+
+    class MockTable:
+        def direct_row(self, row_key):
+            return MockRow(row_key)
+
+        def mutate_rows(self, rows):
+            mutations.append([row.row_key for row in rows])
+            # Fail the last row
+            return [MockStatus(0)] * (len(rows) - 1) + [MockStatus(14)]
+
+    class MockInstance:
+        def table(self, table_id):
+            return MockTable()
+
+    class MockClient:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def instance(self, *args, **kwargs):
+            return MockInstance()
+
+    monkeypatch.setattr(bigtable, "Client", MockClient)
+
+    pc = BigTableProfileController(
+        test_ctx, "mock_project_id", "mock_instance_id", "mock_table_id"
+    )
+    failed = pc.set_client_profiles(make_profiles(3))
+
+    assert mutations == [[b"client-0", b"client-1", b"client-2"]]
+    assert failed == ["client-2"]
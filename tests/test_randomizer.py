@@ -5,6 +5,7 @@ selection based on probability,
 
 from taar.recommenders.randomizer import reorder_guids
 from taar.recommenders.randomizer import in_experiment
+from taar.recommenders.randomizer import seeded_rng
 
 import numpy as np
 from collections import Counter
@@ -46,6 +47,52 @@ def test_reorder_guids():
     assert best_result == ["guid4", "guid3", "guid2", "guid1"]
 
 
+def test_reorder_guids_matches_sequential_choice():
+    """
+    The exponential keys sampler must produce the same distribution
+    as sequential weighted selection with numpy.random.choice
+    """
+    guid_weight_tuples = [
+        ("guid0", -0.60),
+        ("guid1", -0.30),
+        ("guid2", 0.09),
+        ("guid3", 0.30),
+        ("guid4", 2.5),
+        ("guid5", 1.2),
+    ]
+    guids = [guid for (guid, weight) in guid_weight_tuples]
+    weights = np.array([weight for (guid, weight) in guid_weight_tuples])
+    scaled_weights = weights - np.min(weights) + np.finfo(float).eps
+    probabilities = scaled_weights / np.sum(scaled_weights)
+
+    rng = np.random.default_rng(42)
+    trials = 20000
+    limit = 3
+
+    expected = np.zeros((limit, len(guids)))
+    observed = np.zeros((limit, len(guids)))
+    for i in range(trials):
+        choices = rng.choice(len(guids), size=limit, replace=False, p=probabilities)
+        expected[np.arange(limit), choices] += 1
+
+        reordered = reorder_guids(guid_weight_tuples, size=limit, rng=rng)
+        positions = [guids.index(guid) for (guid, weight) in reordered]
+        observed[np.arange(limit), positions] += 1
+
+    # The first pick is drawn with exactly the normalized weights
+    assert np.allclose(observed[0] / trials, probabilities, atol=0.015)
+
+    # Every position of the output should have the same marginal
+    # distribution as sequential selection
+    assert np.allclose(observed / trials, expected / trials, atol=0.02)
+
+
+def test_reorder_guids_full_permutation():
+    guid_weight_tuples = [("guid%d" % i, float(i)) for i in range(10)]
+    reordered = reorder_guids(guid_weight_tuples)
+    assert sorted(reordered) == sorted(guid_weight_tuples)
+
+
 def test_reorder_guids_size_less_than_limit():
     guid_weight_tuples = [
         ("guid0", -0.60),
@@ -57,6 +104,46 @@ def test_reorder_guids_size_less_than_limit():
     assert len(reordered) == 2
 
 
+def test_seeded_rng_is_stable_within_bucket():
+    guid_weight_tuples = [("guid%d" % i, float(i)) for i in range(20)]
+
+    def reorder(client_id, generation, now):
+        rng = seeded_rng(client_id, generation, bucket_seconds=3600, now=now)
+        return reorder_guids(guid_weight_tuples, size=10, rng=rng)
+
+    baseline = reorder("client-1", "1:100", now=7200)
+
+    # Same client, generation and time bucket
+    assert reorder("client-1", "1:100", now=7200 + 3599) == baseline
+
+    # Any change to the seed material yields a different stream
+    assert reorder("client-1", "1:100", now=7200 + 3600) != baseline
+    assert reorder("client-1", "2:200", now=7200) != baseline
+    assert reorder("client-2", "1:100", now=7200) != baseline
+
+
+def test_seeded_rng_keeps_weighted_distribution():
+    guid_weight_tuples = [
+        ("guid0", -0.60),
+        ("guid1", -0.30),
+        ("guid2", 0.09),
+        ("guid3", 0.30),
+        ("guid4", 2.5),
+    ]
+
+    results = []
+    limit = 4
+    for i in range(200):
+        rng = seeded_rng("client-%d" % i, "1:100", bucket_seconds=0)
+        results.append(reorder_guids(guid_weight_tuples, size=limit, rng=rng))
+
+    best_result = []
+    for i in range(limit):
+        best_result.append(most_frequent([row[i] for row in results])[0])
+
+    assert best_result == ["guid4", "guid3", "guid2", "guid1"]
+
+
 def test_experimental_branch_guid():
     """
     Test the experimental cutoff selection code.
@@ -2,6 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from taar.interfaces import ITAARCache
 from taar.recommenders.recommendation_manager import RecommendationManager
 from taar.recommenders.base_recommender import AbstractRecommender
 
@@ -15,16 +16,21 @@ from .noop_fixtures import (
 from .mocks import MockRecommenderFactory
 
 import operator
+import threading
+import time
 from functools import reduce
 
 import numpy as np
-from markus import TIMING
+from markus import INCR, TIMING
 from markus.testing import MetricsMock
 
 import mock
 import contextlib
 import fakeredis
+from taar.recommenders.cache import empty_cache_context
 from taar.recommenders.redis_cache import TAARCacheRedis
+from taar.recommenders.result_cache import InMemoryResultCache
+from taar.settings import AppSettings
 
 
 @contextlib.contextmanager
@@ -83,7 +89,9 @@ def mock_install_mock_curated_data(ctx):
         ctx["recommender_factory"] = MockRecommenderFactory()
 
         # Initialize redis
-        TAARCacheRedis.get_instance(ctx).safe_load_data()
+        cache = TAARCacheRedis.get_instance(ctx)
+        cache.safe_load_data()
+        ctx[ITAARCache] = cache
 
         yield stack
 
@@ -123,15 +131,15 @@ def test_simple_recommendation(test_ctx):
 
     with mock_install_mock_curated_data(test_ctx):
         EXPECTED_RESULTS = [
-            ("def", 3320.0),
-            ("klm", 409.99999999999994),
+            ("ghi", 3430.0),
+            ("jkl", 400.0),
             ("hij", 3100.0),
             ("ijk", 3200.0),
-            ("ghi", 3430.0),
             ("lmn", 420.0),
-            ("jkl", 400.0),
-            ("abc", 23.0),
+            ("klm", 409.99999999999994),
+            ("def", 3320.0),
             ("fgh", 22.0),
+            ("abc", 23.0),
             ("efg", 21.0)
         ]
 
@@ -197,3 +205,181 @@ def test_experimental_randomization(test_ctx):
         )
 
         assert len(rand_list) == len(raw_list)
+
+
+def test_result_cache_skips_profile_fetch(test_ctx):
+    with mock_install_mock_curated_data(test_ctx):
+
+        class CountingProfileFetcher:
+            calls = 0
+
+            def get(self, client_id):
+                self.calls += 1
+                return {"client_id": client_id}
+
+        fetcher = CountingProfileFetcher()
+        test_ctx["profile_fetcher"] = fetcher
+        test_ctx["result_cache"] = InMemoryResultCache(10, 60)
+
+        manager = RecommendationManager(test_ctx)
+        first = manager.recommend("some_client_id", 10)
+        second = manager.recommend("some_client_id", 10)
+
+        assert fetcher.calls == 1
+        assert sorted(first) == sorted(second)
+
+
+def test_result_cache_invalidated_by_generation(test_ctx):
+    with mock_install_mock_curated_data(test_ctx):
+
+        class CountingProfileFetcher:
+            calls = 0
+
+            def get(self, client_id):
+                self.calls += 1
+                return {"client_id": client_id}
+
+        fetcher = CountingProfileFetcher()
+        test_ctx["profile_fetcher"] = fetcher
+        test_ctx["result_cache"] = InMemoryResultCache(10, 60)
+
+        manager = RecommendationManager(test_ctx)
+        manager.recommend("some_client_id", 10)
+
+        # Reloading the model data switches the cache generation
+        TAARCacheRedis.get_instance(test_ctx).safe_load_data()
+        manager.recommend("some_client_id", 10)
+
+        assert fetcher.calls == 2
+
+
+def test_seeded_randomization_is_stable(test_ctx):
+    with mock_install_mock_curated_data(test_ctx):
+        test_ctx["TAAR_SEEDED_RANDOMIZATION"] = True
+
+        manager = RecommendationManager(test_ctx)
+        first = manager.recommend("some_client_id", 10)
+        for i in range(5):
+            assert manager.recommend("some_client_id", 10) == first
+
+
+def test_profile_fetch_overlaps_cache_read(test_ctx):
+    with mock_install_mock_curated_data(test_ctx):
+        main_thread = threading.get_ident()
+
+        class ThreadRecordingProfileFetcher:
+            thread_ident = None
+
+            def get(self, client_id):
+                self.thread_ident = threading.get_ident()
+                return {"client_id": client_id}
+
+        fetcher = ThreadRecordingProfileFetcher()
+        test_ctx["profile_fetcher"] = fetcher
+
+        manager = RecommendationManager(test_ctx)
+        assert len(manager.recommend("some_client_id", 10)) == 10
+        assert fetcher.thread_ident not in (None, main_thread)
+
+
+def test_slow_profile_fetch_exceeds_deadline(test_ctx):
+    with mock_install_mock_curated_data(test_ctx):
+
+        class SlowProfileFetcher:
+            def get(self, client_id):
+                time.sleep(0.5)
+                return {"client_id": client_id}
+
+        test_ctx["profile_fetcher"] = SlowProfileFetcher()
+        test_ctx["TAAR_REQUEST_TIMEOUT"] = 0.05
+
+        with MetricsMock() as mm:
+            manager = RecommendationManager(test_ctx)
+            assert manager.recommend("some_client_id", 10) == []
+            assert mm.has_record(INCR, stat="taar.request_deadline_exceeded")
+
+
+def test_slow_cache_read_exceeds_deadline(test_ctx):
+    with mock_install_mock_curated_data(test_ctx):
+
+        class StubProfileFetcher:
+            def get(self, client_id):
+                return {"client_id": client_id}
+
+        test_ctx["profile_fetcher"] = StubProfileFetcher()
+        test_ctx["TAAR_REQUEST_TIMEOUT"] = 0.05
+
+        manager = RecommendationManager(test_ctx)
+        cache_context = manager._cache.cache_context
+
+        def slow_cache_context():
+            time.sleep(0.5)
+            return cache_context()
+
+        manager._cache.cache_context = slow_cache_context
+        with MetricsMock() as mm:
+            start_time = time.monotonic()
+            assert manager.recommend("some_client_id", 10) == []
+            assert time.monotonic() - start_time < 0.4
+            assert mm.has_record(INCR, stat="taar.request_deadline_exceeded")
+
+
+def test_io_pool_is_sized_for_the_deadline(test_ctx, monkeypatch):
+    monkeypatch.setattr(AppSettings, "TAAR_IO_THREADS", 8)
+    with mock_install_mock_curated_data(test_ctx):
+        test_ctx["TAAR_REQUEST_TIMEOUT"] = 0
+        assert RecommendationManager(test_ctx)._io_executor._max_workers == 8
+
+        # Each request runs two reads on the pool under a deadline
+        test_ctx["TAAR_REQUEST_TIMEOUT"] = 0.5
+        assert RecommendationManager(test_ctx)._io_executor._max_workers == 16
+
+
+def test_queued_reads_are_cancelled_at_deadline(test_ctx, monkeypatch):
+    monkeypatch.setattr(AppSettings, "TAAR_IO_THREADS", 1)
+    with mock_install_mock_curated_data(test_ctx):
+
+        class SlowProfileFetcher:
+            def get(self, client_id):
+                time.sleep(0.2)
+                return {"client_id": client_id}
+
+        test_ctx["profile_fetcher"] = SlowProfileFetcher()
+        test_ctx["TAAR_REQUEST_TIMEOUT"] = 0.05
+
+        manager = RecommendationManager(test_ctx)
+        cache_reads = []
+        cache_context = manager._cache.cache_context
+
+        def counting_cache_context():
+            cache_reads.append(1)
+            return cache_context()
+
+        manager._cache.cache_context = counting_cache_context
+
+        # With the other IO thread busy, the cache read is queued
+        # behind the profile fetch and dropped once the deadline passes
+        manager._io_executor.submit(time.sleep, 0.2)
+        assert manager.recommend("some_client_id", 10) == []
+        manager._io_executor.shutdown(wait=True)
+        assert cache_reads == []
+
+
+def test_empty_results_while_cache_not_ready(test_ctx):
+    class NotReadyCache:
+        def cache_context(self):
+            return empty_cache_context()
+
+        def cache_generation(self):
+            return None
+
+    class StubProfileFetcher:
+        def get(self, client_id):
+            return {"client_id": client_id}
+
+    with mock_install_mock_curated_data(test_ctx):
+        test_ctx["profile_fetcher"] = StubProfileFetcher()
+        manager = RecommendationManager(test_ctx)
+        manager._cache = NotReadyCache()
+
+        assert manager.recommend("some_client_id", 10) == []
@@ -0,0 +1,70 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import fakeredis
+
+from taar.utils import LRUTTLCache
+from taar.recommenders.result_cache import (
+    InMemoryResultCache,
+    RedisResultCache,
+    result_cache_key,
+)
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUTTLCache(2, 60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+
+    assert lru.get("b") is None
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+
+
+def test_lru_entries_expire():
+    timer = FakeTimer()
+    lru = LRUTTLCache(10, 60, timer=timer)
+    lru.set("a", 1)
+    lru.set("b", 2, ttl=5)
+
+    timer.now = 10
+    assert lru.get("a") == 1
+    assert lru.get("b") is None
+
+    timer.now = 61
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_key_includes_generation():
+    assert result_cache_key("1:123", "abc") != result_cache_key("2:456", "abc")
+    assert result_cache_key("1:123", "abc", "en-US") != result_cache_key("1:123", "abc")
+
+
+def test_in_memory_result_cache():
+    cache = InMemoryResultCache(10, 60)
+    assert cache.get("key") is None
+    cache.set("key", [("guid-1", 0.5), ("guid-2", 0.25)])
+    assert cache.get("key") == [("guid-1", 0.5), ("guid-2", 0.25)]
+
+
+def test_redis_result_cache_roundtrip():
+    rcon = fakeredis.FakeStrictRedis(db=3)
+    rcon.flushdb()
+    cache = RedisResultCache(rcon, 60)
+    assert cache.get("key") is None
+
+    cache.set("key", [("guid-1", 0.5), ("guid-2", 0.25)])
+    assert cache.get("key") == [("guid-1", 0.5), ("guid-2", 0.25)]
+    assert 0 < rcon.ttl("key") <= 60
@@ -9,6 +9,7 @@ import logging
 import numpy as np
 import scipy.stats
 
+from taar.client_profile import ClientProfile
 from taar.interfaces import ITAARCache
 from taar.recommenders.similarity_recommender import (
     CATEGORICAL_FEATURES,
@@ -429,3 +430,46 @@ def test_weights_categorical(test_ctx):
         rec1_weight = rec1[1]
 
         assert rec0_weight > rec1_weight > 0
+
+
+def test_client_profile_matches_dict(test_ctx):
+    # A ClientProfile must score exactly like the equivalent dict
+    with mock_install_continuous_data(test_ctx):
+        r = SimilarityRecommender(test_ctx)
+        cache = r._get_cache({})
+
+        client = generate_a_fake_taar_client()
+        profile = ClientProfile(client)
+
+        assert r.can_recommend(profile)
+        np.testing.assert_array_equal(
+            r.compute_clients_dist(client, cache),
+            r.compute_clients_dist(profile, cache),
+        )
+        assert r.recommend(client, 2) == r.recommend(profile, 2)
+
+
+def test_guid_id_scoring_matches_guid_strings(test_ctx):
+    # Scoring with the precomputed donor GUID ids must agree with
+    # grouping the donors' addon GUID strings
+    with mock_install_continuous_data(test_ctx):
+        r = SimilarityRecommender(test_ctx)
+        cache = r._get_cache({})
+        assert cache["donor_addon_ids"] is not None
+
+        # The donors' addon GUID lists are only held as ids
+        assert all("active_addons" not in d for d in cache["donors_pool"])
+        index = cache["donor_guid_index"]
+        offsets = cache["donor_addon_offsets"]
+        donors_pool = [
+            dict(d, active_addons=index.guids(cache["donor_addon_ids"][offsets[i]:offsets[i + 1]]))
+            for i, d in enumerate(cache["donors_pool"])
+        ]
+        string_cache = dict(cache, donors_pool=donors_pool, donor_addon_ids=None)
+        client = generate_a_fake_taar_client()
+
+        by_id = r.recommend(client, 10, extra_data={"cache": cache})
+        by_guid = r.recommend(client, 10, extra_data={"cache": string_cache})
+
+        assert [guid for guid, _ in by_id] == [guid for guid, _ in by_guid]
+        np.testing.assert_allclose([w for _, w in by_id], [w for _, w in by_guid])
@@ -0,0 +1,98 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import mock
+import pytest
+
+from taar.recommenders import sorted_key_store
+from taar.recommenders.sorted_key_store import SortedKeyStore, write_sorted_key_store
+
+DATA = {
+    "coinstall|guid-1": {"guid-2": 10, "guid-3": 5},
+    "coinstall|guid-2": {"guid-1": 10},
+    "ranking|guid-1": 400,
+    "ranking|été@example.com": 3,
+    "normdata_guid_row_norm_prefix|guid-1": [0.5, 0.25],
+    "min_installs|": 12.5,
+}
+
+
+@pytest.fixture
+def store(tmpdir):
+    path = str(tmpdir.join("kv"))
+    write_sorted_key_store(path, DATA.items())
+    return SortedKeyStore(path)
+
+
+def test_lookups(store):
+    for key, value in DATA.items():
+        assert store[key] == value
+        assert key in store
+        assert store.get(key) == value
+
+    assert store.get("ranking|missing") is None
+    assert store.get("coinstall|guid-0", {}) == {}
+    assert "ranking|guid-10" not in store
+    assert "zzz" not in store
+    assert "" not in store
+    assert 42 not in store
+    with pytest.raises(KeyError):
+        store["ranking|missing"]
+
+
+def test_iteration_is_sorted(store):
+    assert len(store) == len(DATA)
+    assert list(store) == sorted(DATA, key=lambda k: k.encode("utf8"))
+    assert dict(store.items()) == DATA
+
+
+def test_values_are_decoded_once(store):
+    value = store["coinstall|guid-1"]
+    assert store["coinstall|guid-1"] is value
+    assert "ranking|missing" not in store
+    assert "ranking|missing" not in store
+
+    info = store._lookup.cache_info()
+    assert info.misses == 2
+    assert info.hits == 2
+
+
+def test_decoded_values_are_bounded(tmpdir):
+    path = str(tmpdir.join("kv"))
+    write_sorted_key_store(path, DATA.items())
+    store = SortedKeyStore(path, cache_size=2)
+
+    for key in DATA:
+        assert store[key] == DATA[key]
+    assert store._lookup.cache_info().currsize == 2
+
+
+def test_repeated_lookups_are_cache_hits(tmpdir):
+    path = str(tmpdir.join("kv"))
+    write_sorted_key_store(
+        path, ((f"coinstall|guid-{i}", {"guid-0": i}) for i in range(10000))
+    )
+    store = SortedKeyStore(path)
+    keys = [f"coinstall|guid-{i}" for i in range(0, 10000, 10)]
+    for key in keys:
+        store[key]
+    assert store._lookup.cache_info().misses == len(keys)
+
+    # Repeated lookups skip the key search and unpickling
+    with mock.patch.object(sorted_key_store.pickle, "loads", side_effect=AssertionError("unpickled")):
+        for key in keys:
+            assert store[key] == {"guid-0": int(key.split("-")[-1])}
+    info = store._lookup.cache_info()
+    assert info.hits == len(keys)
+    assert info.misses == len(keys)
+
+
+def test_hash_collisions(tmpdir, monkeypatch):
+    monkeypatch.setattr(sorted_key_store, "_key_hash", lambda encoded: len(encoded))
+    path = str(tmpdir.join("kv"))
+    write_sorted_key_store(path, DATA.items())
+    store = SortedKeyStore(path)
+
+    assert dict(store.items()) == DATA
+    assert "ranking|guid-2" not in store